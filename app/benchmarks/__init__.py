@@ -0,0 +1 @@
+"""Benchmarks of the bot hot paths, run them as modules from the app folder"""
@@ -0,0 +1,62 @@
+"""Benchmark of a shared Database against constructing a new Database for every call"""
+import os
+import tempfile
+from time import perf_counter
+from modules.database_control import Database
+
+ITERATIONS = 500
+PEOPLE = 50
+
+
+def fill_database(database_path: str) -> None:
+    """
+    Fills a database with people that will be looked up
+
+    :param database_path: path to a database
+    :return:
+    """
+    database = Database(database_path)
+    for i in range(PEOPLE):
+        database.insert_person('handle_' + str(i))
+    database.stop()
+
+
+def per_call(database_path: str) -> float:
+    """
+    Looks people up the way bot did it before, with a new Database for every call
+
+    :param database_path: path to a database
+    :return: elapsed seconds
+    """
+    start = perf_counter()
+    for i in range(ITERATIONS):
+        database = Database(database_path)
+        database.find_person('handle_' + str(i % PEOPLE))
+        database.stop()
+    return perf_counter() - start
+
+
+def shared(database_path: str) -> float:
+    """
+    Looks people up through one Database shared by every call
+
+    :param database_path: path to a database
+    :return: elapsed seconds
+    """
+    start = perf_counter()
+    database = Database(database_path)
+    for i in range(ITERATIONS):
+        database.find_person('handle_' + str(i % PEOPLE))
+    database.stop()
+    return perf_counter() - start
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.db')
+        fill_database(path)
+        per_call_time = per_call(path)
+        shared_time = shared(path)
+    print(f"Database per call: {per_call_time:.3f} s ({per_call_time / ITERATIONS * 1000:.3f} ms per lookup)")
+    print(f"Shared Database:   {shared_time:.3f} s ({shared_time / ITERATIONS * 1000:.3f} ms per lookup)")
+    print(f"Speedup: {per_call_time / shared_time:.1f}x")
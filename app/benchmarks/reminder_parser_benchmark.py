@@ -0,0 +1,178 @@
+"""Benchmark of the single-pass reminder parser against the functions it replaced"""
+import datetime
+import re
+from time import perf_counter
+from dateutil.parser import parse
+from modules.bot_get_posts import get_every_from_post, get_time_to_remind_from_post
+from modules.database_control import convert_date
+
+ITERATIONS = 200
+TIME_SEND = '2024-05-22T15:30:07.107Z'
+BOT = '@remind-me-pyt.bsky.social'
+CORPUS = [
+    BOT,
+    BOT + ' ',
+    BOT + ' in 3 days',
+    BOT + ' in 2 weeks',
+    BOT + ' in 1 hour',
+    BOT + ' in 45 minutes',
+    BOT + ' in 1 year',
+    BOT + ' in 10 days please',
+    BOT + ' In 23 days',
+    BOT + ' remind me in 5 hours!',
+    BOT + ' remind me about this in 7',
+    BOT + ' in the morning',
+    BOT + ' 01.06.2025',
+    BOT + ' 1.6.2025',
+    BOT + ' 01.06.2025 15:00',
+    BOT + ' 01/06/2025 at 9:05',
+    BOT + ' remind me on 24.12.2024 at 18:30',
+    BOT + ' 15:00',
+    BOT + ' at 23:59:30',
+    BOT + ' 31.02.2025',
+    BOT + ' on monday',
+    BOT + ' on 3 June 2025',
+    BOT + ' December 24',
+    BOT + ' remind me this, it is important',
+    BOT + ' every day',
+    BOT + ' every 20 minutes in 1 hour',
+    BOT + ' in 1 day every 2 days',
+    BOT + ' remind @friend.bsky.social in 2 days',
+    BOT + ' remind @friend2024.bsky.social and @other.bsky.social in 4 hours',
+    BOT + ' delete',
+    BOT + ' UTC',
+    BOT + ' what is this? #reminder',
+    BOT + ' ping me in 2 weeks about the release',
+    BOT + ' check this in 6 hours :)',
+]
+
+
+def legacy_count_remind(date: str, time_start: str) -> str:
+    """
+    Counts date from a starting date the way bot did it before, adding months past December is wrong
+
+    :param date: number of days, month and so on which must be added
+    :param time_start: starting date
+    :return: new date in string format
+    """
+    date_ret = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if date.split()[1] in ['day', 'days']:
+        date_ret = parse(time_start) + datetime.timedelta(days=int(date.split()[0]))
+    if date.split()[1] in ['month', 'months']:
+        new_month = parse(time_start).month + int(date.split()[0])
+        if new_month < 12:
+            date_ret = parse(time_start).replace(month=new_month)
+        else:
+            date_ret = parse(time_start).replace(month=(new_month % 12 + 1), year=parse(time_start).year + (new_month // 12))
+    if date.split()[1] in ['year', 'years']:
+        date_ret = parse(time_start).replace(year=parse(time_start).year + int(date.split()[0]))
+    if date.split()[1] in ['minute', 'minutes']:
+        date_ret = parse(time_start) + datetime.timedelta(minutes=int(date.split()[0]))
+    if date.split()[1] in ['hour', 'hours']:
+        date_ret = parse(time_start) + datetime.timedelta(hours=int(date.split()[0]))
+    if date.split()[1] in ['week', 'weeks']:
+        date_ret = parse(time_start) + datetime.timedelta(weeks=int(date.split()[0]))
+    return date_ret.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def legacy_get_period(text_origin: str, word: str) -> str:
+    """
+    Gets a period from a given text origin.
+
+    :param text_origin: text from which must be found period
+    :param word: which word must be before period
+    :return: period
+    """
+    punc = '''!()-[]{};:'"\\, <>./?@#$%^&*_~'''
+    text = text_origin
+    for i in punc:
+        text = text.replace(i, ' ')
+    text = re.sub(' +', ' ', text)
+    text_split = text.split(' ')
+    if text.lower().find(word.lower()) != -1:
+        for (i, elem) in enumerate(text_split):
+            if elem.lower() == word.lower() and i + 1 in range(len(text_split)):
+                time = text_split[i + 1]
+                try:
+                    int(time)
+                except ValueError:
+                    return "1 day"
+                item = 'day'
+                if i + 2 in range(len(text_split)):
+                    item = text_split[i + 2]
+                    if item.lower() not in ['day', 'days', 'month', 'months', 'year', 'years',
+                                            'minute', 'minutes', 'hour', 'hours', 'week', 'weeks']:
+                        item = 'day'
+                return str(time) + " " + item
+    return ''
+
+
+def legacy_time_to_remind(text: str, time_send: str) -> str:
+    """
+    Returns date when post must be reminded
+
+    :param text: post message where will be found a period
+    :param time_send: time when post was sent
+    :return: date when post must be reminded
+    """
+    if legacy_get_period(text, 'in') != '':
+        return legacy_count_remind(legacy_get_period(text, 'in'), convert_date(time_send))
+    try:
+        time_send_1 = datetime.datetime.strptime(convert_date(time_send), '%Y-%m-%d %H:%M:%S')
+        parse_time = parse(text, fuzzy=True, default=time_send_1, dayfirst=True).strftime('%Y-%m-%d %H:%M:%S')
+        return parse_time
+    except ValueError:
+        return legacy_count_remind('1 day', convert_date(time_send))
+
+
+def legacy_every(text: str) -> int:
+    """
+    Gets how often post must be reminded
+
+    :param text: post text from which will be found period
+    :return: period in seconds how often post must be reminded
+    """
+    ret = 0
+    try:
+        if legacy_get_period(text, 'every'):
+            text = legacy_get_period(text, 'every')
+            if text.split()[1] in ['day', 'days']:
+                ret = int(text.split()[0]) * 24 * 60 * 60
+            if text.split()[1] in ['month', 'months']:
+                ret = int(text.split()[0]) * 24 * 60 * 60 * 30
+            if text.split()[1] in ['year', 'years']:
+                ret = int(text.split()[0]) * 24 * 60 * 60 * 365
+            if text.split()[1] in ['minute', 'minutes']:
+                ret = int(text.split()[0]) * 60
+            if text.split()[1] in ['hour', 'hours']:
+                ret = int(text.split()[0]) * 60 * 60
+            if text.split()[1] in ['week', 'weeks']:
+                ret = int(text.split()[0]) * 24 * 60 * 60 * 7
+    except ValueError:
+        ret = 0
+    return ret
+
+
+def measure(time_to_remind, every) -> float:
+    """
+    Parses the whole corpus ITERATIONS times
+
+    :param time_to_remind: function that returns a time of a reminder
+    :param every: function that returns how often a reminder repeats
+    :return: elapsed seconds
+    """
+    start = perf_counter()
+    for _ in range(ITERATIONS):
+        for text in CORPUS:
+            time_to_remind(text, TIME_SEND)
+            every(text)
+    return perf_counter() - start
+
+
+if __name__ == '__main__':
+    legacy_time = measure(legacy_time_to_remind, legacy_every)
+    parser_time = measure(get_time_to_remind_from_post, get_every_from_post)
+    texts = ITERATIONS * len(CORPUS)
+    print(f"Legacy functions:     {legacy_time:.3f} s ({legacy_time / texts * 1000000:.1f} us per text)")
+    print(f"Single-pass parser:   {parser_time:.3f} s ({parser_time / texts * 1000000:.1f} us per text)")
+    print(f"Speedup: {legacy_time / parser_time:.1f}x")
@@ -0,0 +1,100 @@
+"""Benchmark of lookups on a synthetic database with the legacy schema and after migrating it to the current one"""
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+from modules.database_control import Database, to_epoch
+
+POSTS = 1_000_000
+PEOPLE = 10_000
+LOOKUPS = 50
+START = to_epoch('2024-01-01 00:00:00')
+
+
+def legacy_time(timestamp: int, seconds=True) -> str:
+    """
+    Formats a time the way the legacy schema stored it
+
+    :param timestamp: unix timestamp
+    :param seconds: whether seconds are stored
+    :return: date in '%Y-%m-%d %H:%M:%S' or '%Y-%m-%d %H:%M' format
+    """
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S' if seconds else '%Y-%m-%d %H:%M')
+
+
+def fill_legacy_database(database_path: str) -> None:
+    """
+    Creates a database with the schema of the shipped database.db and fills it with reminders
+
+    :param database_path: path to a database
+    :return:
+    """
+    connection = sqlite3.connect(database_path)
+    connection.executescript('''
+        CREATE TABLE PEOPLE (ID INTEGER NOT NULL, HANDLE VARCHAR, PRIMARY KEY (ID));
+        CREATE TABLE POSTS (ID INTEGER NOT NULL, TEXT VARCHAR, TIME_TO_REMIND VARCHAR, AUTHOR_REMIND INTEGER, AUTHOR_POST INTEGER,
+                            EVERY_N_SECONDS INTEGER, TIME_SEND_REQUEST VARCHAR, PRIMARY KEY (ID));
+        CREATE TABLE PERSON_POST_MENTION (ID INTEGER NOT NULL, POST_ID INTEGER, PERSON_ID INTEGER, PRIMARY KEY (ID));
+        CREATE TABLE MEDIA (ID INTEGER NOT NULL, PATH VARCHAR, ALT VARCHAR, IS_FOREIGN VARCHAR, TITLE VARCHAR, POST_ID INTEGER,
+                            PRIMARY KEY (ID));
+        CREATE TABLE FACETS (ID INTEGER NOT NULL, BYTE_START INTEGER, BYTE_END INTEGER, TYPE VARCHAR, URI VARCHAR, POST_ID INTEGER,
+                             PRIMARY KEY (ID));
+        CREATE TABLE NOTIFICATIONS (ID INTEGER NOT NULL, CID VARCHAR, PRIMARY KEY (ID));
+    ''')
+    connection.executemany('INSERT INTO PEOPLE (ID, HANDLE) VALUES (?, ?)', ((i, 'handle_' + str(i)) for i in range(1, PEOPLE + 1)))
+    connection.execute('''
+        WITH RECURSIVE N(I) AS (SELECT 1 UNION ALL SELECT I + 1 FROM N WHERE I < ?)
+        INSERT INTO POSTS SELECT I, 'text', strftime('%Y-%m-%d %H:%M', ? + I * 60, 'unixepoch'), I % ? + 1, I % ? + 1, 0,
+                                 strftime('%Y-%m-%d %H:%M:%S', ? + I, 'unixepoch') FROM N
+    ''', (POSTS, START, PEOPLE, PEOPLE, START))
+    connection.execute('INSERT INTO PERSON_POST_MENTION (POST_ID, PERSON_ID) SELECT ID, AUTHOR_REMIND FROM POSTS')
+    connection.commit()
+    connection.close()
+
+
+def lookups(database_path: str, typed: bool) -> dict:
+    """
+    Runs the lookups of the bot against a database
+
+    :param database_path: path to a database
+    :param typed: whether times are stored as unix timestamps
+    :return: dictionary from a lookup to its average time in milliseconds
+    """
+    randomizer = random.Random(0)
+    ids = [randomizer.randint(1, POSTS) for _ in range(LOOKUPS)]
+    queries = {
+        'person by handle': ('SELECT ID FROM PEOPLE WHERE HANDLE = ?', [('handle_' + str(post_id % PEOPLE + 1),) for post_id in ids]),
+        'post by author and send time': ('SELECT ID FROM POSTS WHERE AUTHOR_REMIND = ? AND TIME_SEND_REQUEST = ?',
+                                         [(post_id % PEOPLE + 1, START + post_id if typed else legacy_time(START + post_id))
+                                          for post_id in ids]),
+        'mentions of a post': ('SELECT PERSON_ID FROM PERSON_POST_MENTION WHERE POST_ID = ?', [(post_id,) for post_id in ids]),
+        'reminders of a minute': ('SELECT ID FROM POSTS WHERE TIME_TO_REMIND >= ? AND TIME_TO_REMIND < ?' if typed else
+                                  'SELECT ID FROM POSTS WHERE TIME_TO_REMIND = ?',
+                                  [(START + post_id * 60, START + post_id * 60 + 60) if typed else (legacy_time(START + post_id * 60, False),)
+                                   for post_id in ids]),
+    }
+    connection = sqlite3.connect(database_path)
+    ret = {}
+    for name, (query, parameters) in queries.items():
+        start = perf_counter()
+        for parameter in parameters:
+            assert connection.execute(query, parameter).fetchall()
+        ret[name] = (perf_counter() - start) / LOOKUPS * 1000
+    connection.close()
+    return ret
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.db')
+        fill_legacy_database(path)
+        before = lookups(path, False)
+        migration_start = perf_counter()
+        Database(path).stop()
+        migration_time = perf_counter() - migration_start
+        after = lookups(path, True)
+    print(f"Migration of {POSTS} reminders: {migration_time:.1f} s")
+    for lookup, legacy_ms in before.items():
+        print(f"{lookup}: {legacy_ms:.3f} ms before, {after[lookup]:.3f} ms after ({legacy_ms / after[lookup]:.0f}x)")
@@ -0,0 +1,80 @@
+"""Benchmark of sending a minute of due reminders one after another and through the send pipeline"""
+from time import perf_counter, sleep, time
+from types import SimpleNamespace
+from modules.send_pipeline import LagStats, SendPipeline
+
+REMINDERS = 100
+PREPARE_LATENCY_SEC = 0.03
+POST_LATENCY_SEC = 0.01
+POSTS_PER_REMINDER = 2
+
+
+class SimulatedSender:
+    """Sender whose requests only sleep, a reminder needs one prepare and POSTS_PER_REMINDER posts"""
+
+    @staticmethod
+    def load(_records) -> None:
+        """Nothing to read"""
+
+    @staticmethod
+    def prepare(_post_record):
+        """Sleeps like handle lookups and an upload"""
+        sleep(PREPARE_LATENCY_SEC)
+        return [], list(range(POSTS_PER_REMINDER))
+
+    @staticmethod
+    def post(_post_record, _done, posts) -> bool:
+        """Sleeps like posts of a thread made in order"""
+        for _ in posts:
+            sleep(POST_LATENCY_SEC)
+        return True
+
+    @staticmethod
+    def finalize(_post_record) -> bool:
+        """Nothing to reschedule"""
+        return True
+
+
+def due_reminders() -> list:
+    """
+    Returns reminders that are all due now
+
+    :return: records with an id and a time to remind
+    """
+    now = int(time())
+    return [SimpleNamespace(ID=index, TIME_TO_REMIND=now, SENT_FIRE_TIME=None) for index in range(REMINDERS)]
+
+
+def serial() -> tuple[float, float]:
+    """
+    Sends reminders one after another, like send_main did before the pipeline
+
+    :return: seconds it took and p99 delay of reminders
+    """
+    sender, lags = SimulatedSender(), LagStats()
+    start = perf_counter()
+    for record in due_reminders():
+        sender.post(record, *sender.prepare(record))
+        lags.record(time() - record.TIME_TO_REMIND)
+        sender.finalize(record)
+    return perf_counter() - start, lags.percentile(0.99)
+
+
+def pipelined() -> tuple[float, float]:
+    """
+    Sends reminders through a SendPipeline with the default pools
+
+    :return: seconds it took and p99 delay of reminders
+    """
+    pipeline = SendPipeline(SimulatedSender())
+    start = perf_counter()
+    pipeline.run(due_reminders())
+    elapsed = perf_counter() - start
+    pipeline.stop()
+    return elapsed, pipeline.lag.percentile(0.99)
+
+
+if __name__ == '__main__':
+    for name, function in (('serial', serial), ('pipeline', pipelined)):
+        seconds, p99 = function()
+        print(f"{name}: {REMINDERS} reminders in {seconds:.2f} s, p99 lag {p99:.2f} s")
@@ -0,0 +1,82 @@
+"""Benchmark of sending due reminders from several bot instances that share one database and lease reminders"""
+import os
+import tempfile
+import threading
+from time import perf_counter, sleep
+import sqlalchemy as db
+from modules.bot_send_posts import CLAIM_BATCH_SIZE
+from modules.database_control import Database, to_epoch
+from modules.partitions import archive_posts, drop_partitions
+
+REMINDERS = 400
+SEND_LATENCY_SEC = 0.01
+NODES = (1, 2, 4, 8)
+NOW = to_epoch('2024-01-01 12:00:00')
+
+
+def fill_database(database: Database) -> None:
+    """
+    Inserts reminders that are all due
+
+    :param database: database of a benchmark
+    :return:
+    """
+    author = database.insert_person('author')
+    with database.transaction() as connection:
+        connection.execute(db.insert(database.post_table), [
+            {'TEXT': 'text', 'TIME_TO_REMIND': NOW - index, 'AUTHOR_REMIND': author, 'AUTHOR_POST': author, 'EVERY_N_SECONDS': 0}
+            for index in range(REMINDERS)])
+
+
+def run_node(database_path: str, sent: list) -> None:
+    """
+    Sends reminders like send_main does until no reminder is due, a send only sleeps for SEND_LATENCY_SEC
+
+    :param database_path: path to a shared database
+    :param sent: list that ids of sent reminders are appended to
+    :return:
+    """
+    database = Database(database_path)
+    while records := database.claim_due_posts(NOW, limit=CLAIM_BATCH_SIZE):
+        finished = []
+        for record in records:
+            sleep(SEND_LATENCY_SEC)
+            database.mark_post_sent(record)
+            sent.append(record.ID)
+            if not database.update_post_time_remind(record, NOW):
+                finished.append(record.ID)
+        archive_posts(database, finished, os.path.dirname(database_path))
+    database.stop()
+
+
+def throughput(nodes: int) -> float:
+    """
+    Measures how many reminders a number of instances send per second
+
+    :param nodes: number of instances, each with its own Database like a separate process
+    :return: reminders per second
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.db')
+        database = Database(path)
+        fill_database(database)
+        sent = []
+        threads = [threading.Thread(target=run_node, args=(path, sent)) for _ in range(nodes)]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+        assert sorted(sent) == list(range(1, REMINDERS + 1))
+        drop_partitions(database, to_epoch('2100-01-01 00:00:00'))
+        database.stop()
+    return REMINDERS / elapsed
+
+
+if __name__ == '__main__':
+    single = None
+    for count in NODES:
+        rate = throughput(count)
+        single = single or rate
+        print(f"{count} instance(s): {rate:.0f} reminders/s ({rate / single:.2f}x)")
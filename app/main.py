@@ -1,22 +1,43 @@
 """Main script of a program that will run this as a service"""
+import argparse
+import asyncio
 import os
 import threading
 from dotenv import load_dotenv
-from modules import bot_get_posts, bot_send_posts
+from modules import async_runtime, bot_get_posts, bot_send_posts, database_control
+from modules.handle_resolver import HandleResolver
+from modules.jetstream import STREAM_SOURCE
 
 
-def main_program():
-    """Bot itself"""
+def main_program(use_async=False):
+    """
+    Bot itself
+
+    :param use_async: run both loops as asyncio tasks instead of two threads
+    """
     load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
     app_handle = os.getenv('APP_HANDLE')
     app_password = os.getenv('APP_PASSWORD')
     database_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database/database.db')
     media_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media')
-    send_post = threading.Thread(target=bot_send_posts.send_main, args=(app_handle, app_password, database_path, media_path))
-    get_post = threading.Thread(target=bot_get_posts.get_notifications, args=(app_handle, app_password, database_path, media_path))
+    database = database_control.Database(os.getenv('DATABASE_URL', database_path),
+                                         pool_size=int(os.getenv('DATABASE_POOL_SIZE', str(database_control.DEFAULT_POOL_SIZE))),
+                                         max_overflow=int(os.getenv('DATABASE_MAX_OVERFLOW', str(database_control.DEFAULT_MAX_OVERFLOW))))
+    database.node_id = os.getenv('NODE_ID', database.node_id)
+    if database.pragmas():
+        print("SQLite pragmas in effect:", ", ".join(name + "=" + str(value) for name, value in database.pragmas().items()))
+    resolver = HandleResolver(database)
+    if use_async:
+        asyncio.run(async_runtime.async_main(app_handle, app_password, database, media_path, resolver))
+        return
+    send_post = threading.Thread(target=bot_send_posts.send_main, args=(app_handle, app_password, database, media_path, resolver))
+    ingest = bot_get_posts.stream_notifications if os.getenv('NOTIFICATION_SOURCE') == STREAM_SOURCE else bot_get_posts.get_notifications
+    get_post = threading.Thread(target=ingest, args=(app_handle, app_password, database, media_path, resolver))
     send_post.start()
     get_post.start()
 
 
 if __name__ == '__main__':
-    main_program()
+    parser = argparse.ArgumentParser(description='Bluesky bot that reminds posts')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='run on asyncio with AsyncClient')
+    main_program(parser.parse_args().use_async)
@@ -0,0 +1,395 @@
+"""Asynchronous runtime of a bot that processes notifications and sends reminders as concurrent tasks"""
+import asyncio
+import os
+from collections import OrderedDict
+from time import time
+import atproto_client.exceptions
+import httpx
+import websockets
+from atproto import AsyncClient, models
+from sqlalchemy.exc import SQLAlchemyError
+from modules import database_control
+from modules.bot_get_posts import (DELETE, SAVE, MAX_FETCH_NOTIFICATIONS_DELAY_SEC, MIN_FETCH_NOTIFICATIONS_DELAY_SEC,
+                                   NOTIFICATIONS_LEASE_SEC, create_reminder_post, deleted_reminder, facets_from_post,
+                                   get_time_to_remind_from_post, media_of_post, mention_action, mentioned_dids,
+                                   parent_to_fetch, post_images, remove_media_files)
+from modules.bot_send_posts import CLAIM_BATCH_SIZE, MAX_SEND_SLEEP_SEC, MIN_SEND_SLEEP_SEC, plan_reminder, post_arguments
+from modules.blob_cache import BlobCache
+from modules.classes import Media, Post
+from modules.handle_resolver import HandleResolver
+from modules.jetstream import JETSTREAM_URL, RECONNECT_DELAY_SEC, STREAM_SOURCE, JetstreamIngest
+from modules.leases import NOTIFICATIONS_LEASE, hold_lease
+from modules.media_store import AsyncMediaStore, media_cid
+from modules.notification_ingest import NotificationIngest
+from modules.outbox import STEP_ERRORS, UPLOAD_BLOB, Outbox, blob_result, payload_of, post_result
+from modules.partitions import archive_posts
+from modules.poll_control import AdaptivePoller, AsyncRateLimitAwareRequest
+from modules.post_cache import PostCache, record_response
+from modules.reminder_queue import ReminderQueue
+from modules.thread_layout import mentioned_handles
+
+NOTIFICATION_CONCURRENCY = 8
+SEND_CONCURRENCY = 4
+
+
+class AsyncBot:
+    """
+    Bot built on AsyncClient where every notification and every due reminder is a task of its own
+
+    Semaphores bound how many notifications, reminders and CDN downloads are in flight at once. Notifications of one
+    author are processed in order, so that "delete" never overtakes a reminder it deletes. Database calls are short and
+    run in worker threads, so they never block the event loop.
+    """
+
+    def __init__(self, client: AsyncClient, database: database_control.Database, media_path: str, resolver: HandleResolver):
+        self.client = client
+        self.database = database
+        self.resolver = resolver
+        self.media_store = AsyncMediaStore(media_path)
+        self.outbox = Outbox(database, BlobCache(database, media_path))
+        self.limits = {'notifications': asyncio.Semaphore(NOTIFICATION_CONCURRENCY),
+                       'sends': asyncio.Semaphore(SEND_CONCURRENCY)}
+        self.tasks = set()
+
+    async def get_did(self, handle: str) -> str:
+        """
+        Resolves a handle into a did, asking Bluesky only when a resolver does not know it
+
+        :param handle: handle of an account
+        :return: did of an account
+        """
+        did = await asyncio.to_thread(self.resolver.lookup_did, handle)
+        if did is None:
+            did = (await self.client.resolve_handle(handle)).did
+            await asyncio.to_thread(self.resolver.remember, did, handle)
+        return did
+
+    async def get_handle(self, did: str) -> str:
+        """
+        Resolves a did into a handle, asking Bluesky only when a resolver does not know it
+
+        :param did: did of an account
+        :return: handle of an account
+        """
+        handle = await asyncio.to_thread(self.resolver.lookup_handle, did)
+        if handle is None:
+            handle = (await self.client.get_profile(did)).handle
+            await asyncio.to_thread(self.resolver.remember, did, handle)
+        return handle
+
+    async def reply(self, post_reply_to, text: str) -> None:
+        """
+        Replies to a given post
+
+        :param post_reply_to: post which will be replied to
+        :param text: text of a reply
+        :return: None
+        """
+        root_post_ref = models.create_strong_ref(post_reply_to)
+        await self.client.send_post(text=text, reply_to=models.AppBskyFeedPost.ReplyRef(parent=root_post_ref, root=root_post_ref))
+
+    async def get_any_media(self, parent_post) -> list[Media]:
+        """
+        Downloads all images of a post concurrently or gets url of a gif
+
+        :param parent_post: post from which media will be downloaded
+        :return: list of media of a post
+        """
+        images = post_images(parent_post)
+        paths = await self.media_store.download_all(parent_post.author.did, [img.image.ref.link for img in images])
+        return media_of_post(parent_post, images, paths)
+
+    async def save_reminder(self, new_post: Post, post_parent) -> int:
+        """
+        Saves a reminder with media and facets of an original post in one transaction, then downloads again files that
+        another reminder removed before the new MEDIA rows were committed
+
+        :param new_post: reminder that will be saved
+        :param post_parent: original post
+        :return: id of a post in a database
+        """
+        media_list = await self.get_any_media(post_parent)
+        try:
+            post_id = await asyncio.to_thread(self.database.insert_reminder, new_post, media_list, facets_from_post(post_parent))
+        except Exception:
+            await asyncio.to_thread(remove_media_files, self.database, self.media_store.media_path, media_list)
+            raise
+        await self.media_store.download_all(post_parent.author.did, [media_cid(media.path) for media in media_list if media.path])
+        return post_id
+
+    async def process_notification(self, notification, app_handle: str, posts: PostCache) -> None:
+        """
+        Saves, deletes or rejects a reminder a notification asks for and replies to it
+
+        :param notification: notification with a mention of a bot
+        :param app_handle: handle of a program
+        :param posts: cache of posts of the current page of notifications
+        :return: None
+        """
+        view = await posts.view_async(self.client, notification.uri)
+        if view is None:
+            return
+        post = record_response(view)
+        if notification.author.handle is None:
+            notification.author.handle = (await asyncio.to_thread(self.resolver.lookup_handle, notification.author.did) or
+                                          (await self.client.get_profile(notification.author.did)).handle)
+        await asyncio.to_thread(self.resolver.remember, notification.author.did, notification.author.handle)
+        app_did = await self.get_did(app_handle)
+        if notification.author.did == app_did:
+            return
+        time_to_remind = get_time_to_remind_from_post(text=post.value.text, time_send=post.value.created_at)
+        uri = parent_to_fetch(post, time_to_remind)
+        post_parent = None if uri is None else await posts.view_async(self.client, uri)
+        action, reply = mention_action(post, post_parent, app_handle, time_to_remind)
+        if action == DELETE:
+            await asyncio.to_thread(self.database.delete_post, deleted_reminder(notification, post_parent), self.media_store.media_path)
+        elif action == SAVE:
+            mentions = await asyncio.gather(*(self.get_handle(did) for did in mentioned_dids(post, app_did)))
+            await self.save_reminder(create_reminder_post(notification, post, post_parent, time_to_remind, list(mentions)), post_parent)
+        await self.reply(post, reply)
+
+    async def process_author(self, notifications: list, app_handle: str, posts: PostCache) -> None:
+        """
+        Processes notifications of one author in order, a notification that fails is logged and skipped
+
+        :param notifications: notifications of one author, the oldest first
+        :param app_handle: handle of a program
+        :param posts: cache of posts of the current page of notifications
+        :return: None
+        """
+        for notification in notifications:
+            async with self.limits['notifications']:
+                try:
+                    await self.process_notification(notification, app_handle, posts)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    # a locked database or a malformed notification must not end the page and the loops of a bot
+                    print("Error! Notification", notification.uri, "was not processed:", repr(e))
+
+    async def process_page(self, notifications: list, app_handle: str, posts: PostCache) -> None:
+        """
+        Fetches posts of a page of notifications in batches and processes every author as a separate task
+
+        :param notifications: notifications with a mention of a bot, the oldest first
+        :param app_handle: handle of a program
+        :param posts: cache of posts that a page is fetched into
+        :return: None
+        """
+        try:
+            await posts.prefetch_async(self.client, notifications)
+        except (atproto_client.exceptions.AtProtocolError, httpx.HTTPError) as e:
+            print("Prefetch error:", e)
+        by_author = OrderedDict()
+        for notification in notifications:
+            by_author.setdefault(notification.author.did, []).append(notification)
+        await asyncio.gather(*(self.process_author(page, app_handle, posts) for page in by_author.values()))
+
+    async def resolve_dids(self, handles: list[str]) -> dict:
+        """
+        Resolves handles of all mentions in a title concurrently
+
+        :param handles: mentioned handles, each once
+        :return: dictionary from a handle to its did or None if a handle could not be resolved
+        """
+        dids = await asyncio.gather(*(self.get_did(handle) for handle in handles), return_exceptions=True)
+        for did in dids:
+            if isinstance(did, BaseException) and not isinstance(did, atproto_client.exceptions.BadRequestError):
+                raise did
+        return {handle: None if isinstance(did, BaseException) else did for handle, did in zip(handles, dids)}
+
+    async def send_reminder(self, post_record, bundle) -> None:
+        """
+        Sends a reminder through the outbox as a thread of a title and a reminded post, then archives or reschedules it
+
+        A reminder that was already sent for its fire time by an instance that lost its lease is only rescheduled.
+
+        :param post_record: database record of a post
+        :param bundle: ReminderBundle of a post loaded with its batch, None if a post was deleted after it was claimed
+        :return:
+        """
+        if post_record.SENT_FIRE_TIME != post_record.TIME_TO_REMIND and not await self._run_outbox(post_record, bundle):
+            return
+        if not await asyncio.to_thread(self.database.update_post_time_remind, post_record, int(time())):
+            await asyncio.to_thread(archive_posts, self.database, [post_record.ID], self.media_store.media_path)
+
+    async def _run_outbox(self, post_record, bundle) -> bool:
+        """
+        Makes every step of a reminder that is not done yet, in order
+
+        :param post_record: database record of a post
+        :param bundle: ReminderBundle of a post or None
+        :return: False if a failed step waits for a retry or failed for good, or a reminder was deleted
+        """
+        started = None if bundle is None else await asyncio.to_thread(self.outbox.start, post_record, plan_reminder(post_record, bundle))
+        if started is None:
+            return False
+        done, pending = started
+        for step in pending:
+            try:
+                result = await self._execute_step(step, done, bundle)
+            except STEP_ERRORS as e:
+                await asyncio.to_thread(self.outbox.settle, post_record, step, e)
+                return False
+            await asyncio.to_thread(self.outbox.advance, step, result, done)
+        await asyncio.to_thread(self.outbox.finish, post_record)
+        return True
+
+    async def _execute_step(self, step, done: list[tuple[str, dict]], bundle) -> dict:
+        """
+        Makes one request of a reminder
+
+        :param step: row of OUTBOX
+        :param done: (kind, result) tuples of finished steps in order
+        :param bundle: ReminderBundle of a post
+        :return: result of a step
+        """
+        payload = payload_of(step)
+        if step.KIND == UPLOAD_BLOB:
+            return blob_result((await self.outbox.blob_cache.get_blobs_async(self.client, [payload['path']]))[0])
+        dids = await self.resolve_dids(mentioned_handles([payload]))
+        return post_result(await self.client.send_post(**post_arguments(payload, done, dids, bundle)))
+
+    async def dispatch(self, records) -> list[asyncio.Task]:
+        """
+        Reads everything claimed reminders need in one batch and starts sending them without waiting for them, so that
+        a slow one never delays the others
+
+        :param records: claimed database records of posts
+        :return: started tasks
+        """
+        bundles = await asyncio.to_thread(self.database.load_reminder_bundle, [record.ID for record in records]) if records else {}
+        started = []
+        for record in records:
+            task = asyncio.create_task(self._send_limited(record, bundles.get(record.ID)))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            started.append(task)
+        return started
+
+    async def notifications_loop(self, app_handle: str, app_password: str) -> None:
+        """
+        Polls new notifications and processes every author as a separate task while this instance is a leader
+
+        :param app_handle: handle of a program
+        :param app_password: password of a program
+        :return: None
+        """
+        ingest = NotificationIngest(self.database)
+        posts = PostCache()
+        poller = AdaptivePoller(MIN_FETCH_NOTIFICATIONS_DELAY_SEC, MAX_FETCH_NOTIFICATIONS_DELAY_SEC)
+        while True:
+            if not await asyncio.to_thread(hold_lease, self.database, NOTIFICATIONS_LEASE, int(time()), NOTIFICATIONS_LEASE_SEC):
+                await asyncio.sleep(MAX_FETCH_NOTIFICATIONS_DELAY_SEC)
+                continue
+            try:
+                new_mentions = await ingest.fetch_new_async(self.client)
+            except (atproto_client.exceptions.InvokeTimeoutError, atproto_client.exceptions.NetworkError, atproto_client.exceptions.AtProtocolError):
+                poller.record_rate_limit(self.client.request.rate_limit)
+                new_mentions = []
+                if not poller.rate_limit_delay():
+                    await self.client.login(app_handle, app_password)
+                    new_mentions = await ingest.fetch_new_async(self.client)
+
+            await self.process_page(new_mentions, app_handle, posts)
+            poller.record(len(new_mentions))
+            poller.record_rate_limit(self.client.request.rate_limit)
+            await asyncio.sleep(poller.next_delay())
+
+    async def stream_loop(self, app_handle: str) -> None:
+        """
+        Processes mentions pushed by a Jetstream feed while this instance is a leader, instead of polling notifications
+
+        :param app_handle: handle of a program
+        :return: None
+        """
+        ingest = JetstreamIngest(self.database, await self.get_did(app_handle))
+        posts = PostCache()
+        while True:
+            if not await asyncio.to_thread(hold_lease, self.database, NOTIFICATIONS_LEASE, int(time()), NOTIFICATIONS_LEASE_SEC):
+                await asyncio.sleep(MAX_FETCH_NOTIFICATIONS_DELAY_SEC)
+                continue
+            try:
+                async with websockets.connect(await asyncio.to_thread(ingest.url, os.getenv('JETSTREAM_URL', JETSTREAM_URL))) as websocket:
+                    await self.follow_stream(websocket, ingest, app_handle, posts)
+            except (websockets.exceptions.WebSocketException, OSError) as e:
+                print("Stream error:", e)
+                await asyncio.sleep(RECONNECT_DELAY_SEC)
+
+    async def follow_stream(self, messages, ingest: JetstreamIngest, app_handle: str, posts: PostCache) -> None:
+        """
+        Processes mentions read from a stream, every author as a separate task, until a stream ends or this instance
+        stops being a leader
+
+        :param messages: asynchronous iterable of JSON texts of events
+        :param ingest: reader of a stream with its cursor
+        :param app_handle: handle of a program
+        :param posts: cache of posts of mentions
+        :return: None
+        """
+        async for message in messages:
+            if not ingest.add(message):
+                continue
+            await self.process_page(await asyncio.to_thread(ingest.flush), app_handle, posts)
+            if not await asyncio.to_thread(hold_lease, self.database, NOTIFICATIONS_LEASE, int(time()), NOTIFICATIONS_LEASE_SEC):
+                return
+
+    async def send_loop(self) -> None:
+        """
+        Claims due reminders and sends each of them as a separate task
+
+        Only as many reminders are claimed as there are free send slots, so a claimed reminder starts at once and never
+        waits in a queue until its lease expires and it is claimed again.
+
+        :return: None
+        """
+        reminder_queue = ReminderQueue()
+        self.database.listeners.append(reminder_queue)
+        reminder_queue.load(await asyncio.to_thread(self.database.get_pending_reminders))
+        poller = AdaptivePoller(MIN_SEND_SLEEP_SEC, MAX_SEND_SLEEP_SEC)
+        while True:
+            free = min(CLAIM_BATCH_SIZE, SEND_CONCURRENCY - len(self.tasks))
+            records = await asyncio.to_thread(self.database.claim_due_posts, int(time()), limit=free) if free > 0 else []
+            await self.dispatch(records)
+            poller.record(len(records))
+            poller.record_rate_limit(self.client.request.rate_limit)
+            await asyncio.sleep(poller.rate_limit_delay())
+            if self.tasks and len(records) == free:
+                await asyncio.wait(set(self.tasks), return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await reminder_queue.wait_for_due_async(poller.next_delay())
+
+    async def _send_limited(self, post_record, bundle) -> None:
+        """
+        Sends a reminder when a semaphore of sends allows it
+
+        :param post_record: database record of a post
+        :param bundle: ReminderBundle of a post or None
+        :return:
+        """
+        async with self.limits['sends']:
+            try:
+                await self.send_reminder(post_record, bundle)
+            except (atproto_client.exceptions.AtProtocolError, httpx.HTTPError, OSError, SQLAlchemyError) as e:
+                print("Error! Reminder", post_record.ID, "was not sent:", e)
+
+
+async def async_main(app_handle, app_password, database: database_control.Database, media_path, resolver: HandleResolver) -> None:
+    """
+    Runs both loops of a bot on one event loop, mentions come from a Jetstream feed when NOTIFICATION_SOURCE is jetstream
+
+    :param app_handle: handle of a program
+    :param app_password: password of a program
+    :param database: database shared by the whole process
+    :param media_path: path to media folder
+    :param resolver: cache of handles shared by the whole process
+    :return: None
+    """
+    client = AsyncClient(request=AsyncRateLimitAwareRequest())
+    await client.login(app_handle, app_password)
+    bot = AsyncBot(client, database, media_path, resolver)
+    try:
+        if os.getenv('NOTIFICATION_SOURCE') == STREAM_SOURCE:
+            await asyncio.gather(bot.stream_loop(app_handle), bot.send_loop())
+        else:
+            await asyncio.gather(bot.notifications_loop(app_handle, app_password), bot.send_loop())
+    finally:
+        await bot.media_store.close()
@@ -0,0 +1,148 @@
+"""Cache of uploaded blobs so that recurring reminders do not upload the same images every time they are sent"""
+import asyncio
+import hashlib
+import os
+import threading
+from time import time
+import sqlalchemy as db
+from atproto_client.models.blob_ref import BlobRef, IpldLink
+from atproto_client.exceptions import BadRequestError
+from modules.database_control import Database
+from modules.storage import writes
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def is_blob_rejection(error: BadRequestError) -> bool:
+    """
+    Checks if a PDS rejected a post because of a blob it refers to
+
+    :param error: error of a request
+    :return: True if an error is about a blob
+    """
+    content = getattr(error.response, 'content', None)
+    text = str(getattr(content, 'error', '')) + ' ' + str(getattr(content, 'message', ''))
+    return 'blob' in text.lower()
+
+
+class BlobCache:
+    """
+    Blob refs of uploaded media files stored in BLOB_CACHE by sha256 of a file
+
+    A blob stays on a PDS as long as a post refers to it, so a recurring reminder reuses the ref of its first upload.
+    When a PDS rejects a cached ref anyway, forget drops it and the next get_blobs uploads the file again. Uploads are
+    streamed from disk, and hashes are remembered per file until its size or modification time changes.
+    """
+
+    def __init__(self, database: Database, media_path: str):
+        self.database = database
+        self.media_path = media_path
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def file_hash(self, path: str) -> str:
+        """
+        Returns sha256 of a media file
+
+        :param path: name of a file in media folder
+        :return: hex digest of a file
+        """
+        stat = os.stat(self.media_path + '/' + path)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(self.media_path + '/' + path, 'rb') as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        with self._lock:
+            self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    def lookup(self, digests: list[str]) -> dict:
+        """
+        Returns cached blob refs
+
+        :param digests: hashes of media files
+        :return: dictionary from a hash to its blob ref, hashes that were never uploaded are missing
+        """
+        table = self.database.blob_cache_table
+        with self.database.transaction() as connection:
+            rows = connection.execute(db.select(table).where(table.c.HASH.in_(set(digests)))).fetchall()
+        return {row.HASH: BlobRef(mime_type=row.MIME_TYPE, size=row.SIZE, ref=IpldLink.model_validate({'$link': row.CID}))
+                for row in rows}
+
+    @writes
+    def store(self, digest: str, blob: BlobRef) -> None:
+        """
+        Stores a blob ref of a freshly uploaded file
+
+        :param digest: hash of a media file
+        :param blob: blob ref returned by a PDS
+        :return:
+        """
+        table = self.database.blob_cache_table
+        cid = blob.ref if isinstance(blob.ref, str) else blob.ref.link
+        values = {'CID': cid, 'MIME_TYPE': blob.mime_type, 'SIZE': blob.size, 'UPLOADED_AT': int(time())}
+        with self.database.transaction() as connection:
+            if not connection.execute(db.update(table).where(table.c.HASH == digest).values(**values)).rowcount:
+                connection.execute(db.insert(table).values(HASH=digest, **values))
+
+    @writes
+    def forget(self, paths: list[str]) -> None:
+        """
+        Drops cached blob refs of media files, so that they are uploaded again
+
+        :param paths: names of files in media folder
+        :return:
+        """
+        table = self.database.blob_cache_table
+        digests = [self.file_hash(path) for path in paths]
+        with self.database.transaction() as connection:
+            connection.execute(db.delete(table).where(table.c.HASH.in_(digests)))
+
+    def get_blobs(self, client, paths: list[str]) -> list[BlobRef]:
+        """
+        Returns blob refs of media files, uploading only the files that are not cached
+
+        :param client: client of a bot
+        :param paths: names of files in media folder
+        :return: blob refs in the same order as paths
+        """
+        digests = [self.file_hash(path) for path in paths]
+        blobs = self.lookup(digests)
+        for path, digest in zip(paths, digests):
+            if digest not in blobs:
+                with open(self.media_path + '/' + path, 'rb') as f:
+                    blobs[digest] = client.com.atproto.repo.upload_blob(f).blob
+                self.store(digest, blobs[digest])
+        return [blobs[digest] for digest in digests]
+
+    async def get_blobs_async(self, client, paths: list[str]) -> list[BlobRef]:
+        """
+        Returns blob refs of media files using an AsyncClient, missing files are uploaded concurrently
+
+        :param client: asynchronous client of a bot
+        :param paths: names of files in media folder
+        :return: blob refs in the same order as paths
+        """
+        digests = await asyncio.gather(*(asyncio.to_thread(self.file_hash, path) for path in paths))
+        blobs = await asyncio.to_thread(self.lookup, digests)
+        missing = {digest: path for path, digest in zip(paths, digests) if digest not in blobs}
+        uploaded = await asyncio.gather(*(client.com.atproto.repo.upload_blob(self._read_chunks(path)) for path in missing.values()))
+        for digest, response in zip(missing, uploaded):
+            blobs[digest] = response.blob
+            await asyncio.to_thread(self.store, digest, response.blob)
+        return [blobs[digest] for digest in digests]
+
+    async def _read_chunks(self, path: str):
+        """
+        Reads a media file in chunks without blocking an event loop
+
+        :param path: name of a file in media folder
+        :return: asynchronous iterator of bytes
+        """
+        with open(self.media_path + '/' + path, 'rb') as f:
+            while chunk := await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE):
+                yield chunk
@@ -1,16 +1,35 @@
 """Processing of notifications of a bot"""
-import re
-import shutil
+import os
 import datetime
-from time import sleep
+from functools import partial
+from time import sleep, time
 import atproto_client.exceptions
-import requests
 from atproto import Client, models
 from dateutil.parser import parse
-from modules import database_control
-from modules.classes import Post, Media
-
-FETCH_NOTIFICATIONS_DELAY_SEC = 3
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect
+from modules import database_control, reminder_parser
+from modules.classes import Post, Media, Facet
+from modules.handle_resolver import HandleResolver
+from modules.jetstream import JETSTREAM_URL, RECONNECT_DELAY_SEC, JetstreamIngest
+from modules.leases import NOTIFICATIONS_LEASE, hold_lease
+from modules.media_store import MediaStore, media_cid
+from modules.notification_ingest import NotificationIngest
+from modules.notification_workers import DEFAULT_QUEUE_SIZE, DEFAULT_WORKERS, NotificationWorkers, StageStats
+from modules.poll_control import AdaptivePoller, RateLimitAwareRequest
+from modules.post_cache import PostCache, record_response
+from modules.storage import writes
+
+MIN_FETCH_NOTIFICATIONS_DELAY_SEC = 1
+MAX_FETCH_NOTIFICATIONS_DELAY_SEC = 30
+NOTIFICATIONS_LEASE_SEC = 4 * MAX_FETCH_NOTIFICATIONS_DELAY_SEC
+DELETED_REPLY = 'Okay, I deleted this reminder from my mind. :)'
+ERROR_REPLY = 'I am sorry. Error occurred. I cannot remind you this :('
+PAST_DATE_REPLY = "You want me to remind on a date that is in the past. I don't have time machine yet. I am really sorry :("
+NOT_FOUND_REPLY = "I'm sorry. I don't find this post in my memory. Maybe you meant the one I answered to?"
+NOT_A_REPLY_REPLY = "Your message is not a reply. I am sorry :("
+SAVE = 'save'
+DELETE = 'delete'
 
 
 def count_remind(date: str, time_start: str) -> str:
@@ -21,24 +40,10 @@ def count_remind(date: str, time_start: str) -> str:
     :param time_start: starting date
     :return: new date in string format
     """
-    date_ret = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    if date.split()[1] in ['day', 'days']:
-        date_ret = parse(time_start) + datetime.timedelta(days=int(date.split()[0]))
-    if date.split()[1] in ['month', 'months']:
-        new_month = parse(time_start).month + int(date.split()[0])
-        if new_month < 12:
-            date_ret = parse(time_start).replace(month=new_month)
-        else:
-            date_ret = parse(time_start).replace(month=(new_month % 12 + 1), year=parse(time_start).year + (new_month // 12))
-    if date.split()[1] in ['year', 'years']:
-        date_ret = parse(time_start).replace(year=parse(time_start).year + int(date.split()[0]))
-    if date.split()[1] in ['minute', 'minutes']:
-        date_ret = parse(time_start) + datetime.timedelta(minutes=int(date.split()[0]))
-    if date.split()[1] in ['hour', 'hours']:
-        date_ret = parse(time_start) + datetime.timedelta(hours=int(date.split()[0]))
-    if date.split()[1] in ['week', 'weeks']:
-        date_ret = parse(time_start) + datetime.timedelta(weeks=int(date.split()[0]))
-    return date_ret.strftime("%Y-%m-%d %H:%M:%S")
+    amount, unit = date.split()[:2]
+    if unit.lower() not in reminder_parser.UNITS:
+        return datetime.datetime.now().strftime(reminder_parser.DATE_FORMAT)
+    return reminder_parser.add_period(parse(time_start), int(amount), reminder_parser.UNITS[unit.lower()]).strftime(reminder_parser.DATE_FORMAT)
 
 
 def get_period(text_origin: str, word: str) -> str:
@@ -49,27 +54,13 @@ def get_period(text_origin: str, word: str) -> str:
     :param word: which word must be before period
     :return: period
     """
-    punc = '''!()-[]{};:'"\\, <>./?@#$%^&*_~'''
-    text = text_origin
-    for i in punc:
-        text = text.replace(i, ' ')
-    text = re.sub(' +', ' ', text)
-    text_split = text.split(' ')
-    if text.lower().find(word.lower()) != -1:
-        for (i, elem) in enumerate(text_split):
-            if elem.lower() == word.lower() and i + 1 in range(len(text_split)):
-                time = text_split[i + 1]
-                try:
-                    int(time)
-                except ValueError:
-                    return "1 day"
-                item = 'day'
-                if i + 2 in range(len(text_split)):
-                    item = text_split[i + 2]
-                    if item.lower() not in ['day', 'days', 'month', 'months', 'year', 'years',
-                                            'minute', 'minutes', 'hour', 'hours', 'week', 'weeks']:
-                        item = 'day'
-                return str(time) + " " + item
+    text_split = reminder_parser.SEPARATORS.sub(' ', text_origin).split(' ')
+    for (i, elem) in enumerate(text_split[:-1]):
+        if elem.lower() == word.lower():
+            if not reminder_parser.NUMBER.fullmatch(text_split[i + 1]):
+                return "1 day"
+            item = text_split[i + 2] if i + 2 < len(text_split) else 'day'
+            return text_split[i + 1] + " " + (item if item.lower() in reminder_parser.UNITS else 'day')
     return ''
 
 
@@ -81,14 +72,7 @@ def get_time_to_remind_from_post(text: str, time_send: str) -> str:
     :param time_send: time when post was sent
     :return: date when post must be reminded
     """
-    if get_period(text, 'in') != '':
-        return count_remind(get_period(text, 'in'), database_control.convert_date(time_send))
-    try:
-        time_send_1 = datetime.datetime.strptime(database_control.convert_date(time_send), '%Y-%m-%d %H:%M:%S')
-        parse_time = parse(text, fuzzy=True, default=time_send_1, dayfirst=True).strftime('%Y-%m-%d %H:%M:%S')
-        return parse_time
-    except ValueError:
-        return count_remind('1 day', database_control.convert_date(time_send))
+    return reminder_parser.time_to_remind(text, database_control.convert_date(time_send))
 
 
 def get_every_from_post(text: str) -> int:
@@ -98,116 +82,234 @@ def get_every_from_post(text: str) -> int:
     :param text: post text from which will be found period
     :return: period in seconds how often post must be reminded
     """
-    ret = 0
+    return reminder_parser.parse_reminder(text).every_seconds()
+
+
+def ok_reply_text(time_to_remind: str) -> str:
+    """
+    Returns a text of a reply to a saved reminder
+
+    :param time_to_remind: time when post will be reminded
+    :return: text of a reply
+    """
+    remind_date = datetime.datetime.strptime(time_to_remind, '%Y-%m-%d %H:%M:%S')
+    return (f"I will remind you this on {str(remind_date.strftime('%d-%m-%Y'))} at {str(remind_date.strftime('%H:%M'))}! :)\nBeware! "
+            f'Date of the reminder is in UTC-0 time!')
+
+
+def is_in_past(time_to_remind: str) -> bool:
+    """
+    Checks if a time to remind has already passed
+
+    :param time_to_remind: time when post will be reminded
+    :return: True if a time is in the past
+    """
+    return datetime.datetime.strptime(time_to_remind, '%Y-%m-%d %H:%M:%S').replace(
+        tzinfo=datetime.timezone.utc) < datetime.datetime.now().astimezone(datetime.timezone.utc)
+
+
+def facets_from_post(post) -> list[Facet]:
+    """
+    Gets any facets from the post
+
+    :param post: given post from which facets will be taken
+    :return: list of facets of a post
+    """
+    facet_list = []
     try:
-        if get_period(text, 'every'):
-            text = get_period(text, 'every')
-            if text.split()[1] in ['day', 'days']:
-                ret = int(text.split()[0]) * 24 * 60 * 60
-            if text.split()[1] in ['month', 'months']:
-                ret = int(text.split()[0]) * 24 * 60 * 60 * 30
-            if text.split()[1] in ['year', 'years']:
-                ret = int(text.split()[0]) * 24 * 60 * 60 * 365
-            if text.split()[1] in ['minute', 'minutes']:
-                ret = int(text.split()[0]) * 60
-            if text.split()[1] in ['hour', 'hours']:
-                ret = int(text.split()[0]) * 60 * 60
-            if text.split()[1] in ['week', 'weeks']:
-                ret = int(text.split()[0]) * 24 * 60 * 60 * 7
-    except ValueError:
-        ret = 0
-    return ret
+        for facet in post.record.facets:
+            new_facet = Facet()
+            new_facet.set_index([facet.index.byte_start, facet.index.byte_end])
+            if hasattr(facet.features[0], 'did'):
+                new_facet.set_facet_type('mention')
+                new_facet.set_uri(facet.features[0].did)
+            if hasattr(facet.features[0], 'tag'):
+                new_facet.set_facet_type('tag')
+                new_facet.set_uri(facet.features[0].tag)
+            if hasattr(facet.features[0], 'uri'):
+                new_facet.set_facet_type('link')
+                new_facet.set_uri(facet.features[0].uri)
+            facet_list.append(new_facet)
+    except TypeError:
+        pass
+    return facet_list
+
+
+def post_images(parent_post) -> list:
+    """
+    Returns images of a post
 
+    :param parent_post: post with images
+    :return: list of images, empty if a post has none
+    """
+    try:
+        return list(parent_post.record.embed.images)
+    except AttributeError:
+        print("Post doesn't have images")
+        return []
 
-class GetPosts:
-    """Class that handles getting and processes posts"""
 
-    def __init__(self, client, database_path, media_path):
-        self.client = client
-        self.database_path = database_path
-        self.media_path = media_path
+def media_of_post(parent_post, images: list, paths: list[str]) -> list[Media]:
+    """
+    Creates media of downloaded images and a gif of a post
 
-    def reply_to_post_delete(self, post_reply_to) -> None:
-        """
-        Replies to a post after deleting a reminder.
+    :param parent_post: post from which media were taken
+    :param images: images of a post
+    :param paths: names of downloaded files of images in media folder, None for images that could not be retrieved
+    :return: list of media of a post, without images that could not be retrieved
+    """
+    media_list = []
+    for img, path in zip(images, paths):
+        if path is None:
+            continue
+        media = Media()
+        media.set_alt(img.alt)
+        media.set_path(path)
+        media_list.append(media)
+    try:
+        media = Media()
+        media.set_alt(parent_post.record.embed.external.description)
+        media.set_foreign(parent_post.record.embed.external.uri)
+        media.set_title(parent_post.record.embed.external.title)
+        media_list.append(media)
+    except AttributeError:
+        print("Post doesn't have any gif")
+    return media_list
 
-        :param post_reply_to: post to which reply will be sent
-        :return:
-        """
-        root_post_ref = models.create_strong_ref(post_reply_to)
-        self.client.send_post(
-            text='Okay, I deleted this reminder from my mind. :)',
-            reply_to=models.AppBskyFeedPost.ReplyRef(parent=root_post_ref, root=root_post_ref),
-        )
 
-    def reply_to_post_error(self, post_reply_to, error="") -> None:
-        """
-        Replies to a given post with a specific error message or an ordinary reply.
+@writes
+def remove_media_files(database: database_control.Database, media_path: str, media_list: list[Media]) -> None:
+    """
+    Removes downloaded files of media that were not saved, unless another reminder refers to the same file
 
-        :param post_reply_to: post which will be replied to
-        :param error: error message
-        :return: None
-        """
-        root_post_ref = models.create_strong_ref(post_reply_to)
-        if error == '':
-            self.client.send_post(
-                text='I am sorry. Error occurred. I cannot remind you this :(',
-                reply_to=models.AppBskyFeedPost.ReplyRef(parent=root_post_ref, root=root_post_ref),
-            )
-        else:
-            self.client.send_post(
-                text=error,
-                reply_to=models.AppBskyFeedPost.ReplyRef(parent=root_post_ref, root=root_post_ref),
-            )
-
-    def download_photo(self, author_did: str, image_id: str, post_id: int) -> None:
-        """
-        Downloads a photo from a given author.
+    :param database: database with MEDIA table
+    :param media_path: path to media folder
+    :param media_list: media of a reminder
+    :return: None
+    """
+    with database.transaction() as connection:
+        database_control.remove_unreferenced_media(connection, media_path, [media.path for media in media_list if media.path])
 
-        :param author_did: did of photo's author (the user who posted the photo)
-        :param image_id: id of an image
-        :param post_id: id of a post
-        :return: None
-        """
-        url = "https://cdn.bsky.app/img/feed_fullsize/plain/" + author_did + "/" + image_id.link
-        res = requests.get(url, stream=True, timeout=5)
-        if res.status_code == 200:
-            with open(self.media_path + '/' + str(post_id) + "_" + image_id.link + ".jpg", 'wb') as f:
-                shutil.copyfileobj(res.raw, f)
-        else:
-            print("Error! Media couldn't be retrieved")
-
-    def add_gif(self, url: str, alt: str, post_id: int, title: str) -> None:
+
+def create_reminder_post(notification, post, post_parent, time_to_remind: str, mentions: list[str]) -> Post:
+    """
+    Creates a reminder that a notification asks for
+
+    :param notification: notification with a mention of a bot
+    :param post: post that mentioned a bot
+    :param post_parent: original post that will be reminded
+    :param time_to_remind: time when post will be reminded
+    :param mentions: handles of people who will be reminded
+    :return: reminder
+    """
+    new_post = Post()
+    new_post.set_text(post_parent.record.text)
+    new_post.set_time_to_remind(time_to_remind)
+    new_post.set_author_remind(notification.author.handle)
+    new_post.set_author_post(post_parent.author.handle)
+    new_post.set_time_send_request(post.value.created_at)
+    new_post.set_people_remind(mentions)
+    new_post.set_recurrence(reminder_parser.parse_reminder(post.value.text).recurrence())
+    return new_post
+
+
+def parent_to_fetch(post, time_to_remind: str):
+    """
+    Returns a uri of a post a mention asks to remind, if an answer to a mention depends on it
+
+    :param post: post that mentioned a bot
+    :param time_to_remind: time when post will be reminded
+    :return: uri of a parent or None when a mention is rejected without it
+    """
+    if is_in_past(time_to_remind) or post.value.reply is None:
+        return None
+    return post.value.reply.parent.uri
+
+
+def mention_action(post, post_parent, app_handle: str, time_to_remind: str) -> tuple:
+    """
+    Decides what a mention of a bot asks for, both runtimes only make the requests that carry it out
+
+    :param post: post that mentioned a bot
+    :param post_parent: view of a post a mention replies to, None if it was not fetched or does not exist
+    :param app_handle: handle of a program
+    :param time_to_remind: time when post will be reminded
+    :return: (action, reply) where action is SAVE, DELETE or None when a bot only replies
+    """
+    if is_in_past(time_to_remind):
+        return None, PAST_DATE_REPLY
+    if post.value.reply is None:
+        return None, NOT_A_REPLY_REPLY
+    if post_parent is None:
+        return None, ERROR_REPLY
+    if post.value.text.find('delete') == -1:
+        return SAVE, ok_reply_text(time_to_remind)
+    if post_parent.record.text.find('@' + app_handle) == -1:
+        return None, NOT_FOUND_REPLY
+    return DELETE, DELETED_REPLY
+
+
+def deleted_reminder(notification, post_parent) -> Post:
+    """
+    Creates a reminder that identifies a saved reminder a notification asks to delete
+
+    :param notification: notification with a mention of a bot
+    :param post_parent: original post of a saved reminder
+    :return: reminder with its author and time of a request
+    """
+    new_post = Post()
+    new_post.set_author_remind(notification.author.handle)
+    new_post.set_time_send_request(post_parent.record.created_at)
+    return new_post
+
+
+def mentioned_dids(post, app_did: str) -> list[str]:
+    """
+    Returns dids of people a mention asks to remind
+
+    :param post: post that mentioned a bot
+    :param app_did: did of a program, it is left out
+    :return: dids in the order they are mentioned
+    """
+    return [mention.features[0].did for mention in post.value.facets if mention.features[0].did != app_did]
+
+
+class GetPosts:
+    """Class that handles getting and processes posts"""
+
+    def __init__(self, client, database: database_control.Database, media_path, resolver: HandleResolver):
+        self.client = client
+        self.database = database
+        self.media_path = media_path
+        self.resolver = resolver
+        self.stats = StageStats()
+        self.media_store = MediaStore(media_path)
+        self.posts = PostCache()
+
+    def prefetch(self, notifications) -> None:
         """
-        Adds gif to a database
+        Fetches posts of a page of notifications and their parents into a cache, a failed fetch leaves them to handlers
 
-        :param title: media title
-        :param url: url of a gif
-        :param alt: alt description of a gif
-        :param post_id: id of a post in which gif is
+        :param notifications: notifications with a mention of a bot
         :return: None
         """
-        media = Media()
-        media.set_post_id(post_id)
-        media.set_alt(alt)
-        media.set_foreign(url)
-        media.set_title(title)
-        database_control.Database(self.database_path).insert_media(media)
+        try:
+            with self.stats.measure('prefetch'):
+                self.posts.prefetch(self.client, notifications)
+        except atproto_client.exceptions.AtProtocolError as e:
+            print("Prefetch error:", e)
 
-    def reply_to_post_ok(self, post_reply_to, time_to_remind) -> None:
+    def reply(self, post_reply_to, text: str) -> None:
         """
-        Replies to a given post with an ok message.
+        Replies to a given post
 
         :param post_reply_to: post which will be replied to
-        :param time_to_remind: time when post will be reminded
+        :param text: text of a reply
         :return: None
         """
-
-        remind_date = datetime.datetime.strptime(time_to_remind, '%Y-%m-%d %H:%M:%S')
         root_post_ref = models.create_strong_ref(post_reply_to)
         self.client.send_post(
-            text=f"I will remind you this on {str(remind_date.strftime('%d-%m-%Y'))} at {str(remind_date.strftime('%H:%M'))}! :)\nBeware! "
-                 f'Date of the reminder is in UTC-0 time!',
+            text=text,
             reply_to=models.AppBskyFeedPost.ReplyRef(parent=root_post_ref, root=root_post_ref),
         )
 
@@ -220,136 +322,187 @@ class GetPosts:
         :return: list of user handle who where mentioned without bot's handle
         """
 
-        ret_mentions = []
-        for mention in post.value.facets:
-            if mention.features[0].did != self.client.resolve_handle(app_handle).did:
-                ret_mentions.append(self.client.get_profile(mention.features[0].did).handle)
-        return ret_mentions
+        app_did = self.resolver.get_did(self.client, app_handle)
+        return [self.resolver.get_handle(self.client, did) for did in mentioned_dids(post, app_did)]
 
-    def get_any_media(self, parent_post, post_id):
+    def get_any_media(self, parent_post) -> list[Media]:
         """
         Downloads or gets url of any media in post
 
         :param parent_post: post from which media will be downloaded
-        :param post_id: id of a reply post which was added to a database previously
-        :return:
+        :return: list of media of a post
         """
-        try:
-            for img in parent_post.record.embed.images:
-                self.download_photo(author_did=parent_post.author.did, image_id=img.image.ref, post_id=post_id)
-                media = Media()
-                media.set_post_id(post_id)
-                media.set_alt(img.alt)
-                media.set_path(str(post_id) + "_" + img.image.ref.link + ".jpg")
-                database_control.Database(self.database_path).insert_media(media)
-        except AttributeError:
-            print("Post doesn't have images")
-
-        try:
-            self.add_gif(url=parent_post.record.embed.external.uri, alt=parent_post.record.embed.external.description,
-                         post_id=post_id, title=parent_post.record.embed.external.title)
-        except AttributeError:
-            print("Post doesn't have any gif")
+        images = post_images(parent_post)
+        paths = self.media_store.download_all(parent_post.author.did, [img.image.ref.link for img in images])
+        return media_of_post(parent_post, images, paths)
 
-    def get_any_facets(self, post, post_id):
+    def get_any_facets(self, post) -> list[Facet]:
         """
         Function gets any facets from the post
 
-        :param post: given post from which facets will be added to a database
-        :param post_id: id of a post in a database
-        :return:
+        :param post: given post from which facets will be taken
+        :return: list of facets of a post
         """
+        return facets_from_post(post)
+
+    def save_reminder(self, new_post: Post, post_parent) -> int:
+        """
+        Saves a reminder with media and facets of an original post in one transaction
+
+        A file that was already stored can be removed by a delete or an archive of another reminder before the new MEDIA
+        row is committed. Once it is committed nothing removes the file anymore, so missing files are downloaded again.
+
+        :param new_post: reminder that will be saved
+        :param post_parent: original post
+        :return: id of a post in a database
+        """
+        media_list = self.get_any_media(post_parent)
         try:
-            for facet in post.record.facets:
-                facet_type = ''
-                uri = ''
-                if hasattr(facet.features[0], 'did'):
-                    facet_type = 'mention'
-                    uri = facet.features[0].did
-                if hasattr(facet.features[0], 'tag'):
-                    facet_type = 'tag'
-                    uri = facet.features[0].tag
-                if hasattr(facet.features[0], 'uri'):
-                    facet_type = 'link'
-                    uri = facet.features[0].uri
-                database_control.Database(self.database_path).insert_facets([facet.index.byte_start, facet.index.byte_end], facet_type, uri,
-                                                                            post_id)
-        except TypeError:
-            pass
-
-    def get_new_notifications(self, response):
+            post_id = self.database.insert_reminder(new_post, media_list, self.get_any_facets(post_parent))
+        except Exception:
+            remove_media_files(self.database, self.media_path, media_list)
+            raise
+        self.media_store.download_all(post_parent.author.did, [media_cid(media.path) for media in media_list if media.path])
+        return post_id
+
+    def process_notification(self, notification, app_handle) -> None:
         """
-        Gets new notifications
+        Saves, deletes or rejects a reminder a notification asks for and replies to it
 
-        :param response: response with all notifications
-        :return: list of unprocessed notifications
+        :param notification: notification with a mention of a bot
+        :param app_handle: handle of a program
+        :return: None
         """
-        new_mentions = []
-        for notification in response.notifications:
-            if notification.reason == 'mention' and database_control.Database(self.database_path).get_notifications_db(notification):
-                new_mentions.append(notification)
-        return new_mentions
+        with self.stats.measure('get_post'):
+            view = self.posts.view(self.client, notification.uri)
+        if view is None:
+            return
+        post = record_response(view)
+        if notification.author.handle is None:
+            notification.author.handle = self.resolver.get_handle(self.client, notification.author.did)
+        self.resolver.remember(notification.author.did, notification.author.handle)
+        if notification.author.did == self.resolver.get_did(self.client, app_handle):
+            return
+        time_to_remind = get_time_to_remind_from_post(text=post.value.text, time_send=post.value.created_at)
+        uri = parent_to_fetch(post, time_to_remind)
+        with self.stats.measure('get_parent'):
+            post_parent = None if uri is None else self.posts.view(self.client, uri)
+        action, reply = mention_action(post, post_parent, app_handle, time_to_remind)
+        if action == DELETE:
+            self.database.delete_post(deleted_reminder(notification, post_parent), self.media_path)
+        elif action == SAVE:
+            with self.stats.measure('mentions'):
+                mentions = self.get_mentions_post(post, app_handle)
+            with self.stats.measure('save'):
+                self.save_reminder(create_reminder_post(notification, post, post_parent, time_to_remind, mentions), post_parent)
+        with self.stats.measure('reply'):
+            self.reply(post, reply)
+
+
+def notification_workers(get_post: GetPosts, app_handle: str) -> NotificationWorkers:
+    """
+    Starts threads that process notifications, sized by NOTIFICATION_WORKERS and NOTIFICATION_QUEUE_SIZE
+
+    :param get_post: processor of notifications
+    :param app_handle: handle of a program
+    :return: started workers
+    """
+    return NotificationWorkers(partial(get_post.process_notification, app_handle=app_handle), get_post.stats,
+                               workers=int(os.getenv('NOTIFICATION_WORKERS', str(DEFAULT_WORKERS))),
+                               queue_size=int(os.getenv('NOTIFICATION_QUEUE_SIZE', str(DEFAULT_QUEUE_SIZE))))
+
+
+def follow_stream(messages, ingest: JetstreamIngest, get_post: GetPosts, workers: NotificationWorkers) -> None:
+    """
+    Hands mentions read from a stream to workers until a stream ends or this instance stops being a leader
+
+    :param messages: iterable of JSON texts of events
+    :param ingest: reader of a stream with its cursor
+    :param get_post: processor of notifications
+    :param workers: threads that process notifications
+    :return:
+    """
+    for message in messages:
+        if not ingest.add(message):
+            continue
+        mentions = ingest.flush()
+        get_post.prefetch(mentions)
+        for mention in mentions:
+            workers.submit(mention)
+        if not hold_lease(get_post.database, NOTIFICATIONS_LEASE, int(time()), NOTIFICATIONS_LEASE_SEC):
+            return
+
+
+def stream_notifications(app_handle, app_password, database: database_control.Database, media_path, resolver: HandleResolver) -> None:
+    """
+    Processes mentions pushed by a Jetstream feed while this instance is a leader, instead of polling notifications
+
+    :param app_handle: handle of a program
+    :param app_password: password of a program
+    :param database: database shared by the whole process
+    :param media_path: path to media folder
+    :param resolver: cache of handles shared by the whole process
+    :return: None
+    """
+    client = Client(request=RateLimitAwareRequest())
+    client.login(app_handle, app_password)
+    get_post = GetPosts(client, database, media_path, resolver)
+    workers = notification_workers(get_post, app_handle)
+    ingest = JetstreamIngest(database, resolver.get_did(client, app_handle))
+    while True:
+        if not hold_lease(database, NOTIFICATIONS_LEASE, int(time()), NOTIFICATIONS_LEASE_SEC):
+            sleep(MAX_FETCH_NOTIFICATIONS_DELAY_SEC)
+            continue
+        try:
+            with connect(ingest.url(os.getenv('JETSTREAM_URL', JETSTREAM_URL))) as websocket:
+                follow_stream(websocket, ingest, get_post, workers)
+        except (WebSocketException, OSError) as e:
+            print("Stream error:", e)
+            sleep(RECONNECT_DELAY_SEC)
 
 
-def get_notifications(app_handle, app_password, database_path, media_path) -> None:
+def get_notifications(app_handle, app_password, database: database_control.Database, media_path, resolver: HandleResolver) -> None:
     """
-    Gets and processes notifications
+    Gets and processes notifications while this instance is a leader, other instances wait to take over
 
+    :param app_handle: handle of a program
+    :param app_password: password of a program
+    :param database: database shared by the whole process
+    :param media_path: path to media folder
+    :param resolver: cache of handles shared by the whole process
     :return: None
     """
-    client = Client()
+    client = Client(request=RateLimitAwareRequest())
     client.login(app_handle, app_password)
-    get_post = GetPosts(client, database_path, media_path)
+    get_post = GetPosts(client, database, media_path, resolver)
+    workers = notification_workers(get_post, app_handle)
+    ingest = NotificationIngest(database)
+    poller = AdaptivePoller(MIN_FETCH_NOTIFICATIONS_DELAY_SEC, MAX_FETCH_NOTIFICATIONS_DELAY_SEC)
 
     while True:
-        last_seen_at = client.get_current_time_iso()
+        if not hold_lease(database, NOTIFICATIONS_LEASE, int(time()), NOTIFICATIONS_LEASE_SEC):
+            sleep(MAX_FETCH_NOTIFICATIONS_DELAY_SEC)
+            continue
         try:
-            response = client.app.bsky.notification.list_notifications()
+            new_mentions = ingest.fetch_new(client)
         except (atproto_client.exceptions.InvokeTimeoutError, atproto_client.exceptions.NetworkError, atproto_client.exceptions.AtProtocolError):
-            client.login(app_handle, app_password)
-            response = client.app.bsky.notification.list_notifications()
-
-        client.app.bsky.notification.update_seen({'seen_at': last_seen_at})
-
-        for notification in get_post.get_new_notifications(response):
-            post = client.get_post(post_rkey=notification.uri.split('/')[-1], profile_identify=notification.author.did)
-            if notification.author.did == client.resolve_handle(app_handle):
-                continue
-            time_to_remind = get_time_to_remind_from_post(text=post.value.text, time_send=post.value.created_at)
-            if datetime.datetime.strptime(time_to_remind, '%Y-%m-%d %H:%M:%S').replace(
-                    tzinfo=datetime.timezone.utc) < datetime.datetime.now().astimezone(datetime.timezone.utc):
-                get_post.reply_to_post_error(post,
-                                             error="You want me to remind on a date that is in the past. I don't have time machine yet. "
-                                                   "I am really sorry :(")
-                continue
-            try:
-                post_parent = client.get_posts(uris=[post.value.reply.parent.uri]).posts[0]
-                new_post = Post()
-                if post.value.text.find('delete') != -1 and post_parent.record.text.find('@' + app_handle) != -1:
-                    new_post.set_author_remind(notification.author.handle)
-                    new_post.set_time_send_request(post_parent.record.created_at)
-                    database_control.Database(database_path).delete_post(new_post, media_path)
-                    get_post.reply_to_post_delete(post)
-                    continue
-                if post.value.text.find('delete') != -1 and post_parent.record.text.find('@' + app_handle) == -1:
-                    get_post.reply_to_post_error(post,
-                                                 error="I'm sorry. I don't find this post in my memory. Maybe you meant the one I answered to?")
-                    continue
-
-                new_post.set_text(post_parent.record.text)
-                new_post.set_time_to_remind(time_to_remind)
-                new_post.set_author_remind(notification.author.handle)
-                new_post.set_author_post(post_parent.author.handle)
-                new_post.set_time_send_request(post.value.created_at)
-                new_post.set_people_remind(get_post.get_mentions_post(post, app_handle))
-                new_post.set_every_n_seconds(get_every_from_post(text=post.value.text))
-                post_id = database_control.Database(database_path).insert_post(new_post)
-
-                get_post.get_any_media(post_parent, post_id)
-                get_post.get_any_facets(post_parent, post_id)
-                get_post.reply_to_post_ok(post, time_to_remind)
-            except AttributeError as e:
-                print("Error:", e)
-                get_post.reply_to_post_error(post, error="Your message is not a reply. I am sorry :(")
-
-        sleep(FETCH_NOTIFICATIONS_DELAY_SEC)
+            poller.record_rate_limit(client.request.rate_limit)
+            if poller.rate_limit_delay():
+                new_mentions = []
+            else:
+                client.login(app_handle, app_password)
+                new_mentions = ingest.fetch_new(client)
+
+        get_post.prefetch(new_mentions)
+        for notification in new_mentions:
+            workers.submit(notification)
+        if new_mentions:
+            workers.join()
+            print("Notification workers:", workers.metrics())
+            print("Request budget:", client.request.budget.metrics())
+            print("Post cache:", get_post.posts.counters)
+            print("Handle cache:", resolver.stats())
+            print("Notification poller:", poller.metrics())
+        poller.record(len(new_mentions))
+        poller.record_rate_limit(client.request.rate_limit)
+        sleep(poller.next_delay())
@@ -1,221 +1,293 @@
 """Sending reminders when it is time"""
-from datetime import datetime, timezone
-from time import sleep
+import os
+from time import sleep, time
 import atproto_client.exceptions
-from atproto import Client, client_utils, models
+from atproto import Client, models
 from modules import database_control
+from modules.blob_cache import BlobCache
+from modules.handle_resolver import HandleResolver
+from modules.outbox import (DONE, STEP_ERRORS, UPLOAD_BLOB, Outbox, blob_result, payload_of, planned_steps, post_result, reply_to,
+                            uploaded_blobs)
+from modules.partitions import archive_posts
+from modules.poll_control import AdaptivePoller, RateLimitAwareRequest
+from modules.reminder_queue import ReminderQueue
+from modules.send_pipeline import POST_WORKERS, PREPARE_WORKERS, SendPipeline
+from modules.thread_layout import layout_thread, mentioned_handles, title_layout
 
-SEND_POST_DELAY_SEC = 10
+MIN_SEND_SLEEP_SEC = 1
+MAX_SEND_SLEEP_SEC = 300
+CLAIM_BATCH_SIZE = 20
+
+
+def title_segments(author_post: str, author_remind: str, mentions: list[str]) -> list[tuple]:
+    """
+    Returns parts of a title of a reminder
+
+    :param author_post: author of an original post
+    :param author_remind: author of a reminder
+    :param mentions: mentions from a reminder
+    :return: list of (text, handle) tuples where handle is None for a plain text
+    """
+    return [("Hi! Here's a reminder for you! ", None), *[('@' + mention + ' ', mention) for mention in mentions],
+            ("\nAnd this reminder is brought to you by: ", None), ('@' + author_remind, author_remind),
+            ("\nOriginal post was created by: ", None), ('@' + author_post, author_post)]
+
+
+def mention_facets(layout: dict, dids: dict) -> list[models.AppBskyRichtextFacet.Main]:
+    """
+    Converts mentions of a laid out title post into facets
+
+    :param layout: dictionary with a text and mentions as [byte_start, byte_end, handle] lists
+    :param dids: dictionary from a handle to its did or None if a handle could not be resolved
+    :return: list of facet models, a mention of a handle that was not resolved stays a plain text
+    """
+    return [models.AppBskyRichtextFacet.Main(features=[models.AppBskyRichtextFacet.Mention(did=dids[handle])],
+                                             index=models.AppBskyRichtextFacet.ByteSlice(byte_start=start, byte_end=end))
+            for start, end, handle in layout['mentions'] if dids.get(handle)]
+
+
+def facet_models(facet_rows) -> list[models.AppBskyRichtextFacet.Main]:
+    """
+    Converts facets from a database into a list of models
+
+    :param facet_rows: rows of FACETS table
+    :return: list of facet models
+    """
+    ret = []
+    for facet in facet_rows:
+        index = models.AppBskyRichtextFacet.ByteSlice(byte_end=facet.BYTE_END, byte_start=facet.BYTE_START)
+        if facet.TYPE == 'mention':
+            ret.append(models.AppBskyRichtextFacet.Main(features=[models.AppBskyRichtextFacet.Mention(did=facet.URI)], index=index))
+        if facet.TYPE == 'tag':
+            ret.append(models.AppBskyRichtextFacet.Main(features=[models.AppBskyRichtextFacet.Tag(tag=facet.URI)], index=index))
+        if facet.TYPE == 'link':
+            ret.append(models.AppBskyRichtextFacet.Main(features=[models.AppBskyRichtextFacet.Link(uri=facet.URI)], index=index))
+    return ret
+
+
+def build_embed(media_result, blobs: list):
+    """
+    Builds an embed of a reminded post
+
+    :param media_result: rows of MEDIA table of a post
+    :param blobs: uploaded blobs of local images in the same order as media_result
+    :return: embed model or None when a post has no media
+    """
+    if not media_result:
+        return None
+    if media_result[0].IS_FOREIGN == '':
+        return models.AppBskyEmbedImages.Main(images=[models.AppBskyEmbedImages.Image(alt=media.ALT, image=blob)
+                                                      for media, blob in zip(media_result, blobs)])
+    return models.AppBskyEmbedExternal.Main(external=models.AppBskyEmbedExternal.External(description=media_result[0].ALT,
+                                                                                          uri=media_result[0].IS_FOREIGN,
+                                                                                          title=media_result[0].TITLE))
+
+
+def plan_reminder(post_record, bundle) -> list[tuple[str, dict]]:
+    """
+    Plans uploads of media, posts of a title thread and a reminded post
+
+    :param post_record: database record of a post
+    :param bundle: ReminderBundle of a post
+    :return: list of (kind, payload) tuples
+    """
+    return planned_steps(layout_thread(title_segments(*bundle.people())), bundle.local_media_paths(), post_record.TEXT)
+
+
+def post_arguments(payload: dict, done: list[tuple[str, dict]], dids: dict, bundle) -> dict:
+    """
+    Returns arguments of send_post that make a post of a reminder thread
+
+    :param payload: payload of a send_post step
+    :param done: (kind, result) tuples of finished steps in order
+    :param dids: dictionary from a handle mentioned by a title post to its did
+    :param bundle: ReminderBundle of a post, facets and media of a reminded post come from it
+    :return: keyword arguments of send_post
+    """
+    layout = title_layout(payload)
+    if layout is not None:
+        return {'text': layout['text'], 'reply_to': reply_to(done), 'facets': mention_facets(layout, dids) or None}
+    return {'text': payload['text'], 'reply_to': reply_to(done), 'facets': facet_models(bundle.facets) or None,
+            'embed': build_embed(bundle.media, uploaded_blobs(done))}
 
 
 class SendPost:
     """Class that handles sending posts back when its time"""
-    def __init__(self, database_path: str, media_path: str, client: Client):
-        self.database_path = database_path
+    def __init__(self, database: database_control.Database, media_path: str, client: Client, resolver: HandleResolver):
+        self.database = database
         self.media_path = media_path
         self.client = client
+        self.resolver = resolver
+        self.outbox = Outbox(database, BlobCache(database, media_path))
+        self.bundles = {}
+
+    def load(self, records) -> None:
+        """
+        Reads everything a batch of claimed reminders needs at once, instead of a few queries per reminder and mention
+
+        :param records: claimed database records of posts
+        :return:
+        """
+        self.bundles = self.database.load_reminder_bundle([record.ID for record in records])
 
-    def send_partial_post(self, post_root, post_ref, text_builder):
+    def bundle(self, post_record):
+        """
+        Returns a reminder with its people, facets and media, loaded with its batch or read alone and kept until the next batch
+
+        :param post_record: database record of a post
+        :return: ReminderBundle or None if a post does not exist anymore
         """
-        Sends a part of a post
+        if post_record.ID not in self.bundles:
+            self.bundles.update(self.database.load_reminder_bundle([post_record.ID]))
+        return self.bundles.get(post_record.ID)
 
-        :param post_root: root post
-        :param post_ref: reference post
-        :param text_builder: text_builder that will build post
-        :return: tuple with a new root post and post ref
+    def resolve_dids(self, handles: list[str]) -> dict:
         """
-        if not post_root:
-            post_root = models.create_strong_ref(self.client.send_post(text_builder))
-        else:
-            if post_ref is None:
-                post_ref = post_root
-            post_ref = models.create_strong_ref(
-                self.client.send_post(text_builder, reply_to=models.AppBskyFeedPost.ReplyRef(parent=post_ref, root=post_root)))
-        return [post_root, post_ref]
+        Resolves handles of all mentions in a title
 
-    def send_all_mentions_from_a_post(self, mentions: list[str], char_count, text_builder, refs):
+        :param handles: mentioned handles
+        :return: dictionary from a handle to its did or None if a handle could not be resolved
         """
+        dids = {}
+        for handle in handles:
+            if handle not in dids:
+                try:
+                    dids[handle] = self.resolver.get_did(self.client, handle)
+                except atproto_client.exceptions.BadRequestError:
+                    dids[handle] = None
+        return dids
 
-        :param refs: references to previous posts in a thread
-        :param text_builder: text_builder that will build post
-        :param char_count: number of characters to send per post
-        :param mentions: list of mentions
-        :return: tuple with char_count text builder and refs
+    def execute_step(self, post_record, step, done: list[tuple[str, dict]]) -> dict:
         """
-        for mention in mentions:
-            if char_count + len(mention) + 2 > 300:
-                refs[0], refs[1] = self.send_partial_post(refs[0], refs[1], text_builder)
-                char_count = 0
-                text_builder = client_utils.TextBuilder()
+        Makes one request of a reminder
+
+        :param post_record: database record of a post
+        :param step: row of OUTBOX
+        :param done: (kind, result) tuples of finished steps in order
+        :return: result of a step
+        """
+        payload = payload_of(step)
+        if step.KIND == UPLOAD_BLOB:
+            return blob_result(self.outbox.blob_cache.get_blobs(self.client, [payload['path']])[0])
+        dids = self.resolve_dids(mentioned_handles([payload]))
+        return post_result(self.client.send_post(**post_arguments(payload, done, dids, self.bundle(post_record))))
+
+    def make_steps(self, post_record, steps: list, done: list[tuple[str, dict]]) -> str:
+        """
+        Makes steps of a reminder in order and appends their results to done
+
+        :param post_record: database record of a post
+        :param steps: rows of OUTBOX to make
+        :param done: (kind, result) tuples of finished steps in order
+        :return: DONE when every step was made, PENDING when a failed step waits for a retry, FAILED when it failed for good
+                 and a reminder was abandoned
+        """
+        for step in steps:
             try:
-                text_builder.mention(text=('@' + mention + ' '), did=self.client.resolve_handle(mention).did)
-            except atproto_client.exceptions.BadRequestError:
-                text_builder.text(str('@' + mention + ' '))
-            char_count += len('@' + mention + ' ')
-        return [char_count, text_builder, refs]
+                result = self.execute_step(post_record, step, done)
+            except STEP_ERRORS as e:
+                return self.outbox.settle(post_record, step, e)
+            self.outbox.advance(step, result, done)
+        return DONE
 
-    def post_remind_title(self, author_post: str, author_remind: str, mentions: list[str]):
+    def prepare(self, post_record):
         """
-        Creates post that will be a title of a reminder post
+        Plans a reminder, resolves handles of its title and uploads its media, everything before its first post
 
-        :param author_post: author of an original post
-        :param author_remind: author of a reminder
-        :param mentions: mentions from a reminder
-        :return:
+        :param post_record: database record of a post
+        :return: (kind, result) tuples of finished steps and rows of posts still to make, or None if an upload waits for a retry,
+                 a step failed for good or a reminder was deleted after it was claimed
         """
-        post_root = None
-        post_ref = None
-        char_count = 0
-        text_builder = client_utils.TextBuilder()
-        text_builder.text("Hi! Here's a reminder for you! ")
-        char_count += len("Hi! Here's a reminder for you! ")
-        char_count, text_builder, [post_root, post_ref] = self.send_all_mentions_from_a_post(mentions, char_count,
-                                                                                             text_builder,
-                                                                                             [post_root, post_ref])
-        if char_count + len("\nAnd this reminder is brought to you by: ") > 300:
-            post_root, post_ref = self.send_partial_post(post_root, post_ref, text_builder)
-            char_count = 0
-            text_builder = client_utils.TextBuilder()
-        text_builder.text("\nAnd this reminder is brought to you by: ")
-        char_count += len("\nAnd this reminder is brought to you by: ")
-        if char_count + len('@' + author_remind) > 300:
-            post_root, post_ref = self.send_partial_post(post_root, post_ref, text_builder)
-            char_count = 0
-            text_builder = client_utils.TextBuilder()
-        try:
-            text_builder.mention(text=('@' + author_remind), did=self.client.resolve_handle(author_remind).did)
-        except atproto_client.exceptions.BadRequestError:
-            text_builder.text(str('@' + author_remind))
-        char_count += len('@' + author_remind)
-        if char_count + len("\nOriginal post was created by: ") > 300:
-            post_root, post_ref = self.send_partial_post(post_root, post_ref, text_builder)
-            char_count = 0
-            text_builder = client_utils.TextBuilder()
-        text_builder.text("\nOriginal post was created by: ")
-        char_count += len("\nOriginal post was created by: ")
-        if char_count + len('@' + author_post) > 300:
-            post_root, post_ref = self.send_partial_post(post_root, post_ref, text_builder)
-            char_count = 0
-            text_builder = client_utils.TextBuilder()
-        try:
-            text_builder.mention(text=('@' + author_post), did=self.client.resolve_handle(author_post).did)
-        except atproto_client.exceptions.BadRequestError:
-            text_builder.text(str('@' + author_post))
-        char_count += len('@' + author_post)
-        if post_root is None:
-            post_root = post_ref
-        if post_root is None:
-            post_ref = models.create_strong_ref(self.client.send_post(text_builder))
-        else:
-            post_ref = models.create_strong_ref(
-                self.client.send_post(text_builder, reply_to=models.AppBskyFeedPost.ReplyRef(parent=post_ref, root=post_root)))
-        if not post_root:
-            post_root = post_ref
-        return tuple([post_ref, post_root])
-
-    def post_remind(self, post_ref, post_record) -> None:
-        """
-        Posts a reminder
-
-        :param post_record: post that will be reminded
-        :param post_ref: references to posts
-        :return:
+        bundle = self.bundle(post_record)
+        started = None if bundle is None else self.outbox.start(post_record, plan_reminder(post_record, bundle))
+        if started is None:
+            return None
+        done, pending = started
+        self.resolve_dids(mentioned_handles([payload_of(step) for step in pending]))
+        if self.make_steps(post_record, [step for step in pending if step.KIND == UPLOAD_BLOB], done) != DONE:
+            return None
+        return done, [step for step in pending if step.KIND != UPLOAD_BLOB]
+
+    def post(self, post_record, done: list[tuple[str, dict]], posts: list) -> bool:
         """
-        database = database_control.Database(self.database_path)
-        facets = self.resolve_facets(post_record.ID)
-        media_result = database.get_media_by_post_id(post_record.ID)
-        if not facets:
-            facets = None
-        if not media_result:
-            self.client.send_post(text=post_record.TEXT, reply_to=models.AppBskyFeedPost.ReplyRef(parent=post_ref[0], root=post_ref[1]),
-                                  facets=facets)
-        else:
-            images = []
-            if media_result[0].IS_FOREIGN == '':
-                for media in media_result:
-                    with open(self.media_path + '/' + media.PATH, 'rb') as f:
-                        upload = self.client.com.atproto.repo.upload_blob(f.read())
-                        images.append(models.AppBskyEmbedImages.Image(alt=media.ALT, image=upload.blob))
-                self.client.send_post(text=post_record.TEXT, reply_to=models.AppBskyFeedPost.ReplyRef(parent=post_ref[0], root=post_ref[1]),
-                                      embed=models.AppBskyEmbedImages.Main(images=images), facets=facets)
-            else:
-                self.client.send_post(text=post_record.TEXT, reply_to=models.AppBskyFeedPost.ReplyRef(parent=post_ref[0], root=post_ref[1]),
-                                      embed=models.AppBskyEmbedExternal.Main(
-                                          external=models.AppBskyEmbedExternal.External(description=media_result[0].ALT,
-                                                                                        uri=media_result[0].IS_FOREIGN,
-                                                                                        title=media_result[0].TITLE)), facets=facets)
-
-    def resolve_mentions(self, post_id) -> list[str]:
-        """
-        Resolves mentions from a post
-
-        :param post_id: id of a post
-        :return: list of handles of people mentioned
-        """
-
-        handle_mentions = []
-        for mention in database_control.Database(self.database_path).get_mentions(post_id):
-            handle_mentions.append(database_control.Database(self.database_path).get_person_handle(mention.PERSON_ID))
-        return handle_mentions
-
-    def send_reminder(self, post_record) -> None:
-        """
-        Sends a reminder
+        Makes posts of a prepared reminder, each replying to the previous one, and marks a reminder as sent
 
         :param post_record: database record of a post
-        :return:
+        :param done: (kind, result) tuples of finished steps in order
+        :param posts: rows of OUTBOX of posts still to make
+        :return: False if a failed post waits for a retry or failed for good
         """
+        if self.make_steps(post_record, posts, done) != DONE:
+            return False
+        self.outbox.finish(post_record)
+        return True
 
-        database = database_control.Database(self.database_path)
-        title_post = self.post_remind_title(database.get_person_handle(post_record.AUTHOR_POST),
-                                            database.get_person_handle(post_record.AUTHOR_REMIND),
-                                            self.resolve_mentions(post_record.ID))
-        self.post_remind([title_post[0], title_post[1]], post_record)
-        if post_record.EVERY_N_SECONDS == 0:
-            database_control.Database(self.database_path).delete_post_by_id(post_record.ID, self.media_path)
-        else:
-            database_control.Database(self.database_path).update_post_time_remind(post_record)
+    def dispatch(self, post_record) -> bool:
+        """
+        Makes every step of a reminder that is not done yet, in order
 
-    def resolve_facets(self, post_id) -> list[models.AppBskyRichtextFacet]:
+        :param post_record: database record of a post
+        :return: False if a failed step waits for a retry or failed for good
         """
-        Converts all facets from a post into a list of models
+        prepared = self.prepare(post_record)
+        return prepared is not None and self.post(post_record, *prepared)
 
-        :param post_id: id of a post
-        :return:
+    def send_reminder(self, post_record) -> bool:
+        """
+        Sends a reminder through the outbox and reschedules it if it repeats
+
+        A reminder that was already sent for its fire time by an instance that lost its lease is only rescheduled.
+
+        :param post_record: database record of a post
+        :return: True if a reminder will not be sent anymore and can be archived
         """
-        ret = []
-        for facet in database_control.Database(self.database_path).get_facets_by_post_id(post_id):
-            if facet.TYPE == 'mention':
-                ret.append(models.AppBskyRichtextFacet.Main(features=[models.AppBskyRichtextFacet.Mention(did=facet.URI)],
-                                                            index=models.AppBskyRichtextFacet.ByteSlice(byte_end=facet.BYTE_END,
-                                                                                                        byte_start=facet.BYTE_START)))
-            if facet.TYPE == 'tag':
-                ret.append(models.AppBskyRichtextFacet.Main(features=[models.AppBskyRichtextFacet.Tag(tag=facet.URI)],
-                                                            index=models.AppBskyRichtextFacet.ByteSlice(byte_end=facet.BYTE_END,
-                                                                                                        byte_start=facet.BYTE_START)))
-            if facet.TYPE == 'link':
-                ret.append(models.AppBskyRichtextFacet.Main(features=[models.AppBskyRichtextFacet.Link(uri=facet.URI)],
-                                                            index=models.AppBskyRichtextFacet.ByteSlice(byte_end=facet.BYTE_END,
-                                                                                                        byte_start=facet.BYTE_START)))
-        return ret
-
-
-def send_main(app_handle, app_password, database_path, media_path) -> None:
+        if post_record.SENT_FIRE_TIME != post_record.TIME_TO_REMIND and not self.dispatch(post_record):
+            return False
+        return self.finalize(post_record)
+
+    def finalize(self, post_record) -> bool:
+        """
+        Reschedules a sent reminder if it repeats
+
+        :param post_record: database record of a post
+        :return: True if a reminder will not be sent anymore and can be archived
+        """
+        return not self.database.update_post_time_remind(post_record, int(time()))
+
+
+def send_main(app_handle, app_password, database: database_control.Database, media_path, resolver: HandleResolver) -> None:
     """
-    Main function that checks time and gets all reminder that must be sent in that minute
+    Main function that claims and sends every reminder that is due, including the ones it fell behind on
+
+    Reminders are leased in small batches, so several instances sharing a database split due reminders between them.
+    A batch goes through a SendPipeline, so reminders of a batch are prepared while earlier ones are being posted.
 
-    :param database_path: path to a database
+    :param database: database shared by the whole process
     :param media_path: path to media folder
     :param app_handle: handle of a program
     :param app_password: password of a program
+    :param resolver: cache of handles shared by the whole process
     :return:
     """
 
-    client = Client()
+    client = Client(request=RateLimitAwareRequest())
     client.login(app_handle, app_password)
-    send_post = SendPost(database_path, media_path, client)
+    send_post = SendPost(database, media_path, client, resolver)
+    pipeline = SendPipeline(send_post, prepare_workers=int(os.getenv('SEND_PREPARE_WORKERS', str(PREPARE_WORKERS))),
+                            post_workers=int(os.getenv('SEND_POST_WORKERS', str(POST_WORKERS))))
+    reminder_queue = ReminderQueue()
+    database.listeners.append(reminder_queue)
+    reminder_queue.load(database.get_pending_reminders())
+    poller = AdaptivePoller(MIN_SEND_SLEEP_SEC, MAX_SEND_SLEEP_SEC)
     while True:
-        for record in database_control.Database(database_path).get_posts_by_time_to_remind(
-                datetime.now().astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M")):
-            send_post.send_reminder(record)
-        sleep(SEND_POST_DELAY_SEC)
+        claimed = 0
+        while records := database.claim_due_posts(int(time()), limit=CLAIM_BATCH_SIZE):
+            claimed += len(records)
+            archive_posts(database, pipeline.run(records), media_path)
+        if claimed:
+            print("Send pipeline:", pipeline.metrics())
+            print("Send poller:", poller.metrics())
+        poller.record(claimed)
+        poller.record_rate_limit(client.request.rate_limit)
+        sleep(poller.rate_limit_delay())
+        reminder_queue.wait_for_due(poller.next_delay())
@@ -1,5 +1,6 @@
 """Classes to work with database"""
 import datetime
+from modules.recurrence import Recurrence
 
 
 class Post:
@@ -12,7 +13,7 @@ class Post:
         self.author_post = ""
         self.time_to_remind = ""
         self.people_remind = ""
-        self.every_n_seconds = ""
+        self.recurrence = None
 
     def set_time_to_remind(self, time_to_remind: str):
         """
@@ -66,7 +67,25 @@ class Post:
         :param every_n_seconds: how often will post be reminded
         :return:
         """
-        self.every_n_seconds = every_n_seconds
+        self.recurrence = Recurrence.from_seconds(int(every_n_seconds or 0))
+
+    def set_recurrence(self, recurrence: Recurrence):
+        """
+        Set a rule of a repeating reminder
+
+        :param recurrence: rule or None for a reminder that is sent once
+        :return:
+        """
+        self.recurrence = recurrence
+
+    @property
+    def every_n_seconds(self) -> int:
+        """
+        Returns an approximate period of a repeating reminder
+
+        :return: period in seconds, 0 for a reminder that is sent once
+        """
+        return 0 if self.recurrence is None else self.recurrence.approximate_seconds()
 
     def set_text(self, text):
         """
@@ -132,3 +151,78 @@ class Media:
         :return:
         """
         self.title = title
+
+
+class Facet:
+    """Class representing a facet"""
+
+    def __init__(self):
+        self.byte_start = 0
+        self.byte_end = 0
+        self.facet_type = ""
+        self.uri = ""
+        self.post_id = ""
+
+    def set_index(self, index):
+        """
+        Set byte_start and byte_end attributes
+
+        :param index: indexes of a facet
+        :return:
+        """
+        self.byte_start, self.byte_end = index
+
+    def set_facet_type(self, facet_type):
+        """
+        Set facet_type attribute
+
+        :param facet_type: mention, tag or link
+        :return:
+        """
+        self.facet_type = facet_type
+
+    def set_uri(self, uri):
+        """
+        Set uri attribute
+
+        :param uri: did, tag or uri of a facet
+        :return:
+        """
+        self.uri = uri
+
+    def set_post_id(self, post_id):
+        """
+        Set id of a post attribute
+
+        :param post_id: id of a post
+        :return:
+        """
+        self.post_id = post_id
+
+
+class ReminderBundle:
+    """Class representing a reminder with everything sending it needs, read by Database.load_reminder_bundle"""
+
+    def __init__(self, post, author_post: str, author_remind: str):
+        self.post = post
+        self.author_post = author_post
+        self.author_remind = author_remind
+        self.mentions = []
+        self.facets = []
+        self.media = []
+
+    def people(self) -> tuple:
+        """
+        Returns handles of people of a reminder
+
+        :return: tuple of an author of an original post, an author of a reminder and mentions
+        """
+        return self.author_post, self.author_remind, self.mentions
+
+    def local_media_paths(self) -> list[str]:
+        """
+        Returns names of media files to upload
+
+        :return: paths of local images, empty for a post without media or with an external link
+        """
+        return [media.PATH for media in self.media] if self.media and self.media[0].IS_FOREIGN == '' else []
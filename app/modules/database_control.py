@@ -1,10 +1,83 @@
 """File with class that work with database"""
 import os
-from datetime import timedelta
+from datetime import datetime, timezone
 import sqlalchemy as db
-from dateutil.parser import parse
 from sqlalchemy import Column, Integer, String, ForeignKey
-from modules.classes import Post, Media
+from modules.classes import Post, Media, Facet, ReminderBundle
+from modules.recurrence import anchored_rule, next_fire_times
+from modules.storage import DEFAULT_MAX_OVERFLOW, DEFAULT_POOL_SIZE, Storage, writes
+
+CLAIM_TIMEOUT_SEC = 600
+FAILED_STEP = 'failed'
+TIME_COLUMNS = ('TIME_TO_REMIND', 'TIME_SEND_REQUEST')
+
+METADATA = db.MetaData()
+PEOPLE_TABLE = db.Table('PEOPLE', METADATA,
+                        Column('ID', Integer, primary_key=True),
+                        Column('HANDLE', String, index=True),
+                        Column('DID', String, index=True),
+                        Column('RESOLVED_AT', Integer))
+POST_TABLE = db.Table('POSTS', METADATA,
+                      Column('ID', Integer, primary_key=True),
+                      Column('TEXT', String),
+                      Column('TIME_TO_REMIND', Integer, index=True),
+                      Column('AUTHOR_REMIND', Integer, ForeignKey(PEOPLE_TABLE.c.ID)),
+                      Column('AUTHOR_POST', Integer, ForeignKey(PEOPLE_TABLE.c.ID)),
+                      Column('EVERY_N_SECONDS', Integer),
+                      Column('RECURRENCE', String),
+                      Column('TIME_SEND_REQUEST', Integer),
+                      Column('CLAIMED_AT', Integer),
+                      Column('CLAIMED_BY', String),
+                      Column('LEASE_UNTIL', Integer),
+                      Column('SENT_FIRE_TIME', Integer),
+                      db.Index('ix_POSTS_AUTHOR_REMIND_TIME_SEND_REQUEST', 'AUTHOR_REMIND', 'TIME_SEND_REQUEST'))
+PERSON_POST_MENTION_TABLE = db.Table('PERSON_POST_MENTION', METADATA,
+                                     Column('ID', Integer, primary_key=True),
+                                     Column('POST_ID', Integer, ForeignKey(POST_TABLE.c.ID, ondelete='CASCADE'), index=True),
+                                     Column('PERSON_ID', Integer, ForeignKey(PEOPLE_TABLE.c.ID)))
+MEDIA_TABLE = db.Table('MEDIA', METADATA,
+                       Column('ID', Integer, primary_key=True),
+                       Column('PATH', String, index=True),
+                       Column('ALT', String),
+                       Column('IS_FOREIGN', String),
+                       Column('TITLE', String),
+                       Column('POST_ID', Integer, ForeignKey(POST_TABLE.c.ID, ondelete='CASCADE'), index=True))
+FACETS_TABLE = db.Table('FACETS', METADATA,
+                        Column('ID', Integer, primary_key=True),
+                        Column('BYTE_START', Integer),
+                        Column('BYTE_END', Integer),
+                        Column('TYPE', String),
+                        Column('URI', String),
+                        Column('POST_ID', Integer, ForeignKey(POST_TABLE.c.ID, ondelete='CASCADE'), index=True))
+NOTIFICATIONS_TABLE = db.Table('NOTIFICATIONS', METADATA,
+                               Column('ID', Integer, primary_key=True),
+                               Column('CID', String, index=True, unique=True))
+STATE_TABLE = db.Table('BOT_STATE', METADATA,
+                       Column('KEY', String, primary_key=True),
+                       Column('VALUE', String))
+LEASES_TABLE = db.Table('LEASES', METADATA,
+                        Column('NAME', String, primary_key=True),
+                        Column('HOLDER', String),
+                        Column('EXPIRES_AT', Integer))
+OUTBOX_TABLE = db.Table('OUTBOX', METADATA,
+                        Column('ID', Integer, primary_key=True),
+                        Column('POST_ID', Integer, ForeignKey(POST_TABLE.c.ID, ondelete='CASCADE')),
+                        Column('FIRE_TIME', Integer),
+                        Column('STEP', Integer),
+                        Column('KIND', String),
+                        Column('PAYLOAD', String),
+                        Column('STATE', String),
+                        Column('ATTEMPTS', Integer, default=0),
+                        Column('NEXT_ATTEMPT_AT', Integer),
+                        Column('RESULT', String),
+                        Column('LAST_ERROR', String),
+                        db.UniqueConstraint('POST_ID', 'FIRE_TIME', 'STEP'))
+BLOB_CACHE_TABLE = db.Table('BLOB_CACHE', METADATA,
+                            Column('HASH', String, primary_key=True),
+                            Column('CID', String),
+                            Column('MIME_TYPE', String),
+                            Column('SIZE', Integer),
+                            Column('UPLOADED_AT', Integer))
 
 
 def convert_date(time) -> str:
@@ -17,46 +90,228 @@ def convert_date(time) -> str:
     return time.split('T')[0] + " " + time.split('T')[1].split('.')[0]
 
 
-class Database:
-    """Class that handles database operations"""
+def to_epoch(time: str) -> int:
+    """
+    Converts a date in UTC into a unix timestamp that is stored in a database
 
-    def __init__(self, database_location):
-        self.engine = db.create_engine("sqlite:///" + database_location)
-        self.connection = self.engine.connect()
-        self.people_table = db.Table('PEOPLE', db.MetaData(),
-                                     Column('ID', Integer, primary_key=True),
-                                     Column('HANDLE', String))
-        self.post_table = db.Table('POSTS', db.MetaData(),
-                                   Column('ID', Integer, primary_key=True),
-                                   Column('TEXT', String),
-                                   Column('TIME_TO_REMIND', String),
-                                   Column('AUTHOR_REMIND', Integer, ForeignKey(self.people_table.c.ID)),
-                                   Column('AUTHOR_POST', Integer, ForeignKey(self.people_table.c.ID)),
-                                   Column('EVERY_N_SECONDS', Integer),
-                                   Column('TIME_SEND_REQUEST', String))
-        self.person_mention_post = db.Table('PERSON_POST_MENTION', db.MetaData(),
-                                            Column('ID', Integer, primary_key=True),
-                                            Column('POST_ID', Integer, ForeignKey(self.post_table.c.ID)),
-                                            Column('PERSON_ID', Integer, ForeignKey(self.post_table.c.ID)))
-        self.media_table = db.Table('MEDIA', db.MetaData(),
-                                    Column('ID', Integer, primary_key=True),
-                                    Column('PATH', String),
-                                    Column('ALT', String),
-                                    Column('IS_FOREIGN', String),
-                                    Column('TITLE', String),
-                                    Column('POST_ID', Integer, ForeignKey(self.post_table.c.ID)))
-        self.facets_table = db.Table('FACETS', db.MetaData(),
-                                     Column('ID', Integer, primary_key=True),
-                                     Column('BYTE_START', Integer),
-                                     Column('BYTE_END', Integer),
-                                     Column('TYPE', String),
-                                     Column('URI', String),
-                                     Column('POST_ID', Integer, ForeignKey(self.post_table.c.ID)))
-        self.post_table.create(self.engine, checkfirst=True)
-        self.people_table.create(self.engine, checkfirst=True)
-        self.person_mention_post.create(self.engine, checkfirst=True)
-        self.media_table.create(self.engine, checkfirst=True)
-        self.facets_table.create(self.engine, checkfirst=True)
+    :param time: date in '%Y-%m-%d %H:%M:%S' or '%Y-%m-%d %H:%M' format
+    :return: number of seconds since epoch
+    """
+    time_format = '%Y-%m-%d %H:%M:%S' if time.count(':') == 2 else '%Y-%m-%d %H:%M'
+    return int(datetime.strptime(time, time_format).replace(tzinfo=timezone.utc).timestamp())
+
+
+def _rebuild_table(connection, table: db.Table) -> None:
+    """
+    Rebuilds a table into its current definition, which is the only way SQLite can change types and foreign keys
+
+    Times stored as '%Y-%m-%d %H:%M[:%S]' strings are converted into unix timestamps on the way.
+
+    :param connection: connection in a transaction with foreign keys turned off
+    :param table: current definition of a table
+    :return:
+    """
+    existing = {column['name'] for column in db.inspect(connection).get_columns(table.name)}
+    copied = [column.name for column in table.c if column.name in existing]
+    expressions = ['CASE WHEN typeof("' + name + '") = \'text\' THEN CAST(strftime(\'%s\', "' + name + '") AS INTEGER) ELSE "' +
+                   name + '" END' if name in TIME_COLUMNS else '"' + name + '"' for name in copied]
+    create = str(db.schema.CreateTable(table).compile(dialect=connection.dialect))
+    connection.exec_driver_sql(create.replace('"' + table.name + '"', '"' + table.name + '_NEW"', 1))
+    connection.exec_driver_sql('INSERT INTO "' + table.name + '_NEW" (' + ', '.join('"' + name + '"' for name in copied) + ') SELECT ' +
+                               ', '.join(expressions) + ' FROM "' + table.name + '"')
+    connection.exec_driver_sql('DROP TABLE "' + table.name + '"')
+    connection.exec_driver_sql('ALTER TABLE "' + table.name + '_NEW" RENAME TO "' + table.name + '"')
+
+
+def _add_missing_columns(connection) -> None:
+    """
+    Migration 1: appends columns that were added to tables since a database was created
+
+    :param connection: connection in a transaction with foreign keys turned off
+    :return:
+    """
+    for table in METADATA.sorted_tables:
+        existing = {column['name'] for column in db.inspect(connection).get_columns(table.name)}
+        for column in table.c:
+            if column.name not in existing:
+                connection.exec_driver_sql('ALTER TABLE "' + table.name + '" ADD COLUMN "' + column.name + '" ' +
+                                           column.type.compile(connection.dialect))
+
+
+def _typed_times(connection) -> None:
+    """
+    Migration 2: stores TIME_TO_REMIND and TIME_SEND_REQUEST of POSTS as INTEGER unix timestamps
+
+    :param connection: connection in a transaction with foreign keys turned off
+    :return:
+    """
+    _rebuild_table(connection, POST_TABLE)
+
+
+def _cascading_foreign_keys(connection) -> None:
+    """
+    Migration 3: points PERSON_ID at PEOPLE and deletes rows of a post together with it
+
+    Rows of posts that were already deleted are dropped, the old code could leave them behind.
+
+    :param connection: connection in a transaction with foreign keys turned off
+    :return:
+    """
+    for table in (PERSON_POST_MENTION_TABLE, MEDIA_TABLE, FACETS_TABLE):
+        connection.exec_driver_sql('DELETE FROM "' + table.name + '" WHERE "POST_ID" IS NULL OR "POST_ID" NOT IN (SELECT "ID" FROM "POSTS")')
+        _rebuild_table(connection, table)
+
+
+def _claim_leases(connection) -> None:
+    """
+    Migration 4: claims of posts become leases held by a named bot instance until LEASE_UNTIL
+
+    :param connection: connection in a transaction with foreign keys turned off
+    :return:
+    """
+    _add_missing_columns(connection)
+    connection.exec_driver_sql('UPDATE "POSTS" SET "LEASE_UNTIL" = "CLAIMED_AT" + ' + str(CLAIM_TIMEOUT_SEC) + ' WHERE "CLAIMED_AT" IS NOT NULL')
+
+
+MIGRATIONS = (_add_missing_columns, _typed_times, _cascading_foreign_keys, _claim_leases)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(engine) -> int:
+    """
+    Brings a database to SCHEMA_VERSION, which is stored in PRAGMA user_version
+
+    A new database is created at the current version. An existing one runs every migration it has not run yet, each
+    in its own transaction together with the version bump, so an interrupted upgrade resumes where it stopped.
+    Indexes of the current schema are created at the end. Migrations move SQLite files written by older versions of
+    the bot, other backends always start at the current schema.
+
+    :param engine: engine of a database
+    :return: version a database had before
+    """
+    fresh = not db.inspect(engine).has_table(POST_TABLE.name)
+    METADATA.create_all(engine)
+    if engine.dialect.name != 'sqlite':
+        return SCHEMA_VERSION
+    with engine.connect() as connection:
+        connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        version = SCHEMA_VERSION if fresh else connection.exec_driver_sql('PRAGMA user_version').scalar()
+        connection.commit()
+        for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+            with connection.begin():
+                connection.exec_driver_sql('BEGIN')
+                migration(connection)
+                connection.exec_driver_sql('PRAGMA user_version = ' + str(number))
+        with connection.begin():
+            connection.exec_driver_sql('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+            for table in METADATA.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+        connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+        connection.commit()
+    return version
+
+
+def claim_statement(now: int, node_id: str, claim_timeout=CLAIM_TIMEOUT_SEC, limit=None):
+    """
+    Builds a statement that leases due posts to a bot instance and returns them
+
+    Due posts are picked by a subquery with FOR UPDATE SKIP LOCKED, so on PostgreSQL several bot instances claim
+    disjoint posts without waiting for each other. SQLite has a single writer and leaves the clause out. A post with an
+    OUTBOX step that failed for good at its current fire time is not claimed, it stays in a database for inspection.
+
+    :param now: current unix timestamp
+    :param node_id: name of a bot instance that takes a lease
+    :param claim_timeout: number of seconds a lease lasts, afterwards another instance may claim a post again
+    :param limit: maximum number of claimed posts, None claims all of them
+    :return: UPDATE ... RETURNING statement
+    """
+    failed = db.select(OUTBOX_TABLE.c.ID).where(
+        OUTBOX_TABLE.c.POST_ID == POST_TABLE.c.ID, OUTBOX_TABLE.c.FIRE_TIME == POST_TABLE.c.TIME_TO_REMIND,
+        OUTBOX_TABLE.c.STATE == FAILED_STEP)
+    due = db.select(POST_TABLE.c.ID).where(
+        POST_TABLE.c.TIME_TO_REMIND <= now,
+        db.or_(POST_TABLE.c.LEASE_UNTIL.is_(None), POST_TABLE.c.LEASE_UNTIL <= now),
+        ~failed.exists()
+    ).order_by(POST_TABLE.c.TIME_TO_REMIND, POST_TABLE.c.ID).limit(limit).with_for_update(skip_locked=True)
+    return db.update(POST_TABLE).where(POST_TABLE.c.ID.in_(due)).values(
+        CLAIMED_AT=now, CLAIMED_BY=node_id, LEASE_UNTIL=now + claim_timeout).returning(*POST_TABLE.c)
+
+
+def get_state(database, key: str, default=None):
+    """
+    Returns a value that a bot stored between its runs
+
+    :param database: database where a value is stored
+    :param key: name of a value
+    :param default: value returned when nothing is stored
+    :return: stored string or default
+    """
+    stmt = db.select(STATE_TABLE.c.VALUE).where(STATE_TABLE.c.KEY == key)
+    with database.transaction() as connection:
+        value = connection.execute(stmt).scalar()
+    return default if value is None else value
+
+
+@writes
+def set_state(database, key: str, value: str) -> None:
+    """
+    Stores a value that a bot needs between its runs
+
+    :param database: database where a value will be stored
+    :param key: name of a value
+    :param value: string that will be stored
+    :return:
+    """
+    with database.transaction() as connection:
+        if not connection.execute(db.update(STATE_TABLE).where(STATE_TABLE.c.KEY == key).values(VALUE=value)).rowcount:
+            connection.execute(db.insert(STATE_TABLE).values(KEY=key, VALUE=value))
+
+
+def remove_unreferenced_media(connection, media_path: str, paths) -> None:
+    """
+    Removes local media files that no row of MEDIA refers to anymore
+
+    Files are named by CID of an image, so one file may be shared by many reminders and MEDIA rows are its references.
+
+    :param connection: connection of an open transaction
+    :param media_path: path to media folder
+    :param paths: names of files in media folder that lost a reference
+    :return:
+    """
+    paths = set(paths)
+    if not paths:
+        return
+    stmt = db.select(MEDIA_TABLE.c.PATH).where(MEDIA_TABLE.c.PATH.in_(paths)).distinct()
+    for path in paths - set(connection.execute(stmt).scalars()):
+        if os.path.exists(media_path + '/' + path):
+            os.remove(media_path + '/' + path)
+
+
+class Database(Storage):
+    """
+    Class that handles database operations
+
+    One instance is meant to be shared by the whole process: it owns the engine with its connection pool and
+    creates the schema once, while every thread gets its own pooled connection through transaction().
+    Methods that write run on the writer thread of Storage. Objects in listeners are told about scheduled and
+    cancelled reminders once the change is committed.
+    """
+
+    people_table = PEOPLE_TABLE
+    post_table = POST_TABLE
+    person_mention_post = PERSON_POST_MENTION_TABLE
+    media_table = MEDIA_TABLE
+    facets_table = FACETS_TABLE
+    notification_table = NOTIFICATIONS_TABLE
+    state_table = STATE_TABLE
+    blob_cache_table = BLOB_CACHE_TABLE
+    lease_table = LEASES_TABLE
+    outbox_table = OUTBOX_TABLE
+
+    def __init__(self, database_location, pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW, profile=None):
+        super().__init__(database_location, pool_size, max_overflow, profile)
+        migrate(self.engine)
 
     def find_person(self, handle: str) -> int:
         """
@@ -66,10 +321,12 @@ class Database:
         :return: id of a person in a database or -1 if person was not found
         """
         stmt = db.select(self.people_table).where(self.people_table.c.HANDLE == handle)
-        for row in self.connection.execute(stmt):
-            return row.ID
+        with self.transaction() as connection:
+            for row in connection.execute(stmt):
+                return row.ID
         return -1
 
+    @writes
     def insert_person(self, handle: str) -> int:
         """
         Inserts person into a database
@@ -78,10 +335,11 @@ class Database:
         :return: id of an inserted person
         """
         stmt = db.insert(self.people_table).values(HANDLE=handle)
-        result = self.connection.execute(stmt)
-        self.connection.commit()
+        with self.transaction() as connection:
+            result = connection.execute(stmt)
         return result.inserted_primary_key[0]
 
+    @writes
     def find_person_or_insert(self, handle: str) -> int:
         """
         Find a person's id in a database or inserts them to a database
@@ -95,45 +353,73 @@ class Database:
             ind = self.insert_person(handle)
         return ind
 
-    def insert_person_post_mention(self, post_ind: int, post: Post) -> None:
+    def _upsert_people(self, connection, handles) -> dict:
         """
-        Inserts mentions from a post into a database
+        Finds people in a database and inserts the missing ones with one statement
 
-        :param post_ind: id of a post
-        :param post: inserted post
-        :return:
-         """
-
-        if not post.people_remind:
-            post.people_remind = [post.author_remind]
-        for person in post.people_remind:
-            ind = self.find_person(person)
-            if ind == -1:
-                ind = self.insert_person(person)
-            stmt = db.insert(self.person_mention_post).values(POST_ID=post_ind, PERSON_ID=ind)
-            self.connection.execute(stmt)
-            self.connection.commit()
+        :param connection: connection of a current transaction
+        :param handles: handles of people
+        :return: dictionary from a handle to id of a person
+        """
+        handles = set(handles)
+        stmt = db.select(self.people_table.c.ID, self.people_table.c.HANDLE).where(self.people_table.c.HANDLE.in_(handles))
+        people = {row.HANDLE: row.ID for row in connection.execute(stmt)}
+        missing = [{'HANDLE': handle} for handle in handles if handle not in people]
+        if missing:
+            connection.execute(db.insert(self.people_table), missing)
+            people.update({row.HANDLE: row.ID for row in connection.execute(stmt)})
+        return people
 
+    @writes
     def insert_post(self, post_insert: Post) -> int:
         """
-        Inserts post into a database
+        Inserts post into a database together with its authors and people who will be reminded
 
         :param post_insert: post that will be inserted
         :return: id of an inserted post
         """
 
-        date = convert_date(post_insert.time_send_request)
-        time_to_remind = post_insert.time_to_remind
-        author_post = self.find_person_or_insert(post_insert.author_post)
-        author_remind = self.find_person_or_insert(post_insert.author_remind)
-        stmt = db.insert(self.post_table).values(TEXT=post_insert.text, AUTHOR_REMIND=author_remind, TIME_SEND_REQUEST=date,
-                                                 AUTHOR_POST=author_post, TIME_TO_REMIND=time_to_remind,
-                                                 EVERY_N_SECONDS=post_insert.every_n_seconds)
-        result = self.connection.execute(stmt)
-        self.insert_person_post_mention(result.inserted_primary_key[0], post_insert)
-        self.connection.commit()
-        return result.inserted_primary_key[0]
+        date = to_epoch(convert_date(post_insert.time_send_request))
+        time_to_remind = to_epoch(post_insert.time_to_remind)
+        if not post_insert.people_remind:
+            post_insert.people_remind = [post_insert.author_remind]
+        with self.transaction() as connection:
+            people = self._upsert_people(connection, [post_insert.author_post, post_insert.author_remind, *post_insert.people_remind])
+            stmt = db.insert(self.post_table).values(TEXT=post_insert.text, AUTHOR_REMIND=people[post_insert.author_remind],
+                                                     TIME_SEND_REQUEST=date, AUTHOR_POST=people[post_insert.author_post],
+                                                     TIME_TO_REMIND=time_to_remind, EVERY_N_SECONDS=post_insert.every_n_seconds,
+                                                     RECURRENCE=anchored_rule(post_insert.recurrence, time_to_remind))
+            post_id = connection.execute(stmt).inserted_primary_key[0]
+            connection.execute(db.insert(self.person_mention_post),
+                               [{'POST_ID': post_id, 'PERSON_ID': people[person]} for person in post_insert.people_remind])
+            self._notify('reminder_scheduled', post_id, time_to_remind)
+        return post_id
+
+    @writes
+    def insert_reminder(self, post_insert: Post, media_list: list[Media], facet_list: list[Facet]) -> int:
+        """
+        Inserts post with all of its media and facets in one transaction, nothing is inserted if any part fails
 
+        :param post_insert: post that will be inserted
+        :param media_list: media of a post
+        :param facet_list: facets of a post
+        :return: id of an inserted post
+        """
+        with self.transaction() as connection:
+            post_id = self.insert_post(post_insert)
+            for item in media_list + facet_list:
+                item.set_post_id(post_id)
+            if media_list:
+                connection.execute(db.insert(self.media_table), [
+                    {'PATH': media.path, 'ALT': media.alt, 'POST_ID': post_id, 'IS_FOREIGN': media.foreign, 'TITLE': media.title}
+                    for media in media_list])
+            if facet_list:
+                connection.execute(db.insert(self.facets_table), [
+                    {'BYTE_START': facet.byte_start, 'BYTE_END': facet.byte_end, 'TYPE': facet.facet_type, 'URI': facet.uri,
+                     'POST_ID': post_id} for facet in facet_list])
+        return post_id
+
+    @writes
     def delete_post(self, post_delete: Post, media_path) -> None:
         """
         Deletes a post from a database
@@ -142,14 +428,15 @@ class Database:
         :param post_delete: post that will be deleted
         :return:
         """
-        date = convert_date(post_delete.time_send_request)
-        author_remind = self.find_person_or_insert(post_delete.author_remind)
-        stmt = db.select(self.post_table).where(
-            self.post_table.c.AUTHOR_REMIND == author_remind, self.post_table.c.TIME_SEND_REQUEST == date)
-        result = self.connection.execute(stmt).fetchone()
-        self.delete_post_by_id(result.ID, media_path)
-        self.connection.commit()
+        date = to_epoch(convert_date(post_delete.time_send_request))
+        with self.transaction() as connection:
+            author_remind = self.find_person_or_insert(post_delete.author_remind)
+            stmt = db.select(self.post_table).where(
+                self.post_table.c.AUTHOR_REMIND == author_remind, self.post_table.c.TIME_SEND_REQUEST == date)
+            result = connection.execute(stmt).fetchone()
+            self.delete_post_by_id(result.ID, media_path)
 
+    @writes
     def insert_media(self, media: Media) -> None:
         """
         Inserts media into a database
@@ -159,9 +446,10 @@ class Database:
         """
         stmt = db.insert(self.media_table).values(PATH=media.path, ALT=media.alt, POST_ID=media.post_id, IS_FOREIGN=media.foreign,
                                                   TITLE=media.title)
-        self.connection.execute(stmt)
-        self.connection.commit()
+        with self.transaction() as connection:
+            connection.execute(stmt)
 
+    @writes
     def insert_facets(self, index, facet_type, uri, post_id) -> None:
         """
         Inserts facets into a database
@@ -173,8 +461,8 @@ class Database:
         :return:
         """
         stmt = db.insert(self.facets_table).values(BYTE_START=index[0], BYTE_END=index[1], TYPE=facet_type, URI=uri, POST_ID=post_id)
-        self.connection.execute(stmt)
-        self.connection.commit()
+        with self.transaction() as connection:
+            connection.execute(stmt)
 
     def get_mentions(self, post_id):
         """
@@ -184,7 +472,8 @@ class Database:
         :return:
         """
         stmt = db.select(self.person_mention_post).where(self.person_mention_post.c.POST_ID == post_id)
-        return self.connection.execute(stmt).fetchall()
+        with self.transaction() as connection:
+            return connection.execute(stmt).fetchall()
 
     def get_person_handle(self, person_id):
         """
@@ -194,42 +483,64 @@ class Database:
         :return:
         """
         stmt = db.select(self.people_table).where(self.people_table.c.ID == person_id)
-        person = self.connection.execute(stmt).fetchone()
+        with self.transaction() as connection:
+            person = connection.execute(stmt).fetchone()
         return person.HANDLE
 
+    @writes
     def delete_post_by_id(self, post_id, media_path) -> None:
         """
-        Deletes post by id
+        Deletes post by id together with its mentions, media and facets, which follow it through ON DELETE CASCADE
+
+        Media files are removed only when no other post refers to them.
 
         :param post_id: id of a post
+        :param media_path: path to media folder
         :return:
         """
-        stmt = db.delete(self.post_table).where(self.post_table.c.ID == post_id)
-        self.connection.execute(stmt)
-        stmt = db.select(self.media_table).where(self.media_table.c.POST_ID == post_id)
-        for media in self.connection.execute(stmt):
-            if not media.IS_FOREIGN:
-                os.remove(media_path + '/' + media.PATH)
-        stmt = db.delete(self.media_table).where(self.media_table.c.POST_ID == post_id)
-        self.connection.execute(stmt)
-        stmt = db.delete(self.facets_table).where(self.facets_table.c.POST_ID == post_id)
-        self.connection.execute(stmt)
-        stmt = db.delete(self.person_mention_post).where(self.person_mention_post.c.POST_ID == post_id)
-        self.connection.execute(stmt)
-        self.connection.commit()
+        with self.transaction() as connection:
+            stmt = db.select(self.media_table).where(self.media_table.c.POST_ID == post_id)
+            paths = [media.PATH for media in connection.execute(stmt) if not media.IS_FOREIGN]
+            connection.execute(db.delete(self.post_table).where(self.post_table.c.ID == post_id))
+            remove_unreferenced_media(connection, media_path, paths)
+            self._notify('reminder_cancelled', post_id)
 
-    def update_post_time_remind(self, post_record) -> None:
+    @writes
+    def update_post_time_remind(self, post_record, now=None) -> bool:
         """
-        Updates time remind in a post
+        Moves a repeating reminder to its next occurrence and releases its lease
+
+        Nothing changes when a post was claimed by another instance after its lease had expired, or was already moved.
+
+        :param post_record: database record of a post
+        :param now: unix timestamp, occurrences that are not later than it are skipped, None keeps every occurrence
+        :return: False if a reminder does not repeat anymore and must be deleted
+        """
+        time_to_remind = next_fire_times([post_record], post_record.TIME_TO_REMIND if now is None else now)[post_record.ID]
+        if time_to_remind is None:
+            return False
+        stmt = db.update(self.post_table).where(
+            self.post_table.c.ID == post_record.ID, self.post_table.c.TIME_TO_REMIND == post_record.TIME_TO_REMIND,
+            self.post_table.c.CLAIMED_BY.is_not_distinct_from(getattr(post_record, 'CLAIMED_BY', None))
+        ).values(TIME_TO_REMIND=time_to_remind, CLAIMED_AT=None, CLAIMED_BY=None, LEASE_UNTIL=None)
+        with self.transaction() as connection:
+            if connection.execute(stmt).rowcount:
+                self._notify('reminder_scheduled', post_record.ID, time_to_remind)
+        return True
+
+    @writes
+    def mark_post_sent(self, post_record) -> None:
+        """
+        Remembers that a reminder was sent for its current fire time, an instance that claims it again does not resend it
 
         :param post_record: database record of a post
         :return:
         """
-        date_ret = parse(post_record.TIME_TO_REMIND) + timedelta(seconds=int(post_record.EVERY_N_SECONDS))
-        stmt = db.update(self.post_table).where(self.post_table.c.ID == post_record.ID).values(
-            TIME_TO_REMIND=date_ret.strftime('%Y-%m-%d %H:%M'))
-        self.connection.execute(stmt)
-        self.connection.commit()
+        stmt = db.update(self.post_table).where(
+            self.post_table.c.ID == post_record.ID, self.post_table.c.TIME_TO_REMIND == post_record.TIME_TO_REMIND
+        ).values(SENT_FIRE_TIME=post_record.TIME_TO_REMIND)
+        with self.transaction() as connection:
+            connection.execute(stmt)
 
     def get_facets_by_post_id(self, post_id):
         """
@@ -239,7 +550,8 @@ class Database:
         :return: rows of a table
         """
         stmt = db.select(self.facets_table).where(self.facets_table.c.POST_ID == post_id)
-        return self.connection.execute(stmt).fetchall()
+        with self.transaction() as connection:
+            return connection.execute(stmt).fetchall()
 
     def get_media_by_post_id(self, post_id):
         """
@@ -249,43 +561,73 @@ class Database:
         :return:
         """
         stmt = db.select(self.media_table).where(self.media_table.c.POST_ID == post_id)
-        return self.connection.execute(stmt).fetchall()
+        with self.transaction() as connection:
+            return connection.execute(stmt).fetchall()
+
+    def load_reminder_bundle(self, post_ids) -> dict:
+        """
+        Reads reminders with handles of their people, facets and media in four queries, however many they have
+
+        :param post_ids: ids of posts, usually a claimed batch
+        :return: dictionary from an id of a post to its ReminderBundle, posts that do not exist are left out
+        """
+        post_ids = list(post_ids)
+        author_post, author_remind = self.people_table.alias('AUTHOR_POST_PERSON'), self.people_table.alias('AUTHOR_REMIND_PERSON')
+        posts = db.select(self.post_table, author_post.c.HANDLE.label('AUTHOR_POST_HANDLE'), author_remind.c.HANDLE.label('AUTHOR_REMIND_HANDLE')
+                          ).outerjoin(author_post, author_post.c.ID == self.post_table.c.AUTHOR_POST
+                          ).outerjoin(author_remind, author_remind.c.ID == self.post_table.c.AUTHOR_REMIND
+                          ).where(self.post_table.c.ID.in_(post_ids))
+        mentions = db.select(self.person_mention_post.c.POST_ID, self.people_table.c.HANDLE).join(
+            self.people_table, self.people_table.c.ID == self.person_mention_post.c.PERSON_ID
+        ).where(self.person_mention_post.c.POST_ID.in_(post_ids)).order_by(self.person_mention_post.c.ID)
+        facets = db.select(self.facets_table).where(self.facets_table.c.POST_ID.in_(post_ids)).order_by(self.facets_table.c.ID)
+        media = db.select(self.media_table).where(self.media_table.c.POST_ID.in_(post_ids)).order_by(self.media_table.c.ID)
+        with self.transaction() as connection:
+            bundles = {row.ID: ReminderBundle(row, row.AUTHOR_POST_HANDLE, row.AUTHOR_REMIND_HANDLE) for row in connection.execute(posts)}
+            for row in connection.execute(mentions):
+                bundles[row.POST_ID].mentions.append(row.HANDLE)
+            for row in connection.execute(facets):
+                bundles[row.POST_ID].facets.append(row)
+            for row in connection.execute(media):
+                bundles[row.POST_ID].media.append(row)
+        return bundles
 
     def get_posts_by_time_to_remind(self, time_to_remind):
         """
         Get posts by time_to_remind attribute
 
-        :param time_to_remind: time to remind
+        :param time_to_remind: minute of a reminder in '%Y-%m-%d %H:%M' format
         :return:
         """
-        stmt = db.select(self.post_table).where(self.post_table.c.TIME_TO_REMIND == time_to_remind)
-        return self.connection.execute(stmt).fetchall()
+        minute_start = to_epoch(time_to_remind)
+        stmt = db.select(self.post_table).where(self.post_table.c.TIME_TO_REMIND >= minute_start,
+                                                self.post_table.c.TIME_TO_REMIND < minute_start + 60)
+        with self.transaction() as connection:
+            return connection.execute(stmt).fetchall()
 
-    def get_notifications_db(self, notification) -> bool:
+    @writes
+    def claim_due_posts(self, now: int, claim_timeout=CLAIM_TIMEOUT_SEC, limit=None):
         """
-        Returns if notification is not in a database
+        Leases posts that must be reminded by now, including the overdue ones, to this instance
 
-        :param notification: notification that must be checked
-        :return: True (notification was not database) or False (notification is in the database)
+        Claimed posts are not returned again until they are rescheduled or deleted, unless their lease of
+        claim_timeout seconds expires, which happens only when a sender stopped in the middle of sending them.
+
+        :param now: current unix timestamp
+        :param claim_timeout: number of seconds a lease lasts
+        :param limit: maximum number of claimed posts, None claims all of them
+        :return: claimed rows ordered by time to remind
         """
-        notification_table = db.Table('NOTIFICATIONS', db.MetaData(),
-                                      Column('ID', Integer, primary_key=True),
-                                      Column('CID', String))
-        notification_table.create(self.engine, checkfirst=True)
-        stmt = db.select(notification_table).where(notification.cid == notification_table.c.CID)
-        result = self.connection.execute(stmt).fetchall()
-        if not result:
-            stmt = db.insert(notification_table).values(CID=notification.cid)
-            self.connection.execute(stmt)
-            self.connection.commit()
-            return True
-        return False
+        with self.transaction() as connection:
+            rows = connection.execute(claim_statement(now, self.node_id, claim_timeout, limit)).fetchall()
+        return sorted(rows, key=lambda row: (row.TIME_TO_REMIND, row.ID))
 
-    def stop(self) -> None:
+    def get_pending_reminders(self):
         """
-        Stops connection
+        Returns every reminder that is waiting to be sent
 
-        :return:
+        :return: list of (time_to_remind, post_id) pairs
         """
-        self.connection.close()
-        self.engine.dispose()
+        stmt = db.select(self.post_table.c.TIME_TO_REMIND, self.post_table.c.ID)
+        with self.transaction() as connection:
+            return [(row.TIME_TO_REMIND, row.ID) for row in connection.execute(stmt)]
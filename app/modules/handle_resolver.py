@@ -0,0 +1,165 @@
+"""Cache of handle and did resolution shared by both threads of a bot"""
+import threading
+from collections import OrderedDict
+from time import time
+import sqlalchemy as db
+from modules.database_control import Database
+from modules.storage import writes
+
+DEFAULT_TTL_SEC = 24 * 60 * 60
+DEFAULT_MAX_SIZE = 10000
+
+
+class HandleResolver:
+    """
+    Resolves handles to dids and back, asking Bluesky only when neither memory nor a database knows the answer
+
+    Both directions are kept in memory as LRU dictionaries bounded by max_size, and every answer is also stored
+    in PEOPLE table so that it survives a restart. Answers older than ttl seconds are resolved again. A pair that is
+    already cached is written again only once it is older than half of ttl.
+    """
+
+    def __init__(self, database: Database, ttl=DEFAULT_TTL_SEC, max_size=DEFAULT_MAX_SIZE):
+        self.database = database
+        self.ttl = ttl
+        self.max_size = max_size
+        self.counters = {'hits': 0, 'misses': 0}
+        self._dids = OrderedDict()
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        """
+        Returns counters of a cache
+
+        :return: dictionary with hits, misses and number of cached handles
+        """
+        with self._lock:
+            return {**self.counters, 'size': len(self._dids)}
+
+    def remember(self, did: str, handle: str, resolved_at=None) -> None:
+        """
+        Stores a pair of did and handle that is already known, e.g. from an author of a notification
+
+        Nothing is written when memory already has the same pair resolved less than half of ttl ago.
+
+        :param did: did of an account
+        :param handle: handle of an account
+        :param resolved_at: unix timestamp when a pair was resolved, now by default
+        :return:
+        """
+        resolved_at = int(time()) if resolved_at is None else resolved_at
+        with self._lock:
+            cached = self._dids.get(handle)
+        if cached is not None and cached[0] == did and resolved_at - cached[1] < self.ttl / 2:
+            return
+        self._store(did, handle, resolved_at)
+
+    @writes
+    def _store(self, did: str, handle: str, resolved_at: int) -> None:
+        """
+        Stores a pair of did and handle in memory and in PEOPLE table
+
+        :param did: did of an account
+        :param handle: handle of an account
+        :param resolved_at: unix timestamp when a pair was resolved
+        :return:
+        """
+        self._remember_memory(did, handle, resolved_at)
+        people = self.database.people_table
+        with self.database.transaction() as connection:
+            updated = connection.execute(db.update(people).where(people.c.HANDLE == handle).values(DID=did, RESOLVED_AT=resolved_at))
+            if not updated.rowcount:
+                connection.execute(db.insert(people).values(HANDLE=handle, DID=did, RESOLVED_AT=resolved_at))
+
+    def lookup_did(self, handle: str):
+        """
+        Looks a did of a handle up in memory and in a database without asking Bluesky
+
+        :param handle: handle of an account
+        :return: did of an account or None if it is not cached
+        """
+        return self._lookup(self._dids, handle, self.database.people_table.c.HANDLE, 'DID')
+
+    def lookup_handle(self, did: str):
+        """
+        Looks a handle of a did up in memory and in a database without asking Bluesky
+
+        :param did: did of an account
+        :return: handle of an account or None if it is not cached
+        """
+        return self._lookup(self._handles, did, self.database.people_table.c.DID, 'HANDLE')
+
+    def get_did(self, client, handle: str) -> str:
+        """
+        Resolves a handle into a did
+
+        :param client: client that is used when a handle is not cached
+        :param handle: handle of an account
+        :return: did of an account
+        """
+        did = self.lookup_did(handle)
+        if did is None:
+            did = client.resolve_handle(handle).did
+            self.remember(did, handle)
+        return did
+
+    def get_handle(self, client, did: str) -> str:
+        """
+        Resolves a did into a handle
+
+        :param client: client that is used when a did is not cached
+        :param did: did of an account
+        :return: handle of an account
+        """
+        handle = self.lookup_handle(did)
+        if handle is None:
+            handle = client.get_profile(did).handle
+            self.remember(did, handle)
+        return handle
+
+    def _lookup(self, cache: OrderedDict, key: str, column, answer: str):
+        """
+        Looks a key up in memory and then in a database, counting hits and misses
+
+        :param cache: memory cache of one direction
+        :param key: handle or did
+        :param column: column of PEOPLE table where key is stored
+        :param answer: name of a column with a value that is looked for
+        :return: cached value or None
+        """
+        expire_before = time() - self.ttl
+        with self._lock:
+            cached = cache.get(key)
+            if cached is not None and cached[1] > expire_before:
+                cache.move_to_end(key)
+                self.counters['hits'] += 1
+                return cached[0]
+        stmt = db.select(self.database.people_table).where(
+            column == key, self.database.people_table.c.RESOLVED_AT > expire_before
+        ).order_by(self.database.people_table.c.RESOLVED_AT.desc()).limit(1)
+        with self.database.transaction() as connection:
+            row = connection.execute(stmt).fetchone()
+        with self._lock:
+            if row is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['hits'] += 1
+        self._remember_memory(row.DID, row.HANDLE, row.RESOLVED_AT)
+        return getattr(row, answer)
+
+    def _remember_memory(self, did: str, handle: str, resolved_at: int) -> None:
+        """
+        Stores a pair in memory and evicts the least recently used ones over max_size
+
+        :param did: did of an account
+        :param handle: handle of an account
+        :param resolved_at: unix timestamp when a pair was resolved
+        :return:
+        """
+        with self._lock:
+            for cache, key, value in ((self._dids, handle, did), (self._handles, did, handle)):
+                cache[key] = (value, resolved_at)
+                cache.move_to_end(key)
+                while len(cache) > self.max_size:
+                    cache.popitem(last=False)
@@ -0,0 +1,117 @@
+"""Push ingestion of mentions of a bot from a Jetstream feed of repository events, an alternative to polling"""
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import sqlalchemy as db
+from modules.database_control import Database, get_state, set_state
+from modules.storage import writes
+
+JETSTREAM_URL = 'wss://jetstream2.us-east.bsky.network/subscribe'
+POST_COLLECTION = 'app.bsky.feed.post'
+MENTION_TYPE = 'app.bsky.richtext.facet#mention'
+CURSOR_KEY = 'jetstream_cursor'
+REWIND_US = 5 * 1000 * 1000
+CURSOR_INTERVAL_US = 1000 * 1000
+RECONNECT_DELAY_SEC = 5
+STREAM_SOURCE = 'jetstream'
+
+
+def mention_of(event: dict, bot_did: str):
+    """
+    Converts an event of a new post that mentions a bot into an object that looks like a notification
+
+    :param event: decoded Jetstream event
+    :param bot_did: did of a bot
+    :return: object with uri, cid, reason, indexed_at, record and author with did and an unknown handle, or None
+    """
+    commit = event.get('commit') or {}
+    if event.get('kind') != 'commit' or commit.get('operation') != 'create' or commit.get('collection') != POST_COLLECTION:
+        return None
+    if event.get('did') == bot_did:
+        return None
+    record = commit.get('record') or {}
+    features = [feature for facet in record.get('facets') or [] for feature in facet.get('features') or []]
+    if not any(feature.get('$type') == MENTION_TYPE and feature.get('did') == bot_did for feature in features):
+        return None
+    indexed_at = datetime.fromtimestamp(event['time_us'] / 1000000, timezone.utc).isoformat().replace('+00:00', 'Z')
+    return SimpleNamespace(uri='at://' + event['did'] + '/' + POST_COLLECTION + '/' + commit['rkey'], cid=commit.get('cid'),
+                           reason='mention', indexed_at=indexed_at, record=record, author=SimpleNamespace(did=event['did'], handle=None))
+
+
+class JetstreamIngest:
+    """
+    Reads a stream of post events and keeps mentions of a bot, with a cursor stored in BOT_STATE
+
+    Events are fed one message at a time. The cursor is the time_us of the latest event that was read, it is stored
+    together with the CIDs of new mentions in NOTIFICATIONS, at least once per CURSOR_INTERVAL_US of stream time and
+    right after a mention. A reconnect resumes REWIND_US before the stored cursor, so nothing between the last stored
+    cursor and a crash is missed, and mentions that are replayed are dropped by their CID.
+    """
+
+    def __init__(self, database: Database, bot_did: str):
+        self.database = database
+        self.bot_did = bot_did
+        self._pending = []
+        self._cursor = None
+        self._flushed_at = None
+
+    def url(self, base=JETSTREAM_URL) -> str:
+        """
+        Returns a subscription url that resumes from the stored cursor
+
+        :param base: url of a Jetstream subscribe endpoint
+        :return: url with a filter of posts and a cursor
+        """
+        cursor = get_state(self.database, CURSOR_KEY)
+        url = base + '?wantedCollections=' + POST_COLLECTION
+        return url if cursor is None else url + '&cursor=' + str(max(0, int(cursor) - REWIND_US))
+
+    def add(self, message) -> bool:
+        """
+        Reads one message of a stream
+
+        :param message: JSON text of an event
+        :return: True if mentions and a cursor should be flushed now
+        """
+        event = json.loads(message)
+        if 'time_us' not in event:
+            return False
+        self._cursor = event['time_us']
+        if self._flushed_at is None:
+            self._flushed_at = self._cursor
+        mention = mention_of(event, self.bot_did)
+        if mention is not None:
+            self._pending.append(mention)
+        return bool(self._pending) or self._cursor - self._flushed_at >= CURSOR_INTERVAL_US
+
+    def flush(self) -> list:
+        """
+        Stores read mentions and the cursor
+
+        :return: mentions that were not ingested before, the oldest first
+        """
+        if self._cursor is None:
+            return []
+        pending, self._pending = self._pending, []
+        self._flushed_at = self._cursor
+        return self._store_new(pending, self._cursor)
+
+    @writes
+    def _store_new(self, mentions: list, cursor: int) -> list:
+        """
+        Removes already ingested mentions and stores the rest with a new cursor
+
+        :param mentions: mentions read since the last flush
+        :param cursor: time_us of the latest event that was read
+        :return: new mentions
+        """
+        table = self.database.notification_table
+        with self.database.transaction() as connection:
+            known = set()
+            if mentions:
+                known = set(connection.execute(db.select(table.c.CID).where(table.c.CID.in_({mention.cid for mention in mentions}))).scalars())
+            new = {mention.cid: mention for mention in mentions if mention.cid not in known}
+            if new:
+                connection.execute(db.insert(table), [{'CID': cid} for cid in new])
+            set_state(self.database, CURSOR_KEY, str(cursor))
+        return list(new.values())
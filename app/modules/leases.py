@@ -0,0 +1,96 @@
+"""Named leases in a shared database that elect one bot instance to do a job that must not run twice at once"""
+import threading
+import weakref
+import sqlalchemy as db
+from modules.database_control import Database
+from modules.storage import writes
+
+NOTIFICATIONS_LEASE = 'notifications'
+_RENEWALS = weakref.WeakKeyDictionary()
+_RENEWALS_LOCK = threading.Lock()
+
+
+@writes
+def _take_lease(database: Database, name: str, now: int, ttl: int) -> bool:
+    """
+    Extends a lease held by this instance, takes over an expired one or creates a missing one
+
+    :param database: shared database
+    :param name: name of a lease
+    :param now: current unix timestamp
+    :param ttl: number of seconds a lease lasts
+    :return: True if this instance holds a lease until now + ttl
+    """
+    table = database.lease_table
+    with database.transaction() as connection:
+        taken = connection.execute(db.update(table).where(
+            table.c.NAME == name, db.or_(table.c.HOLDER == database.node_id, table.c.EXPIRES_AT <= now)
+        ).values(HOLDER=database.node_id, EXPIRES_AT=now + ttl)).rowcount
+        if taken:
+            return True
+        if connection.execute(db.select(table.c.NAME).where(table.c.NAME == name)).first() is not None:
+            return False
+        connection.execute(db.insert(table).values(NAME=name, HOLDER=database.node_id, EXPIRES_AT=now + ttl))
+        return True
+
+
+def acquire_lease(database: Database, name: str, now: int, ttl: int) -> bool:
+    """
+    Tries to become a leader of a job, a leader calls it again before ttl runs out to keep its lease
+
+    A leader that stops renewing, because it crashed or hung, loses a lease when it expires and any other instance
+    takes it over.
+
+    :param database: shared database
+    :param name: name of a lease
+    :param now: current unix timestamp
+    :param ttl: number of seconds a lease lasts
+    :return: True if this instance is a leader until now + ttl
+    """
+    try:
+        return _take_lease(database, name, now, ttl)
+    except db.exc.IntegrityError:
+        return False
+
+
+def hold_lease(database: Database, name: str, now: int, ttl: int) -> bool:
+    """
+    Keeps a lease of a leader, renewing it in a database only once half of ttl passed since its last renewal
+
+    A leader checks its lease on every poll, far more often than the lease expires, so most checks only compare with
+    a time kept in memory and an idle poll writes nothing. A renewed lease still has half of ttl left when it is
+    renewed again, so no other instance can take it over in between.
+
+    :param database: shared database
+    :param name: name of a lease
+    :param now: current unix timestamp
+    :param ttl: number of seconds a lease lasts
+    :return: True if this instance is a leader until at least now + ttl / 2
+    """
+    with _RENEWALS_LOCK:
+        renewed_at = _RENEWALS.setdefault(database, {}).get(name)
+    if renewed_at is not None and now - renewed_at < ttl / 2:
+        return True
+    held = acquire_lease(database, name, now, ttl)
+    with _RENEWALS_LOCK:
+        if held:
+            _RENEWALS[database][name] = now
+        else:
+            _RENEWALS[database].pop(name, None)
+    return held
+
+
+@writes
+def release_lease(database: Database, name: str) -> None:
+    """
+    Gives up a lease held by this instance so that another one can take it over without waiting
+
+    :param database: shared database
+    :param name: name of a lease
+    :return:
+    """
+    with _RENEWALS_LOCK:
+        _RENEWALS.get(database, {}).pop(name, None)
+    table = database.lease_table
+    with database.transaction() as connection:
+        connection.execute(db.delete(table).where(table.c.NAME == name, table.c.HOLDER == database.node_id))
@@ -0,0 +1,180 @@
+"""Download stage of images of reminded posts"""
+import asyncio
+import os
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CDN_URL = "https://cdn.bsky.app/img/feed_fullsize/plain/"
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_TIMEOUT_SEC = 5
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def media_file_name(cid: str) -> str:
+    """
+    Returns a name of a file of an image in media folder
+
+    :param cid: CID of an image blob
+    :return: name of a file
+    """
+    return cid + ".jpg"
+
+
+def media_cid(path: str) -> str:
+    """
+    Returns a CID of an image stored in media folder
+
+    :param path: name of a file made by media_file_name
+    :return: CID of an image blob
+    """
+    return path.removesuffix(".jpg")
+
+
+def image_url(author_did: str, cid: str) -> str:
+    """
+    Returns CDN url of an image
+
+    :param author_did: did of photo's author (the user who posted the photo)
+    :param cid: CID of an image blob
+    :return: url of an image
+    """
+    return CDN_URL + author_did + "/" + cid
+
+
+@contextmanager
+def atomic_file(media_path: str, path: str):
+    """
+    Opens a temporary file that is moved to its place once written, so that a half-written file is never visible
+
+    :param media_path: path to media folder
+    :param path: name of a file in media folder
+    :return: context manager with a binary file open for writing
+    """
+    with tempfile.NamedTemporaryFile(dir=media_path, suffix='.part', delete=False) as f:
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, media_path + '/' + path)
+
+
+class MediaStore:
+    """
+    Downloads images into media folder, each of them at most once
+
+    Files are named by CID of an image, so an image reminded by many people is stored once and MEDIA rows referring to
+    the file act as its reference count. Downloads share one pooled HTTP session that retries failed requests with
+    a backoff, a bounded number of them runs at once, and responses are streamed to disk.
+    """
+
+    def __init__(self, media_path: str, workers=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES):
+        self.media_path = media_path
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=workers, max_retries=Retry(total=retries, backoff_factor=0.5,
+                                                                       status_forcelist=[429, 500, 502, 503, 504]))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media')
+
+    def download(self, author_did: str, cid: str):
+        """
+        Downloads an image unless a file of the same CID is already stored
+
+        :param author_did: did of photo's author (the user who posted the photo)
+        :param cid: CID of an image blob
+        :return: name of a file in media folder or None if an image could not be retrieved
+        """
+        path = media_file_name(cid)
+        if os.path.exists(self.media_path + '/' + path):
+            return path
+        try:
+            with self.session.get(image_url(author_did, cid), stream=True, timeout=DOWNLOAD_TIMEOUT_SEC) as res:
+                if res.status_code != 200:
+                    print("Error! Media couldn't be retrieved")
+                    return None
+                with atomic_file(self.media_path, path) as f:
+                    for chunk in res.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+        except requests.RequestException as e:
+            print("Error! Media couldn't be retrieved:", e)
+            return None
+        return path
+
+    def download_all(self, author_did: str, cids: list[str]) -> list[str]:
+        """
+        Downloads images of one post concurrently
+
+        :param author_did: did of photos' author
+        :param cids: CIDs of image blobs
+        :return: names of files in media folder in the same order as cids, None for images that could not be retrieved
+        """
+        return list(self._executor.map(lambda cid: self.download(author_did, cid), cids))
+
+    def close(self) -> None:
+        """
+        Closes a session and stops download threads
+
+        :return:
+        """
+        self._executor.shutdown()
+        self.session.close()
+
+
+class AsyncMediaStore:
+    """Asynchronous counterpart of MediaStore that streams images with one httpx.AsyncClient"""
+
+    def __init__(self, media_path: str, workers=DOWNLOAD_WORKERS):
+        self.media_path = media_path
+        self.http = httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT_SEC, follow_redirects=True,
+                                      transport=httpx.AsyncHTTPTransport(retries=DOWNLOAD_RETRIES))
+        self._semaphore = asyncio.Semaphore(workers)
+
+    async def download(self, author_did: str, cid: str):
+        """
+        Downloads an image unless a file of the same CID is already stored
+
+        :param author_did: did of photo's author (the user who posted the photo)
+        :param cid: CID of an image blob
+        :return: name of a file in media folder or None if an image could not be retrieved
+        """
+        path = media_file_name(cid)
+        if os.path.exists(self.media_path + '/' + path):
+            return path
+        try:
+            async with self._semaphore, self.http.stream('GET', image_url(author_did, cid)) as res:
+                if res.status_code != 200:
+                    print("Error! Media couldn't be retrieved")
+                    return None
+                with atomic_file(self.media_path, path) as f:
+                    async for chunk in res.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+        except httpx.HTTPError as e:
+            print("Error! Media couldn't be retrieved:", e)
+            return None
+        return path
+
+    async def download_all(self, author_did: str, cids: list[str]) -> list[str]:
+        """
+        Downloads images of one post concurrently
+
+        :param author_did: did of photos' author
+        :param cids: CIDs of image blobs
+        :return: names of files in media folder in the same order as cids, None for images that could not be retrieved
+        """
+        return list(await asyncio.gather(*(self.download(author_did, cid) for cid in cids)))
+
+    async def close(self) -> None:
+        """
+        Closes an HTTP client
+
+        :return:
+        """
+        await self.http.aclose()
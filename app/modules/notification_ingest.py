@@ -0,0 +1,120 @@
+"""Incremental ingestion of notifications of a bot"""
+import asyncio
+import itertools
+import sqlalchemy as db
+from modules.database_control import Database, get_state, set_state
+from modules.storage import writes
+
+PAGE_LIMIT = 50
+MAX_PAGES = 10
+INDEXED_AT_KEY = 'notifications_indexed_at'
+
+
+class NotificationIngest:
+    """
+    Pages only the notifications that arrived since the last poll
+
+    Notifications come newest first, so paging follows cursors until the first one that is older than the stored
+    high-water mark, however many pages that takes. Only the first poll, which has no mark yet, stops after max_pages.
+    Notifications indexed at the mark itself are checked against NOTIFICATIONS with a single IN query, and only new
+    CIDs are inserted in bulk together with the new mark. A poll without new notifications writes nothing.
+    """
+
+    def __init__(self, database: Database, page_limit=PAGE_LIMIT, max_pages=MAX_PAGES):
+        self.database = database
+        self.page_limit = page_limit
+        self.max_pages = max_pages
+
+    def fetch_new(self, client, reasons=('mention',)) -> list:
+        """
+        Fetches notifications that were not processed yet and marks them as seen
+
+        :param client: client of a bot
+        :param reasons: reasons of notifications that are returned, the other ones are only marked as processed
+        :return: new notifications, the oldest first
+        """
+        seen_at = client.get_current_time_iso()
+        high_water = get_state(self.database, INDEXED_AT_KEY)
+        fetched = []
+        cursor = None
+        for page in itertools.count(1):
+            response = client.app.bsky.notification.list_notifications(params={'limit': self.page_limit, 'cursor': cursor})
+            cursor = response.cursor
+            if not self._take_page(response, high_water, fetched) or (high_water is None and page >= self.max_pages):
+                break
+        new = self._ingest(fetched)
+        if new:
+            client.app.bsky.notification.update_seen({'seen_at': seen_at})
+        return [notification for notification in new if notification.reason in reasons]
+
+    async def fetch_new_async(self, client, reasons=('mention',)) -> list:
+        """
+        Fetches notifications that were not processed yet and marks them as seen using an AsyncClient
+
+        :param client: asynchronous client of a bot
+        :param reasons: reasons of notifications that are returned, the other ones are only marked as processed
+        :return: new notifications, the oldest first
+        """
+        seen_at = client.get_current_time_iso()
+        high_water = await asyncio.to_thread(get_state, self.database, INDEXED_AT_KEY)
+        fetched = []
+        cursor = None
+        for page in itertools.count(1):
+            response = await client.app.bsky.notification.list_notifications(params={'limit': self.page_limit, 'cursor': cursor})
+            cursor = response.cursor
+            if not self._take_page(response, high_water, fetched) or (high_water is None and page >= self.max_pages):
+                break
+        new = await asyncio.to_thread(self._ingest, fetched)
+        if new:
+            await client.app.bsky.notification.update_seen({'seen_at': seen_at})
+        return [notification for notification in new if notification.reason in reasons]
+
+    @staticmethod
+    def _take_page(response, high_water, fetched: list) -> bool:
+        """
+        Adds notifications of a page that are not older than the high-water mark to fetched ones
+
+        :param response: page of notifications
+        :param high_water: indexedAt of the newest ingested notification or None
+        :param fetched: notifications fetched so far
+        :return: True if the next page must be fetched too
+        """
+        fresh = [notification for notification in response.notifications
+                 if high_water is None or notification.indexed_at >= high_water]
+        fetched.extend(fresh)
+        return len(fresh) == len(response.notifications) and bool(response.cursor)
+
+    def _ingest(self, fetched: list) -> list:
+        """
+        Finds fetched notifications that were not processed yet and stores them, a database is written only if there are any
+
+        :param fetched: notifications at or after the high-water mark
+        :return: new notifications, the oldest first
+        """
+        if not fetched:
+            return []
+        table = self.database.notification_table
+        with self.database.transaction() as connection:
+            known = set(connection.execute(db.select(table.c.CID).where(table.c.CID.in_({notification.cid for notification in fetched}))).scalars())
+        new = {notification.cid: notification for notification in fetched if notification.cid not in known}
+        if not new:
+            return []
+        return self._store_new(list(new.values()), max(notification.indexed_at for notification in fetched))
+
+    @writes
+    def _store_new(self, new: list, indexed_at: str) -> list:
+        """
+        Stores new notifications with a new high-water mark, skipping any that were stored since they were checked
+
+        :param new: notifications that were not processed when they were checked
+        :param indexed_at: indexedAt of the newest fetched notification
+        :return: new notifications, the oldest first
+        """
+        table = self.database.notification_table
+        with self.database.transaction() as connection:
+            known = set(connection.execute(db.select(table.c.CID).where(table.c.CID.in_([notification.cid for notification in new]))).scalars())
+            new = [notification for notification in new if notification.cid not in known]
+            if new:
+                connection.execute(db.insert(table), [{'CID': notification.cid} for notification in new])
+            set_state(self.database, INDEXED_AT_KEY, indexed_at)
+        return sorted(new, key=lambda notification: notification.indexed_at)
@@ -0,0 +1,132 @@
+"""Pool of threads that process notifications of one poll batch in parallel"""
+import queue
+import threading
+import zlib
+from contextlib import contextmanager
+from time import monotonic
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+
+
+class StageStats:
+    """Thread-safe latency counters of named stages of processing"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        Adds one measurement of a stage
+
+        :param stage: name of a stage
+        :param seconds: how long a stage took
+        :return:
+        """
+        with self._lock:
+            count, total, longest = self._stages.get(stage, (0, 0.0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds, max(longest, seconds))
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Measures how long the body of a with statement takes
+
+        :param stage: name of a stage
+        :return: context manager
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, monotonic() - start)
+
+    def snapshot(self) -> dict:
+        """
+        Returns counters of all stages
+
+        :return: dictionary from a stage to its count, average and maximum in seconds
+        """
+        with self._lock:
+            return {stage: {'count': count, 'avg': total / count, 'max': longest}
+                    for stage, (count, total, longest) in self._stages.items()}
+
+
+class NotificationWorkers:
+    """
+    Fixed number of worker threads, each with its own bounded queue
+
+    A notification always goes to the queue chosen by a hash of its author, so notifications of one author are
+    processed in the order they were submitted and a "delete" can never overtake the reminder it deletes. A full queue
+    blocks submit, which slows down polling instead of piling up notifications in memory.
+    """
+
+    def __init__(self, handler, stats: StageStats, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.handler = handler
+        self.stats = stats
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = [threading.Thread(target=self._work, args=(work_queue,), daemon=True) for work_queue in self._queues]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, notification) -> None:
+        """
+        Queues a notification for the worker of its author, waits while that queue is full
+
+        :param notification: notification with a mention of a bot
+        :return:
+        """
+        index = zlib.crc32(notification.author.did.encode()) % len(self._queues)
+        self._queues[index].put((monotonic(), notification))
+
+    def join(self) -> None:
+        """
+        Waits until every submitted notification is processed
+
+        :return:
+        """
+        for work_queue in self._queues:
+            work_queue.join()
+
+    def stop(self) -> None:
+        """
+        Lets workers finish queued notifications and stops them
+
+        :return:
+        """
+        for work_queue in self._queues:
+            work_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def metrics(self) -> dict:
+        """
+        Returns depths of queues and latencies of stages
+
+        :return: dictionary with a depth of every queue and counters of every stage
+        """
+        return {'queue_depths': [work_queue.qsize() for work_queue in self._queues], 'stages': self.stats.snapshot()}
+
+    def _work(self, work_queue: queue.Queue) -> None:
+        """
+        Processes notifications of one queue until stop is called
+
+        :param work_queue: queue of a worker
+        :return:
+        """
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                return
+            queued_at, notification = item
+            self.stats.record('wait', monotonic() - queued_at)
+            try:
+                with self.stats.measure('total'):
+                    self.handler(notification)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # an unexpected error of one notification, like a malformed date, must not kill the worker of its queue
+                print("Error! Notification", notification.uri, "was not processed:", repr(e))
+            finally:
+                work_queue.task_done()
@@ -0,0 +1,332 @@
+"""Durable outbox of the requests that send one reminder, so a restarted sender resumes a thread where it stopped"""
+import json
+from time import time
+import atproto_client.exceptions
+import httpx
+import sqlalchemy as db
+from atproto import models
+from atproto_client.models.blob_ref import BlobRef, IpldLink
+from modules.blob_cache import BlobCache, is_blob_rejection
+from modules.database_control import FAILED_STEP
+from modules.storage import writes
+
+UPLOAD_BLOB = 'upload_blob'
+SEND_POST = 'send_post'
+PENDING = 'pending'
+DONE = 'done'
+FAILED = FAILED_STEP
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SEC = 5
+MAX_BACKOFF_SEC = 30 * 60
+STEP_ERRORS = (atproto_client.exceptions.AtProtocolError, httpx.HTTPError, OSError)
+RETRYABLE_ERRORS = (atproto_client.exceptions.NetworkError, atproto_client.exceptions.RequestException,
+                    atproto_client.exceptions.UnauthorizedError, httpx.HTTPError, OSError)
+
+
+def backoff_delay(attempts: int) -> int:
+    """
+    Returns how long a failed step waits before it is tried again
+
+    :param attempts: number of failed attempts so far
+    :return: delay in seconds, doubled with every attempt up to MAX_BACKOFF_SEC
+    """
+    return min(MAX_BACKOFF_SEC, BASE_BACKOFF_SEC * 2 ** (attempts - 1))
+
+
+def planned_steps(title_posts: list[dict], paths: list[str], text: str) -> list[tuple[str, dict]]:
+    """
+    Returns the requests that send a reminder in the order they must succeed
+
+    :param title_posts: laid out posts of a title thread, each is a dictionary with a text and mentions
+    :param paths: names of local media files of a reminded post
+    :param text: text of a reminded post
+    :return: list of (kind, payload) tuples
+    """
+    return ([(UPLOAD_BLOB, {'path': path}) for path in paths] + [(SEND_POST, post) for post in title_posts] +
+            [(SEND_POST, {'text': text})])
+
+
+def payload_of(step) -> dict:
+    """
+    Returns a payload of a step
+
+    :param step: row of OUTBOX
+    :return: payload stored when a reminder was planned
+    """
+    return json.loads(step.PAYLOAD)
+
+
+def result_of(step) -> dict:
+    """
+    Returns a result of a finished step
+
+    :param step: row of OUTBOX
+    :return: strong ref of a sent post or a blob ref of an uploaded file
+    """
+    return json.loads(step.RESULT)
+
+
+def post_result(response) -> dict:
+    """
+    Converts a response of send_post into a result of a step
+
+    :param response: response with uri and cid of a new post
+    :return: result of a step
+    """
+    return {'uri': response.uri, 'cid': response.cid}
+
+
+def blob_result(blob: BlobRef) -> dict:
+    """
+    Converts an uploaded blob into a result of a step
+
+    :param blob: blob ref returned by a PDS
+    :return: result of a step
+    """
+    return {'cid': blob.ref if isinstance(blob.ref, str) else blob.ref.link, 'mime_type': blob.mime_type, 'size': blob.size}
+
+
+def reply_to(done: list[tuple[str, dict]]):
+    """
+    Returns where the next post of a thread replies to
+
+    :param done: (kind, result) tuples of finished steps in order
+    :return: reply to the last post with the first post as a root, or None for the first post of a thread
+    """
+    refs = [models.ComAtprotoRepoStrongRef.Main(uri=result['uri'], cid=result['cid']) for kind, result in done if kind == SEND_POST]
+    return models.AppBskyFeedPost.ReplyRef(parent=refs[-1], root=refs[0]) if refs else None
+
+
+def uploaded_blobs(done: list[tuple[str, dict]]) -> list[BlobRef]:
+    """
+    Returns blobs uploaded by finished steps
+
+    :param done: (kind, result) tuples of finished steps in order
+    :return: blob refs in the order of media of a post
+    """
+    return [BlobRef(mime_type=result['mime_type'], size=result['size'], ref=IpldLink.model_validate({'$link': result['cid']}))
+            for kind, result in done if kind == UPLOAD_BLOB]
+
+
+def has_failed(steps: list) -> bool:
+    """
+    Checks if a reminder has a step that failed for good
+
+    :param steps: rows of OUTBOX
+    :return: True if a reminder will not be sent at this fire time
+    """
+    return any(step.STATE == FAILED for step in steps)
+
+
+def progress(steps: list) -> tuple[list, list]:
+    """
+    Splits steps of a reminder into the finished ones and the ones that still have to be made
+
+    :param steps: rows of OUTBOX in order
+    :return: (kind, result) tuples of finished steps and rows of steps to make, none after a step failed for good
+    """
+    if has_failed(steps):
+        return [], []
+    return [(step.KIND, result_of(step)) for step in steps if step.STATE == DONE], [step for step in steps if step.STATE != DONE]
+
+
+class Outbox:
+    """
+    Steps of sending a reminder at one fire time, stored in OUTBOX before any of them is made
+
+    Every upload_blob and send_post request of a reminder is a row with a state. A step is marked done together with
+    the strong ref or blob it produced, so a sender that crashed or failed in the middle of a thread continues from
+    the first step that is not done and replies to the posts it already made. A failed step is retried with
+    exponential backoff, the lease of its reminder is extended until then so that no other instance takes it earlier.
+    Errors that a retry cannot fix, and steps that failed MAX_ATTEMPTS times, fail a step for good. Such a reminder is
+    abandoned: it is not marked as sent and its failed steps are kept as a record of the error.
+    """
+
+    def __init__(self, database, blob_cache: BlobCache):
+        self.database = database
+        self.blob_cache = blob_cache
+
+    def steps(self, post_record) -> list:
+        """
+        Returns steps of a reminder at its current fire time
+
+        :param post_record: database record of a post
+        :return: rows of OUTBOX in order, empty if a reminder was not planned yet
+        """
+        table = self.database.outbox_table
+        stmt = db.select(table).where(table.c.POST_ID == post_record.ID, table.c.FIRE_TIME == post_record.TIME_TO_REMIND).order_by(table.c.STEP)
+        with self.database.transaction() as connection:
+            return connection.execute(stmt).fetchall()
+
+    @writes
+    def plan(self, post_record, steps: list[tuple[str, dict]]) -> list:
+        """
+        Stores steps of a reminder unless it already has them
+
+        :param post_record: database record of a post
+        :param steps: list of (kind, payload) tuples
+        :return: rows of OUTBOX in order
+        """
+        with self.database.transaction() as connection:
+            if not self.steps(post_record):
+                connection.execute(db.insert(self.database.outbox_table), [
+                    {'POST_ID': post_record.ID, 'FIRE_TIME': post_record.TIME_TO_REMIND, 'STEP': index, 'KIND': kind,
+                     'PAYLOAD': json.dumps(payload), 'STATE': PENDING, 'ATTEMPTS': 0} for index, (kind, payload) in enumerate(steps)])
+            return self.steps(post_record)
+
+    def start(self, post_record, plan: list[tuple[str, dict]]):
+        """
+        Returns progress of a reminder at its current fire time, its steps are planned first if it has none
+
+        A reminder with a step that failed for good is abandoned instead of being sent.
+
+        :param post_record: database record of a post
+        :param plan: list of (kind, payload) tuples stored when a reminder has no steps yet
+        :return: (kind, result) tuples of finished steps and rows of steps to make, or None if a reminder was abandoned
+        """
+        steps = self.steps(post_record) or self.plan(post_record, plan)
+        if has_failed(steps):
+            self.abandon(post_record)
+            return None
+        return progress(steps)
+
+    def advance(self, step, result: dict, done: list[tuple[str, dict]]) -> None:
+        """
+        Marks a step as done and appends its result to the finished steps of a reminder
+
+        :param step: row of OUTBOX
+        :param result: strong ref of a sent post or a blob ref of an uploaded file
+        :param done: (kind, result) tuples of finished steps in order
+        :return:
+        """
+        self.complete(step, result)
+        done.append((step.KIND, result))
+
+    def settle(self, post_record, step, error: Exception) -> str:
+        """
+        Records a failed attempt of a step, a reminder whose step failed for good is abandoned
+
+        :param post_record: database record of a post
+        :param step: row of OUTBOX
+        :param error: one of STEP_ERRORS raised by an attempt
+        :return: PENDING when a step waits for a retry, FAILED when it failed for good
+        """
+        if self.fail(post_record, step, error) is not None:
+            return PENDING
+        print("Error! Reminder", post_record.ID, "was not sent:", error)
+        self.abandon(post_record)
+        return FAILED
+
+    @writes
+    def complete(self, step, result: dict) -> None:
+        """
+        Marks a step as done and stores what it produced
+
+        :param step: row of OUTBOX
+        :param result: strong ref of a sent post or a blob ref of an uploaded file
+        :return:
+        """
+        table = self.database.outbox_table
+        with self.database.transaction() as connection:
+            connection.execute(db.update(table).where(table.c.ID == step.ID).values(STATE=DONE, RESULT=json.dumps(result)))
+
+    def fail(self, post_record, step, error: Exception):
+        """
+        Records a failed attempt of a step and schedules the next one
+
+        When a PDS rejects cached blobs, they are forgotten and their uploads are planned again.
+
+        :param post_record: database record of a post
+        :param step: row of OUTBOX
+        :param error: error of an attempt
+        :return: unix timestamp of the next attempt or None if a step failed for good
+        """
+        uploads = [payload_of(row)['path'] for row in self.steps(post_record) if row.KIND == UPLOAD_BLOB]
+        rejected = isinstance(error, atproto_client.exceptions.BadRequestError) and uploads and is_blob_rejection(error)
+        if rejected:
+            self.blob_cache.forget(uploads)
+        attempts = step.ATTEMPTS + 1
+        retry_at = None
+        if (rejected or isinstance(error, RETRYABLE_ERRORS)) and attempts < MAX_ATTEMPTS:
+            retry_at = int(time()) + backoff_delay(attempts)
+        if rejected:
+            self._replan_uploads(post_record)
+        self._record_failure(step, str(error), retry_at)
+        if retry_at is not None and self._extend_lease(post_record, retry_at):
+            for listener in self.database.listeners:
+                listener.reminder_scheduled(post_record.ID, retry_at)
+        return retry_at
+
+    @writes
+    def finish(self, post_record) -> None:
+        """
+        Marks a reminder as sent at its fire time and drops its steps
+
+        :param post_record: database record of a post
+        :return:
+        """
+        table = self.database.outbox_table
+        with self.database.transaction() as connection:
+            self.database.mark_post_sent(post_record)
+            connection.execute(db.delete(table).where(table.c.POST_ID == post_record.ID, table.c.FIRE_TIME == post_record.TIME_TO_REMIND))
+
+    @writes
+    def abandon(self, post_record) -> None:
+        """
+        Gives up a fire time of a reminder whose step failed for good, without marking it as sent
+
+        A repeating reminder moves on to its next occurrence. Any other reminder is released and stays in a database,
+        claim_due_posts skips it as long as its failed step is kept.
+
+        :param post_record: database record of a post
+        :return:
+        """
+        if self.database.update_post_time_remind(post_record, int(time())):
+            return
+        table = self.database.post_table
+        with self.database.transaction() as connection:
+            connection.execute(db.update(table).where(table.c.ID == post_record.ID, table.c.CLAIMED_BY == self.database.node_id).values(
+                CLAIMED_AT=None, CLAIMED_BY=None, LEASE_UNTIL=None))
+
+    @writes
+    def _record_failure(self, step, error: str, retry_at) -> None:
+        """
+        Stores a failed attempt of a step
+
+        :param step: row of OUTBOX
+        :param error: text of an error
+        :param retry_at: unix timestamp of the next attempt or None if a step failed for good
+        :return:
+        """
+        table = self.database.outbox_table
+        with self.database.transaction() as connection:
+            connection.execute(db.update(table).where(table.c.ID == step.ID).values(
+                STATE=FAILED if retry_at is None else PENDING, ATTEMPTS=step.ATTEMPTS + 1, NEXT_ATTEMPT_AT=retry_at, LAST_ERROR=error))
+
+    @writes
+    def _replan_uploads(self, post_record) -> None:
+        """
+        Makes uploads of a reminder pending again, after a PDS rejected the blobs they produced
+
+        :param post_record: database record of a post
+        :return:
+        """
+        table = self.database.outbox_table
+        with self.database.transaction() as connection:
+            connection.execute(db.update(table).where(
+                table.c.POST_ID == post_record.ID, table.c.FIRE_TIME == post_record.TIME_TO_REMIND, table.c.KIND == UPLOAD_BLOB
+            ).values(STATE=PENDING, RESULT=None))
+
+    @writes
+    def _extend_lease(self, post_record, until: int) -> bool:
+        """
+        Keeps a reminder leased to this instance until its next attempt, after that any instance may resume it
+
+        :param post_record: database record of a post
+        :param until: unix timestamp of the next attempt
+        :return: True if this instance still held a lease
+        """
+        table = self.database.post_table
+        with self.database.transaction() as connection:
+            return bool(connection.execute(db.update(table).where(
+                table.c.ID == post_record.ID, table.c.CLAIMED_BY == self.database.node_id).values(LEASE_UNTIL=until)).rowcount)
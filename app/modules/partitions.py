@@ -0,0 +1,212 @@
+"""Archive of sent reminders partitioned by the month they were due in, one SQLite file per month"""
+import glob
+import os
+import threading
+from datetime import datetime, timezone
+import sqlalchemy as db
+from modules.database_control import Database, remove_unreferenced_media
+from modules.storage import writes
+
+ARCHIVE_SCHEMA = 'archive'
+MONTH_FORMAT = '%Y_%m'
+ARCHIVED_TABLES = ('PERSON_POST_MENTION', 'MEDIA', 'FACETS', 'POSTS')
+PARTITION_LOCK = threading.Lock()
+
+
+def month_of(timestamp: int) -> str:
+    """
+    Returns a partition key of a reminder
+
+    :param timestamp: unix timestamp when a reminder was due
+    :return: month in '%Y_%m' format
+    """
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(MONTH_FORMAT)
+
+
+def partition_path(database: Database, month: str) -> str:
+    """
+    Returns a path of a partition file, partitions are stored next to a main database file
+
+    :param database: main database
+    :param month: month in '%Y_%m' format
+    :return: path of a file
+    """
+    return os.path.splitext(database.engine.url.database)[0] + '.' + month + '.db'
+
+
+def list_partitions(database: Database) -> list[str]:
+    """
+    Returns months that have a partition file
+
+    :param database: main database
+    :return: months in '%Y_%m' format in ascending order
+    """
+    prefix = os.path.splitext(database.engine.url.database)[0] + '.'
+    months = []
+    for path in glob.glob(glob.escape(prefix) + '*.db'):
+        month = path[len(prefix):-len('.db')]
+        try:
+            datetime.strptime(month, MONTH_FORMAT)
+        except ValueError:
+            continue
+        months.append(month)
+    return sorted(months)
+
+
+def _attach(connection, path: str) -> None:
+    """
+    Attaches a partition file to a connection and creates its tables with the columns of the main tables
+
+    ATTACH is not allowed inside a transaction, so it is committed on its own before any statement that writes.
+
+    :param connection: connection that is not in a transaction
+    :param path: path of a partition file
+    :return:
+    """
+    connection.exec_driver_sql('ATTACH DATABASE ? AS ' + ARCHIVE_SCHEMA, (path,))
+    connection.commit()
+    for table in ARCHIVED_TABLES:
+        connection.exec_driver_sql('CREATE TABLE IF NOT EXISTS ' + ARCHIVE_SCHEMA + '."' + table + '" AS SELECT * FROM main."' + table +
+                                   '" WHERE 0')
+        existing = {row[1] for row in connection.exec_driver_sql('PRAGMA ' + ARCHIVE_SCHEMA + '.table_info("' + table + '")')}
+        for row in connection.exec_driver_sql('PRAGMA main.table_info("' + table + '")').fetchall():
+            if row[1] not in existing:
+                connection.exec_driver_sql('ALTER TABLE ' + ARCHIVE_SCHEMA + '."' + table + '" ADD COLUMN "' + row[1] + '" ' + row[2])
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ' + ARCHIVE_SCHEMA + '."IX_POSTS_TIME_TO_REMIND" ON "POSTS" ("TIME_TO_REMIND")')
+    connection.commit()
+
+
+def _detach(connection) -> None:
+    """
+    Detaches a partition file once a transaction is over
+
+    :param connection: connection with an attached partition
+    :return:
+    """
+    connection.rollback()
+    connection.exec_driver_sql('DETACH DATABASE ' + ARCHIVE_SCHEMA)
+    connection.commit()
+
+
+def _move_rows(connection, post_ids: list[int]) -> None:
+    """
+    Copies reminders with all of their rows into an attached partition and deletes them from main tables
+
+    Rows of other tables are moved before POSTS, deleting a post cascades to them.
+
+    :param connection: connection with an attached partition in a transaction
+    :param post_ids: ids of reminders
+    :return:
+    """
+    ids = ', '.join(str(int(post_id)) for post_id in post_ids)
+    for table in ARCHIVED_TABLES:
+        key = 'ID' if table == 'POSTS' else 'POST_ID'
+        columns = ', '.join('"' + row[1] + '"' for row in connection.exec_driver_sql('PRAGMA main.table_info("' + table + '")'))
+        connection.exec_driver_sql('INSERT INTO ' + ARCHIVE_SCHEMA + '."' + table + '" (' + columns + ') SELECT ' + columns +
+                                   ' FROM main."' + table + '" WHERE "' + key + '" IN (' + ids + ')')
+        connection.exec_driver_sql('DELETE FROM main."' + table + '" WHERE "' + key + '" IN (' + ids + ')')
+
+
+@writes
+def _delete_posts(database: Database, post_ids: list[int], media_path: str) -> None:
+    """
+    Deletes sent reminders with one statement, their rows follow them through ON DELETE CASCADE
+
+    :param database: main database
+    :param post_ids: ids of reminders
+    :param media_path: path to media folder
+    :return:
+    """
+    with database.transaction() as connection:
+        stmt = db.select(database.media_table).where(database.media_table.c.POST_ID.in_(post_ids))
+        paths = [media.PATH for media in connection.execute(stmt) if not media.IS_FOREIGN]
+        connection.execute(db.delete(database.post_table).where(database.post_table.c.ID.in_(post_ids)))
+        remove_unreferenced_media(connection, media_path, paths)
+
+
+def archive_posts(database: Database, post_ids: list[int], media_path: str) -> None:
+    """
+    Moves sent reminders out of the main database into partitions of the months they were due in
+
+    Each month is moved with a few set-based statements in one transaction, instead of deleting rows of every table
+    one reminder at a time. Media files that no remaining reminder refers to are removed like in delete_post_by_id.
+    Partitions are attached by one thread at a time, two connections writing to both files at once could deadlock.
+    Other backends than SQLite partition tables on their own, there sent reminders are just deleted.
+    Reminders leased by another instance are left alone, this instance lost them when its lease expired.
+
+    :param database: main database
+    :param post_ids: ids of reminders that will not be sent anymore
+    :param media_path: path to media folder
+    :return:
+    """
+    if not post_ids:
+        return
+    stmt = db.select(database.post_table.c.ID, database.post_table.c.TIME_TO_REMIND).where(
+        database.post_table.c.ID.in_(post_ids),
+        db.or_(database.post_table.c.CLAIMED_BY.is_(None), database.post_table.c.CLAIMED_BY == database.node_id))
+    with database.transaction() as connection:
+        by_month = {}
+        for row in connection.execute(stmt):
+            by_month.setdefault(month_of(row.TIME_TO_REMIND), []).append(row.ID)
+    if database.engine.dialect.name != 'sqlite':
+        owned = [post_id for ids in by_month.values() for post_id in ids]
+        if owned:
+            _delete_posts(database, owned, media_path)
+        for post_id in owned:
+            for listener in database.listeners:
+                listener.reminder_cancelled(post_id)
+        return
+    for month, ids in by_month.items():
+        with PARTITION_LOCK, database.engine.connect() as connection:
+            _attach(connection, partition_path(database, month))
+            try:
+                with connection.begin():
+                    connection.exec_driver_sql('BEGIN IMMEDIATE')
+                    stmt = db.select(database.media_table).where(database.media_table.c.POST_ID.in_(ids))
+                    paths = [media.PATH for media in connection.execute(stmt) if not media.IS_FOREIGN]
+                    _move_rows(connection, ids)
+                    remove_unreferenced_media(connection, media_path, paths)
+            finally:
+                _detach(connection)
+        for post_id in ids:
+            for listener in database.listeners:
+                listener.reminder_cancelled(post_id)
+
+
+def archived_posts(database: Database, start: int, end: int) -> list:
+    """
+    Returns archived reminders that were due in a time range, reading only the partitions of months in that range
+
+    :param database: main database
+    :param start: unix timestamp, inclusive
+    :param end: unix timestamp, exclusive
+    :return: rows of archived POSTS ordered by time to remind
+    """
+    first, last = month_of(start), month_of(max(start, end - 1))
+    rows = []
+    for month in list_partitions(database):
+        if not first <= month <= last:
+            continue
+        with PARTITION_LOCK, database.engine.connect() as connection:
+            _attach(connection, partition_path(database, month))
+            try:
+                rows.extend(connection.exec_driver_sql('SELECT * FROM ' + ARCHIVE_SCHEMA + '."POSTS" WHERE "TIME_TO_REMIND" >= ? AND '
+                                                       '"TIME_TO_REMIND" < ?', (start, end)).fetchall())
+            finally:
+                _detach(connection)
+    return sorted(rows, key=lambda row: (row.TIME_TO_REMIND, row.ID))
+
+
+def drop_partitions(database: Database, before: int) -> list[str]:
+    """
+    Drops whole partitions of months that ended before a given time by deleting their files
+
+    :param database: main database
+    :param before: unix timestamp, partitions of earlier months are dropped
+    :return: dropped months
+    """
+    with PARTITION_LOCK:
+        dropped = [month for month in list_partitions(database) if month < month_of(before)]
+        for month in dropped:
+            os.remove(partition_path(database, month))
+    return dropped
@@ -0,0 +1,143 @@
+"""Adaptive polling intervals of the bot loops"""
+import random
+import threading
+from time import time
+from atproto_client.exceptions import RequestErrorBase
+from atproto_client.request import AsyncRequest, Request
+from modules.rate_limiter import SHARED_BUDGET, RequestBudget, endpoint_of
+
+RATE_LIMIT_REMAINING_THRESHOLD = 1
+
+
+def rate_limit_headers(headers) -> dict:
+    """
+    Returns ratelimit-* headers of a response
+
+    :param headers: headers of a response
+    :return: dictionary with lower-cased names of rate-limit headers
+    """
+    return {key.lower(): value for key, value in headers.items() if key.lower().startswith('ratelimit-')}
+
+
+class RateLimitAwareRequest(Request):
+    """
+    Request of an atproto client that waits for a budget before every call and remembers rate-limit headers of the
+    latest response
+
+    A client keeps working unchanged on top of it, every XRPC call goes through _send_request.
+    """
+
+    def __init__(self, budget: RequestBudget = SHARED_BUDGET):
+        super().__init__()
+        self.budget = budget
+        self.rate_limit = {}
+
+    def _send_request(self, method: str, url: str, **kwargs):
+        self.budget.acquire(endpoint_of(url))
+        try:
+            response = super()._send_request(method, url, **kwargs)
+        except RequestErrorBase as e:
+            if e.response is not None:
+                self.rate_limit = rate_limit_headers(e.response.headers) or self.rate_limit
+            raise
+        self.rate_limit = rate_limit_headers(response.headers) or self.rate_limit
+        return response
+
+
+class AsyncRateLimitAwareRequest(AsyncRequest):
+    """
+    Request of an atproto AsyncClient that waits for a budget before every call and remembers rate-limit headers of
+    the latest response
+    """
+
+    def __init__(self, budget: RequestBudget = SHARED_BUDGET):
+        super().__init__()
+        self.budget = budget
+        self.rate_limit = {}
+
+    async def _send_request(self, method: str, url: str, **kwargs):
+        await self.budget.acquire_async(endpoint_of(url))
+        try:
+            response = await super()._send_request(method, url, **kwargs)
+        except RequestErrorBase as e:
+            if e.response is not None:
+                self.rate_limit = rate_limit_headers(e.response.headers) or self.rate_limit
+            raise
+        self.rate_limit = rate_limit_headers(response.headers) or self.rate_limit
+        return response
+
+
+class AdaptivePoller:
+    """
+    Interval between polls that halves while work keeps arriving and grows exponentially while idle
+
+    Every delay gets a random jitter, and when the server says the rate limit is used up, no poll happens before
+    the limit resets.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, backoff=2.0, jitter=0.1):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = min_interval
+        self.rate_limited_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, work_count: int) -> None:
+        """
+        Adjusts interval after a poll
+
+        :param work_count: number of items a poll found
+        :return:
+        """
+        with self._lock:
+            if work_count:
+                self.interval = max(self.min_interval, self.interval / self.backoff)
+            else:
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def record_rate_limit(self, headers: dict) -> None:
+        """
+        Reads ratelimit-remaining and ratelimit-reset headers of an atproto response
+
+        :param headers: headers of the latest response
+        :return:
+        """
+        try:
+            remaining = int(headers['ratelimit-remaining'])
+            reset = float(headers['ratelimit-reset'])
+        except (KeyError, ValueError):
+            return
+        with self._lock:
+            if remaining < RATE_LIMIT_REMAINING_THRESHOLD:
+                self.rate_limited_until = max(self.rate_limited_until, reset)
+
+    def rate_limit_delay(self) -> float:
+        """
+        Returns how long to wait before the rate limit resets
+
+        :return: seconds, 0 when polling is not limited
+        """
+        with self._lock:
+            return max(0.0, self.rate_limited_until - time())
+
+    def next_delay(self) -> float:
+        """
+        Returns how long to sleep before the next poll
+
+        :return: jittered interval in seconds, at least until the rate limit resets
+        """
+        with self._lock:
+            delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(delay, self.rate_limit_delay())
+
+    def metrics(self) -> dict:
+        """
+        Returns the current state of a poller
+
+        :return: dictionary with the current interval and seconds until the rate limit resets
+        """
+        with self._lock:
+            interval = self.interval
+        return {'interval': interval, 'rate_limited_for': self.rate_limit_delay()}
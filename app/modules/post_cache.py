@@ -0,0 +1,173 @@
+"""Short-lived cache of posts that whole pages of notifications fill with batched get_posts calls"""
+import asyncio
+import threading
+from collections import OrderedDict
+from time import monotonic
+from atproto import models
+
+GET_POSTS_LIMIT = 25
+POST_CACHE_TTL_SEC = 2 * 60
+POST_CACHE_SIZE = 1000
+
+
+def record_response(view):
+    """
+    Converts a post view into the response get_post returns
+
+    :param view: post view returned by get_posts
+    :return: record of a post with its uri and cid
+    """
+    return models.ComAtprotoRepoGetRecord.Response(uri=view.uri, cid=view.cid, value=view.record)
+
+
+def parent_uri(view):
+    """
+    Returns a uri of a post a post replies to
+
+    :param view: post view
+    :return: uri of a parent or None if a post is not a reply
+    """
+    reply = getattr(view.record, 'reply', None)
+    return reply.parent.uri if reply is not None else None
+
+
+def batches(uris: list[str], size=GET_POSTS_LIMIT) -> list[list[str]]:
+    """
+    Splits uris into groups that fit into one get_posts call
+
+    :param uris: uris of posts
+    :param size: maximum number of uris in one call
+    :return: groups of uris
+    """
+    return [uris[start:start + size] for start in range(0, len(uris), size)]
+
+
+class PostCache:
+    """
+    Post views by uri that expire after ttl seconds, with at most max_size of them
+
+    prefetch takes a whole page of notifications and fetches every mention and then every parent it replies to, 25 uris
+    per get_posts call, so a page of 50 mentions costs 4 calls instead of 100. Handlers then read posts from a cache
+    and fall back to one call of their own for a post that is not cached.
+    """
+
+    def __init__(self, ttl=POST_CACHE_TTL_SEC, max_size=POST_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.counters = {'hits': 0, 'misses': 0, 'calls': 0}
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, uri: str):
+        """
+        Returns a cached post view
+
+        :param uri: uri of a post
+        :return: post view or None if it is not cached or expired
+        """
+        with self._lock:
+            cached = self._views.get(uri)
+            if cached is None or cached[1] < monotonic() - self.ttl:
+                return None
+            return cached[0]
+
+    def missing(self, uris) -> list[str]:
+        """
+        Returns uris that are not cached, each once
+
+        :param uris: uris of posts, None is skipped
+        :return: uris in the order they were given
+        """
+        return [uri for uri in OrderedDict.fromkeys(uris) if uri is not None and self.cached(uri) is None]
+
+    def store(self, views) -> None:
+        """
+        Caches post views, the oldest ones are dropped when a cache is full
+
+        :param views: post views returned by get_posts
+        :return:
+        """
+        with self._lock:
+            self.counters['calls'] += 1
+            for view in views:
+                self._views[view.uri] = (view, monotonic())
+                self._views.move_to_end(view.uri)
+            while len(self._views) > self.max_size:
+                self._views.popitem(last=False)
+
+    def prefetch(self, client, notifications) -> None:
+        """
+        Fetches mentions of a page of notifications and the posts they reply to
+
+        :param client: client of a bot
+        :param notifications: notifications with a mention of a bot
+        :return:
+        """
+        mentions = [notification.uri for notification in notifications]
+        for batch in batches(self.missing(mentions)):
+            self.store(client.get_posts(uris=batch).posts)
+        for batch in batches(self.missing(self.parents(mentions))):
+            self.store(client.get_posts(uris=batch).posts)
+
+    async def prefetch_async(self, client, notifications) -> None:
+        """
+        Fetches mentions of a page of notifications and the posts they reply to using an AsyncClient, batches of a
+        stage are fetched concurrently
+
+        :param client: asynchronous client of a bot
+        :param notifications: notifications with a mention of a bot
+        :return:
+        """
+        mentions = [notification.uri for notification in notifications]
+        for response in await asyncio.gather(*(client.get_posts(uris=batch) for batch in batches(self.missing(mentions)))):
+            self.store(response.posts)
+        for response in await asyncio.gather(*(client.get_posts(uris=batch) for batch in batches(self.missing(self.parents(mentions))))):
+            self.store(response.posts)
+
+    def parents(self, uris: list[str]) -> list[str]:
+        """
+        Returns uris of posts that cached posts reply to
+
+        :param uris: uris of posts
+        :return: uris of parents of cached replies
+        """
+        return [parent_uri(view) for view in map(self.cached, uris) if view is not None]
+
+    def view(self, client, uri: str):
+        """
+        Returns a post view from a cache, or fetches it alone when it is not cached
+
+        :param client: client of a bot
+        :param uri: uri of a post
+        :return: post view or None if a post does not exist
+        """
+        view = self._count(self.cached(uri))
+        if view is None:
+            self.store(client.get_posts(uris=[uri]).posts)
+            view = self.cached(uri)
+        return view
+
+    async def view_async(self, client, uri: str):
+        """
+        Returns a post view from a cache, or fetches it alone with an AsyncClient when it is not cached
+
+        :param client: asynchronous client of a bot
+        :param uri: uri of a post
+        :return: post view or None if a post does not exist
+        """
+        view = self._count(self.cached(uri))
+        if view is None:
+            self.store((await client.get_posts(uris=[uri])).posts)
+            view = self.cached(uri)
+        return view
+
+    def _count(self, view):
+        """
+        Counts a lookup of a handler as a hit or a miss
+
+        :param view: cached post view or None
+        :return: view
+        """
+        with self._lock:
+            self.counters['hits' if view is not None else 'misses'] += 1
+        return view
@@ -0,0 +1,215 @@
+"""Token buckets that keep every atproto call of the bot under the published rate limits of Bluesky"""
+import asyncio
+import threading
+from collections import defaultdict
+from time import monotonic, sleep
+
+URGENT = 0
+NORMAL = 1
+LOOKUP = 2
+REQUESTS = 'requests'
+SAFETY_MARGIN = 0.9
+GATED_WAIT_SEC = 0.05
+LIMITS = {
+    REQUESTS: (3000, 5 * 60),
+    'write_points_hour': (5000, 60 * 60),
+    'write_points_day': (35000, 24 * 60 * 60),
+    'sessions': (30, 5 * 60),
+    'sessions_day': (300, 24 * 60 * 60),
+}
+ENDPOINTS = {
+    'com.atproto.repo.createRecord': (URGENT, {'write_points_hour': 3, 'write_points_day': 3}),
+    'com.atproto.repo.putRecord': (URGENT, {'write_points_hour': 2, 'write_points_day': 2}),
+    'com.atproto.repo.deleteRecord': (URGENT, {'write_points_hour': 1, 'write_points_day': 1}),
+    'com.atproto.repo.uploadBlob': (URGENT, {}),
+    'com.atproto.server.createSession': (URGENT, {'sessions': 1, 'sessions_day': 1}),
+    'app.bsky.notification.listNotifications': (NORMAL, {}),
+    'app.bsky.notification.updateSeen': (NORMAL, {}),
+}
+
+
+def endpoint_of(url: str) -> str:
+    """
+    Returns an XRPC method of a request
+
+    :param url: url of a request such as https://bsky.social/xrpc/com.atproto.repo.createRecord
+    :return: name of a method
+    """
+    return url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+
+
+class TokenBucket:
+    """
+    Budget of one limit that refills continuously, a full bucket holds the whole allowance of a window
+
+    Calls waiting for a bucket are counted by priority, so that a less urgent call does not take tokens a more urgent
+    one is waiting for.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.waiting = defaultdict(int)
+
+    def refill(self, now: float) -> None:
+        """
+        Adds tokens for the time since the last refill
+
+        :param now: current monotonic time
+        :return:
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float) -> float:
+        """
+        Returns how long a call waits until a bucket has enough tokens, call refill first
+
+        :param cost: number of tokens a call takes
+        :return: seconds, 0 when a call can be made now
+        """
+        return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+    def outranked(self, priority: int) -> bool:
+        """
+        Checks if a more urgent call is waiting for a bucket
+
+        :param priority: priority of a call, lower is more urgent
+        :return: True if a call must let a waiting one go first
+        """
+        return any(count for waiting_priority, count in self.waiting.items() if waiting_priority < priority)
+
+
+class RequestBudget:
+    """
+    Token buckets shared by every client of a process, so that the sender and the notification loop spend one budget
+
+    Every call takes a token of REQUESTS and the endpoints in ENDPOINTS take points of their own limits, like
+    createRecord takes 3 of the hourly and daily write points of an account. Buckets run at SAFETY_MARGIN of the
+    published limits. Replies, reminder sends and logins are URGENT, polling notifications is NORMAL and the remaining
+    calls, handle and post lookups, are LOOKUP. A call waits until every bucket it needs has tokens and no more urgent
+    call waits for any of them. A waiting call only counts as a waiter of the buckets it is short of, so a send that
+    waits an hour for write points does not hold back lookups that only need requests. Time that calls waited for a
+    budget is recorded per endpoint.
+    """
+
+    def __init__(self, limits=None, endpoints=None, margin=SAFETY_MARGIN):
+        now = monotonic()
+        self.buckets = {name: TokenBucket(amount * margin / period, amount * margin, now)
+                        for name, (amount, period) in (LIMITS if limits is None else limits).items()}
+        self.endpoints = ENDPOINTS if endpoints is None else endpoints
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'calls': 0, 'waited': 0.0, 'max_wait': 0.0})
+
+    def route(self, endpoint: str) -> tuple[int, dict]:
+        """
+        Returns a priority of an endpoint and the tokens a call of it takes
+
+        :param endpoint: XRPC method
+        :return: priority and a dictionary from a name of a bucket to a number of tokens
+        """
+        priority, costs = self.endpoints.get(endpoint, (LOOKUP, {}))
+        return priority, {REQUESTS: 1, **costs}
+
+    def acquire(self, endpoint: str) -> float:
+        """
+        Blocks a thread until a call of an endpoint fits into the budget, and takes its tokens
+
+        :param endpoint: XRPC method
+        :return: seconds a call waited
+        """
+        priority, costs = self.route(endpoint)
+        start = monotonic()
+        blocked = set()
+        try:
+            while (delay := self._try_take(costs, priority, blocked)) > 0:
+                sleep(delay)
+        finally:
+            self._register(blocked, priority, -1)
+        return self._record(endpoint, monotonic() - start)
+
+    async def acquire_async(self, endpoint: str) -> float:
+        """
+        Waits without blocking an event loop until a call of an endpoint fits into the budget, and takes its tokens
+
+        :param endpoint: XRPC method
+        :return: seconds a call waited
+        """
+        priority, costs = self.route(endpoint)
+        start = monotonic()
+        blocked = set()
+        try:
+            while (delay := self._try_take(costs, priority, blocked)) > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self._register(blocked, priority, -1)
+        return self._record(endpoint, monotonic() - start)
+
+    def metrics(self) -> dict:
+        """
+        Returns how calls of every endpoint waited for a budget
+
+        :return: dictionary from an endpoint to its number of calls, total and longest wait in seconds
+        """
+        with self._lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._stats.items()}
+
+    def _register(self, names, priority: int, change: int) -> None:
+        """
+        Counts a call in or out of the waiters of buckets
+
+        :param names: names of buckets
+        :param priority: priority of a call
+        :param change: 1 when a call starts waiting, -1 when it stops
+        :return:
+        """
+        with self._lock:
+            for name in names:
+                self.buckets[name].waiting[priority] += change
+
+    def _try_take(self, costs: dict, priority: int, blocked: set) -> float:
+        """
+        Takes tokens of a call if all of its buckets have them and no more urgent call waits for them
+
+        :param costs: dictionary from a name of a bucket to a number of tokens
+        :param priority: priority of a call
+        :param blocked: names of buckets a call is registered as a waiter of, updated to the ones it is short of
+        :return: 0 when tokens were taken, otherwise seconds to wait before trying again
+        """
+        with self._lock:
+            now = monotonic()
+            buckets = {name: (self.buckets[name], cost) for name, cost in costs.items() if name in self.buckets}
+            for bucket, _ in buckets.values():
+                bucket.refill(now)
+            if any(bucket.outranked(priority) for bucket, _ in buckets.values()):
+                return GATED_WAIT_SEC
+            delays = {name: bucket.delay(cost) for name, (bucket, cost) in buckets.items()}
+            short = {name for name, delay in delays.items() if delay > 0}
+            for name in blocked ^ short:
+                self.buckets[name].waiting[priority] += 1 if name in short else -1
+            blocked.clear()
+            blocked.update(short)
+            if not short:
+                for bucket, cost in buckets.values():
+                    bucket.tokens -= cost
+            return max(delays.values(), default=0.0)
+
+    def _record(self, endpoint: str, waited: float) -> float:
+        """
+        Adds a wait of a call to the statistics of its endpoint
+
+        :param endpoint: XRPC method
+        :param waited: seconds a call waited
+        :return: seconds a call waited
+        """
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats['calls'] += 1
+            stats['waited'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+        return waited
+
+
+SHARED_BUDGET = RequestBudget()
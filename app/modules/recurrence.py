@@ -0,0 +1,171 @@
+"""Calendar-correct recurrence of reminders stored as compact RRULE-style rules"""
+from datetime import datetime, timezone
+from functools import lru_cache
+from dateutil.relativedelta import relativedelta
+
+FREQUENCIES = {'minutes': 'MINUTELY', 'hours': 'HOURLY', 'days': 'DAILY', 'weeks': 'WEEKLY', 'months': 'MONTHLY', 'years': 'YEARLY'}
+UNITS = {frequency: unit for unit, frequency in FREQUENCIES.items()}
+FIXED_SECONDS = {'minutes': 60, 'hours': 60 * 60, 'days': 24 * 60 * 60, 'weeks': 7 * 24 * 60 * 60}
+CALENDAR_MONTHS = {'months': 1, 'years': 12}
+APPROXIMATE_SECONDS = {**FIXED_SECONDS, 'months': 30 * 24 * 60 * 60, 'years': 365 * 24 * 60 * 60}
+
+
+class Recurrence:
+    """
+    Rule of a repeating reminder: every interval units starting at anchor, optionally count times or until a time
+
+    Occurrence k is always computed from the anchor, never from the previous occurrence, so a reminder on the 31st
+    fires on the last day of shorter months and comes back to the 31st afterwards. Rules with minutes, hours, days
+    and weeks are plain arithmetic on unix timestamps; months and years need at most two calendar additions.
+    """
+
+    def __init__(self, unit: str, interval: int, anchor=None, **limits):
+        self.unit = unit
+        self.interval = interval
+        self.anchor = anchor
+        self.count = limits.get('count')
+        self.until = limits.get('until')
+
+    @staticmethod
+    def from_seconds(seconds: int, anchor=None):
+        """
+        Creates a rule from a period in seconds that older reminders stored
+
+        :param seconds: period in seconds
+        :param anchor: unix timestamp of the first occurrence
+        :return: rule or None for a reminder that is sent once
+        """
+        if not seconds:
+            return None
+        for unit in ('weeks', 'days', 'hours', 'minutes'):
+            if seconds % FIXED_SECONDS[unit] == 0:
+                return Recurrence(unit, seconds // FIXED_SECONDS[unit], anchor)
+        return Recurrence('minutes', max(1, seconds // 60), anchor)
+
+    def to_rule(self) -> str:
+        """
+        Returns a compact text form of a rule that is stored in POSTS.RECURRENCE
+
+        :return: rule such as 'FREQ=MONTHLY;INTERVAL=2;DTSTART=1717252207;COUNT=5'
+        """
+        parts = ['FREQ=' + FREQUENCIES[self.unit], 'INTERVAL=' + str(self.interval)]
+        for name, value in (('DTSTART', self.anchor), ('COUNT', self.count), ('UNTIL', self.until)):
+            if value is not None:
+                parts.append(name + '=' + str(value))
+        return ';'.join(parts)
+
+    def approximate_seconds(self) -> int:
+        """
+        Returns an average period in seconds, used only where a single number is needed
+
+        :return: period in seconds
+        """
+        return self.interval * APPROXIMATE_SECONDS[self.unit]
+
+    def occurrence(self, index: int) -> int:
+        """
+        Returns a time of an occurrence
+
+        :param index: number of an occurrence, 0 is the anchor
+        :return: unix timestamp
+        """
+        if self.unit in FIXED_SECONDS:
+            return self.anchor + index * self.interval * FIXED_SECONDS[self.unit]
+        start = datetime.fromtimestamp(self.anchor, timezone.utc)
+        return int((start + relativedelta(months=index * self.interval * CALENDAR_MONTHS[self.unit])).timestamp())
+
+    def next_after(self, after: int):
+        """
+        Returns the first occurrence that is later than a given time
+
+        :param after: unix timestamp
+        :return: unix timestamp or None when a rule has no more occurrences
+        """
+        if after < self.anchor:
+            index = 0
+        elif self.unit in FIXED_SECONDS:
+            index = (after - self.anchor) // (self.interval * FIXED_SECONDS[self.unit]) + 1
+        else:
+            start = datetime.fromtimestamp(self.anchor, timezone.utc)
+            end = datetime.fromtimestamp(after, timezone.utc)
+            months = (end.year - start.year) * 12 + end.month - start.month
+            index = max(0, months // (self.interval * CALENDAR_MONTHS[self.unit]))
+            while self.occurrence(index) <= after:
+                index += 1
+        if self.count is not None and index >= self.count:
+            return None
+        time = self.occurrence(index)
+        return None if self.until is not None and time > self.until else time
+
+    def upcoming(self, after: int, limit: int) -> list[int]:
+        """
+        Precomputes the next fire times of a rule
+
+        :param after: unix timestamp
+        :param limit: maximum number of fire times
+        :return: up to limit unix timestamps in ascending order
+        """
+        times = []
+        while len(times) < limit:
+            time = self.next_after(after)
+            if time is None:
+                break
+            times.append(time)
+            after = time
+        return times
+
+
+@lru_cache(maxsize=4096)
+def parse_rule(rule: str) -> Recurrence:
+    """
+    Parses a rule stored in POSTS.RECURRENCE, equal rules share one parsed object
+
+    :param rule: text form of a rule
+    :return: rule
+    """
+    parts = dict(part.split('=', 1) for part in rule.split(';'))
+    optional = {name: int(parts[key]) for name, key in (('anchor', 'DTSTART'), ('count', 'COUNT'), ('until', 'UNTIL')) if key in parts}
+    return Recurrence(UNITS[parts['FREQ']], int(parts['INTERVAL']), **optional)
+
+
+def anchored_rule(recurrence, anchor: int):
+    """
+    Returns a text form of a rule that starts at a given time unless it already has an anchor
+
+    :param recurrence: rule or None
+    :param anchor: unix timestamp of the first occurrence
+    :return: text form of a rule or None
+    """
+    if recurrence is None:
+        return None
+    if recurrence.anchor is None:
+        recurrence = Recurrence(recurrence.unit, recurrence.interval, anchor, count=recurrence.count, until=recurrence.until)
+    return recurrence.to_rule()
+
+
+def rule_of_row(row):
+    """
+    Returns a rule of a row of POSTS, rows written before rules existed fall back to EVERY_N_SECONDS
+
+    :param row: row of POSTS
+    :return: rule or None for a reminder that is sent once
+    """
+    if getattr(row, 'RECURRENCE', None):
+        rule = parse_rule(row.RECURRENCE)
+        return rule if rule.anchor is not None else Recurrence(rule.unit, rule.interval, row.TIME_TO_REMIND, count=rule.count, until=rule.until)
+    return Recurrence.from_seconds(int(row.EVERY_N_SECONDS or 0), row.TIME_TO_REMIND)
+
+
+def next_fire_times(rows, after: int) -> dict:
+    """
+    Computes the next fire time of many recurring rows at once
+
+    :param rows: rows of POSTS
+    :param after: unix timestamp, usually now
+    :return: dictionary from id of a post to its next fire time or None when it does not repeat anymore
+    """
+    ret = {}
+    for row in rows:
+        rule = rule_of_row(row)
+        ret[row.ID] = None if rule is None else rule.next_after(max(after, row.TIME_TO_REMIND))
+    return ret
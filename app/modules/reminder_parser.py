@@ -0,0 +1,165 @@
+"""Single-pass parser of texts that ask a bot for a reminder"""
+import datetime
+import re
+from dateutil.parser import parse
+from dateutil.relativedelta import relativedelta
+from modules.recurrence import Recurrence
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+PUNCTUATION = r'''!()\-\[\]{};:'"\\, <>./?@#$%^&*_~'''
+TOKEN = re.compile(r'(?P<date>(?<![^' + PUNCTUATION + r'])(?P<day>\d{1,2})(?P<sep>[./-])(?P<month>\d{1,2})(?P=sep)(?P<year>\d{4})(?![^' +
+                   PUNCTUATION + r']))|(?P<time>(?<![^' + PUNCTUATION + r'])(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?(?![^' +
+                   PUNCTUATION + r'])(?!:))|(?P<word>[^' + PUNCTUATION + r']+)')
+NUMBER = re.compile(r'[0-9]+')
+SEPARATORS = re.compile('[' + PUNCTUATION + ']+')
+DIGIT = re.compile(r'\d')
+UNITS = {'minute': 'minutes', 'minutes': 'minutes', 'hour': 'hours', 'hours': 'hours', 'day': 'days', 'days': 'days',
+         'week': 'weeks', 'weeks': 'weeks', 'month': 'months', 'months': 'months', 'year': 'years', 'years': 'years'}
+UNIT_SECONDS = {'minutes': 60, 'hours': 60 * 60, 'days': 24 * 60 * 60, 'weeks': 7 * 24 * 60 * 60, 'months': 30 * 24 * 60 * 60,
+                'years': 365 * 24 * 60 * 60}
+DATE_WORDS = frozenset(['jan', 'january', 'feb', 'february', 'mar', 'march', 'apr', 'april', 'may', 'jun', 'june', 'jul', 'july',
+                        'aug', 'august', 'sep', 'sept', 'september', 'oct', 'october', 'nov', 'november', 'dec', 'december',
+                        'mon', 'monday', 'tue', 'tuesday', 'wed', 'wednesday', 'thu', 'thursday', 'fri', 'friday', 'sat', 'saturday',
+                        'sun', 'sunday'])
+DEFAULT_PERIOD = (1, 'days')
+NO_PERIOD = (0, 'days')
+
+
+def add_period(start: datetime.datetime, amount: int, unit: str) -> datetime.datetime:
+    """
+    Adds a calendar period to a date, months and years that are too short end on their last day
+
+    :param start: starting date
+    :param amount: number of units
+    :param unit: one of minutes, hours, days, weeks, months or years
+    :return: new date
+    """
+    return start + relativedelta(**{unit: amount})
+
+
+class ReminderText:
+    """
+    Parsed text of a mention that asks for a reminder
+
+    "in N unit" wins over a date, "every N unit" only sets how often a reminder repeats. A date written as
+    dd.mm.yyyy with an optional hh:mm[:ss] is read directly. Any other date-like text is left to a fuzzy dateutil
+    parser, and a text without a date means one day from now.
+    """
+
+    def __init__(self, text: str):
+        self.remind_in = None
+        self.every = NO_PERIOD
+        self.date = None
+        self.time = None
+        self.fuzzy_text = None
+        self._tokenize(text)
+
+    def time_to_remind(self, time_send: datetime.datetime) -> datetime.datetime:
+        """
+        Returns a date when a reminder must be sent
+
+        :param time_send: time when a mention was sent
+        :return: date of a reminder
+        """
+        try:
+            if self.remind_in is not None:
+                return add_period(time_send, *self.remind_in)
+            if self.fuzzy_text is not None:
+                return parse(self.fuzzy_text, fuzzy=True, default=time_send, dayfirst=True)
+            if self.date is not None or self.time is not None:
+                return time_send.replace(**(self.date or {}), **(self.time or {}))
+        except (ValueError, OverflowError):
+            pass
+        return add_period(time_send, *DEFAULT_PERIOD)
+
+    def every_seconds(self) -> int:
+        """
+        Returns how often a reminder repeats
+
+        :return: period in seconds, 0 for a reminder that is sent once
+        """
+        return self.every[0] * UNIT_SECONDS[self.every[1]]
+
+    def recurrence(self):
+        """
+        Returns a rule of a repeating reminder
+
+        :return: rule without an anchor or None for a reminder that is sent once
+        """
+        return Recurrence(self.every[1], self.every[0]) if self.every[0] else None
+
+    def _tokenize(self, text: str) -> None:
+        """
+        Reads all tokens of a text in one pass
+
+        :param text: text of a mention
+        :return:
+        """
+        tokens = list(TOKEN.finditer(text))
+        periods = {}
+        fuzzy = False
+        skip_until = 0
+        for index, match in enumerate(tokens):
+            if index < skip_until:
+                continue
+            word = (match.group('word') or '').lower()
+            if word in ('in', 'every') and word not in periods and index + 1 < len(tokens):
+                period, skip_until = self._period(tokens, index + 1)
+                if period is not None:
+                    periods[word] = period
+                    if word == 'every':
+                        periods['every_span'] = (match.start(), tokens[skip_until - 1].end())
+                    continue
+            if match.group('date') and self.date is None:
+                self.date = {'day': int(match.group('day')), 'month': int(match.group('month')), 'year': int(match.group('year'))}
+            elif match.group('time') and self.time is None:
+                self.time = {'hour': int(match.group('hour')), 'minute': int(match.group('minute'))}
+                if match.group('second'):
+                    self.time['second'] = int(match.group('second'))
+            elif match.group('date') or match.group('time') or DIGIT.search(word) or word in DATE_WORDS:
+                fuzzy = True
+        self.remind_in = periods.get('in')
+        self.every = periods.get('every', NO_PERIOD)
+        if fuzzy:
+            start, end = periods.get('every_span', (len(text), len(text)))
+            self.fuzzy_text = text[:start] + ' ' + text[end:]
+
+    @staticmethod
+    def _period(tokens: list, index: int):
+        """
+        Reads "N unit" after "in" or "every"
+
+        :param tokens: all tokens of a text
+        :param index: index of a token after "in" or "every"
+        :return: tuple of (amount, unit) or None when a date follows, and index of the first token after a period
+        """
+        if tokens[index].group('date') or tokens[index].group('time'):
+            return None, index
+        if not NUMBER.fullmatch(tokens[index].group('word')):
+            return DEFAULT_PERIOD, index
+        amount = int(tokens[index].group('word'))
+        if index + 1 < len(tokens) and (tokens[index + 1].group('word') or '').lower() in UNITS:
+            return (amount, UNITS[tokens[index + 1].group('word').lower()]), index + 2
+        return (amount, 'days'), index + 1
+
+
+def parse_reminder(text: str) -> ReminderText:
+    """
+    Parses a text of a mention
+
+    :param text: text of a mention
+    :return: parsed text
+    """
+    return ReminderText(text)
+
+
+def time_to_remind(text: str, time_send: str) -> str:
+    """
+    Returns date when post must be reminded
+
+    :param text: post message where will be found a period or a date
+    :param time_send: time when post was sent in '%Y-%m-%d %H:%M:%S' format
+    :return: date when post must be reminded
+    """
+    start = datetime.datetime.strptime(time_send, DATE_FORMAT)
+    return parse_reminder(text).time_to_remind(start).strftime(DATE_FORMAT)
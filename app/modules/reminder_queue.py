@@ -0,0 +1,165 @@
+"""In-memory timer of upcoming reminders, the database stays the durable copy of them"""
+import asyncio
+import heapq
+import threading
+from time import time
+
+
+class ReminderQueue:
+    """
+    Min-heap of (time_to_remind, post_id) entries that wakes the sender when the earliest reminder is due
+
+    Rescheduled and deleted reminders are not removed from the heap, their old entries are skipped once they reach
+    the top, so every change costs a single push. Threads wait with wait_for_due, event loops with wait_for_due_async.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled = {}
+        self._condition = threading.Condition()
+        self._events = []
+
+    def __len__(self):
+        with self._condition:
+            return len(self._scheduled)
+
+    def load(self, reminders) -> None:
+        """
+        Loads reminders that are already in a database
+
+        :param reminders: iterable of (time_to_remind, post_id) pairs
+        :return:
+        """
+        with self._condition:
+            for time_to_remind, post_id in reminders:
+                self._scheduled[post_id] = time_to_remind
+            self._heap = [(time_to_remind, post_id) for post_id, time_to_remind in self._scheduled.items()]
+            heapq.heapify(self._heap)
+            self._wake()
+
+    def reminder_scheduled(self, post_id: int, time_to_remind: int) -> None:
+        """
+        Adds a new reminder or moves an existing one to a new time
+
+        :param post_id: id of a post
+        :param time_to_remind: unix timestamp when a post must be reminded
+        :return:
+        """
+        with self._condition:
+            self._scheduled[post_id] = time_to_remind
+            heapq.heappush(self._heap, (time_to_remind, post_id))
+            if self._heap[0] == (time_to_remind, post_id):
+                self._wake()
+
+    def reminder_cancelled(self, post_id: int) -> None:
+        """
+        Forgets a reminder that was deleted
+
+        :param post_id: id of a post
+        :return:
+        """
+        with self._condition:
+            self._scheduled.pop(post_id, None)
+
+    def next_due(self):
+        """
+        Returns time of the earliest reminder
+
+        :return: unix timestamp or None if there is no reminder
+        """
+        with self._condition:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def wait_for_due(self, max_sleep=None) -> list[int]:
+        """
+        Sleeps until the earliest reminder is due and takes every reminder that is due by then
+
+        :param max_sleep: longest time in seconds to sleep, None to sleep until a reminder is due
+        :return: ids of due posts, empty if max_sleep passed first
+        """
+        deadline = None if max_sleep is None else time() + max_sleep
+        with self._condition:
+            while True:
+                due, wake_at = self._due_or_wake_at(deadline)
+                if due is not None:
+                    return due
+                self._condition.wait(None if wake_at is None else max(0.0, wake_at - time()))
+
+    async def wait_for_due_async(self, max_sleep=None) -> list[int]:
+        """
+        Waits like wait_for_due on an event loop, without holding a thread while it sleeps
+
+        :param max_sleep: longest time in seconds to sleep, None to sleep until a reminder is due
+        :return: ids of due posts, empty if max_sleep passed first
+        """
+        deadline = None if max_sleep is None else time() + max_sleep
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            self._events.append(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                with self._condition:
+                    due, wake_at = self._due_or_wake_at(deadline)
+                if due is not None:
+                    return due
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), None if wake_at is None else max(0.0, wake_at - time()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._condition:
+                self._events.remove(waiter)
+
+    def _due_or_wake_at(self, deadline) -> tuple:
+        """
+        Takes due reminders or tells when to look again, call with the condition held
+
+        :param deadline: unix timestamp when waiting ends or None
+        :return: ids of due posts or None, and a unix timestamp to wake at or None to wait for a change
+        """
+        self._drop_stale()
+        now = time()
+        if self._heap and self._heap[0][0] <= now:
+            return self._pop_due(now), None
+        if deadline is not None and now >= deadline:
+            return [], None
+        wake_at = self._heap[0][0] if self._heap else None
+        if deadline is not None:
+            wake_at = deadline if wake_at is None else min(wake_at, deadline)
+        return None, wake_at
+
+    def _wake(self) -> None:
+        """
+        Wakes up waiting threads and event loops after the earliest reminder changed, call with the condition held
+
+        :return:
+        """
+        self._condition.notify_all()
+        for loop, event in self._events:
+            loop.call_soon_threadsafe(event.set)
+
+    def _pop_due(self, now) -> list[int]:
+        """
+        Pops every reminder that is due
+
+        :param now: current unix timestamp
+        :return: ids of due posts
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            time_to_remind, post_id = heapq.heappop(self._heap)
+            if self._scheduled.get(post_id) == time_to_remind:
+                del self._scheduled[post_id]
+                due.append(post_id)
+        return due
+
+    def _drop_stale(self) -> None:
+        """
+        Removes entries of rescheduled and deleted reminders from the top of the heap
+
+        :return:
+        """
+        while self._heap and self._scheduled.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
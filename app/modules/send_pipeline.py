@@ -0,0 +1,158 @@
+"""Sending claimed reminders in three overlapping stages: prepare, post and finalize"""
+import math
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import time
+from modules.notification_workers import StageStats
+
+PREPARE_WORKERS = 4
+POST_WORKERS = 2
+LAG_SAMPLES = 1000
+
+
+class LagStats:
+    """Thread-safe window of the latest delays between the time a reminder was due and the time it was posted"""
+
+    def __init__(self, size=LAG_SAMPLES):
+        self._lags = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        """
+        Adds a delay of one posted reminder
+
+        :param seconds: seconds from the time to remind to the last post of a reminder
+        :return:
+        """
+        with self._lock:
+            self._lags.append(seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Returns a nearest-rank percentile of recorded delays
+
+        :param fraction: rank between 0 and 1, 0.99 for p99
+        :return: delay in seconds, 0 when nothing was recorded
+        """
+        with self._lock:
+            lags = sorted(self._lags)
+        return lags[max(0, math.ceil(fraction * len(lags)) - 1)] if lags else 0.0
+
+    def snapshot(self) -> dict:
+        """
+        Returns a summary of recorded delays
+
+        :return: dictionary with a count, p50, p99 and maximum in seconds
+        """
+        with self._lock:
+            count = len(self._lags)
+            longest = max(self._lags, default=0.0)
+        return {'count': count, 'p50': self.percentile(0.5), 'p99': self.percentile(0.99), 'max': longest}
+
+
+class SendPipeline:
+    """
+    Pools of threads that send a batch of claimed reminders stage by stage
+
+    A sender loads the whole batch from a database first. prepare plans a reminder in the outbox, resolves handles of
+    its title and uploads its media. post makes the posts of a reminder in order, each replying to the previous one.
+    finalize reschedules a reminder or reports it for archiving. Every reminder moves through the stages in the order
+    it was claimed, while a pool of each stage works on several reminders at once, so a reminder is prepared while
+    earlier ones are still being posted instead of waiting for all of them. A reminder whose stage fails skips the rest
+    and its lease expires, so it is tried again.
+    """
+
+    def __init__(self, sender, prepare_workers=PREPARE_WORKERS, post_workers=POST_WORKERS):
+        self.sender = sender
+        self.stats = StageStats()
+        self.lag = LagStats()
+        self._pools = {'prepare': ThreadPoolExecutor(prepare_workers, thread_name_prefix='prepare'),
+                       'post': ThreadPoolExecutor(post_workers, thread_name_prefix='post'),
+                       'finalize': ThreadPoolExecutor(1, thread_name_prefix='finalize')}
+
+    def run(self, records) -> list[int]:
+        """
+        Sends claimed reminders and waits until all of them went through every stage
+
+        :param records: claimed database records of posts, the most overdue first
+        :return: ids of reminders that will not be sent anymore and can be archived
+        """
+        self.sender.load(records)
+        prepared = [self._pools['prepare'].submit(self._stage, 'prepare', self._prepare, record) for record in records]
+        posted = [self._pools['post'].submit(self._stage, 'post', self._post, record, future) for record, future in zip(records, prepared)]
+        finalized = [self._pools['finalize'].submit(self._stage, 'finalize', self._finalize, record, future)
+                     for record, future in zip(records, posted)]
+        return [record.ID for record, future in zip(records, finalized) if future.result()]
+
+    def metrics(self) -> dict:
+        """
+        Returns latencies of stages and delays of posted reminders
+
+        :return: dictionary with counters of every stage and a summary of delays
+        """
+        return {'stages': self.stats.snapshot(), 'lag': self.lag.snapshot()}
+
+    def stop(self) -> None:
+        """
+        Lets pools finish submitted reminders and stops their threads
+
+        :return:
+        """
+        for pool in self._pools.values():
+            pool.shutdown()
+
+    def _stage(self, name: str, function, post_record, upstream: Future = None):
+        """
+        Runs a stage of a reminder once the stage before it finished
+
+        :param name: name of a stage
+        :param function: stage that takes a record and a result of the stage before it
+        :param post_record: database record of a post
+        :param upstream: future of the stage before it
+        :return: result of a stage or None if it failed
+        """
+        previous = () if upstream is None else (upstream.result(),)
+        try:
+            with self.stats.measure(name):
+                return function(post_record, *previous)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # an unexpected error of one reminder, like a malformed payload, must not end the whole batch
+            print("Error! Reminder", post_record.ID, "was not sent:", repr(e))
+            return None
+
+    def _prepare(self, post_record):
+        """
+        Prepares a reminder that was not sent at its time yet
+
+        :param post_record: database record of a post
+        :return: finished steps and posts still to make, None if there is nothing to post
+        """
+        if post_record.SENT_FIRE_TIME == post_record.TIME_TO_REMIND:
+            return None
+        return self.sender.prepare(post_record)
+
+    def _post(self, post_record, prepared) -> bool:
+        """
+        Posts a prepared reminder and records its delay
+
+        :param post_record: database record of a post
+        :param prepared: result of the prepare stage
+        :return: True if a reminder is sent at its time and can be finalized
+        """
+        if post_record.SENT_FIRE_TIME == post_record.TIME_TO_REMIND:
+            return True
+        if prepared is None or not self.sender.post(post_record, *prepared):
+            return False
+        self.lag.record(time() - post_record.TIME_TO_REMIND)
+        return True
+
+    def _finalize(self, post_record, posted) -> bool:
+        """
+        Reschedules a sent reminder
+
+        :param post_record: database record of a post
+        :param posted: result of the post stage
+        :return: True if a reminder can be archived
+        """
+        return bool(posted) and self.sender.finalize(post_record)
@@ -0,0 +1,96 @@
+"""Layout of a reminder title into posts of a thread, counted in graphemes with mentions at UTF-8 byte offsets"""
+import unicodedata
+
+GRAPHEME_LIMIT = 300
+ZERO_WIDTH_JOINER = '\u200d'
+REGIONAL_INDICATORS = (0x1F1E6, 0x1F1FF)
+EXTENDING_RANGES = ((0x1160, 0x11FF), (0xFE00, 0xFE0F), (0x1F3FB, 0x1F3FF), (0xE0020, 0xE007F), (0xE0100, 0xE01EF))
+
+
+def extends_grapheme(char: str, previous: str) -> bool:
+    """
+    Checks if a character continues the grapheme of the character before it
+
+    Covers combining marks, variation selectors, skin tones, emoji tags, Hangul vowels and trailing consonants,
+    emoji joined by a zero width joiner and CR LF, which is what handles and texts of reminders contain.
+
+    :param char: character
+    :param previous: character before it
+    :return: True if both characters are one grapheme
+    """
+    code = ord(char)
+    if char == ZERO_WIDTH_JOINER or previous == ZERO_WIDTH_JOINER or (previous, char) == ('\r', '\n'):
+        return True
+    return unicodedata.category(char) in ('Mn', 'Mc', 'Me') or any(start <= code <= end for start, end in EXTENDING_RANGES)
+
+
+def grapheme_length(text: str) -> int:
+    """
+    Counts user-perceived characters of a text, the unit of the post length limit of Bluesky
+
+    :param text: text
+    :return: number of graphemes
+    """
+    count = 0
+    previous = ''
+    regional = 0
+    for char in text:
+        if REGIONAL_INDICATORS[0] <= ord(char) <= REGIONAL_INDICATORS[1]:
+            regional += 1
+            count += regional % 2
+        else:
+            regional = 0
+            count += 0 if previous and extends_grapheme(char, previous) else 1
+        previous = char
+    return count
+
+
+def layout_thread(segments: list[tuple], limit=GRAPHEME_LIMIT) -> list[dict]:
+    """
+    Splits parts of a title into posts of a thread in one pass, a post holds at most limit graphemes
+
+    Every post is laid out completely before anything is sent: its text and, for every mention, the UTF-8 byte range
+    of "@handle" in that text, so that a sender only adds dids. A part is never split, a part longer than limit gets
+    a post of its own.
+
+    :param segments: list of (text, handle) tuples where handle is None for a plain text
+    :param limit: maximum number of graphemes in one post
+    :return: list of posts, each is a dictionary with a text and mentions as [byte_start, byte_end, handle] lists
+    """
+    posts = [([], [])]
+    graphemes = 0
+    offset = 0
+    for text, handle in segments:
+        length = grapheme_length(text)
+        if graphemes + length > limit and posts[-1][0]:
+            posts.append(([], []))
+            graphemes = 0
+            offset = 0
+        parts, mentions = posts[-1]
+        if handle is not None:
+            mentions.append([offset, offset + len(text.rstrip().encode()), handle])
+        parts.append(text)
+        graphemes += length
+        offset += len(text.encode())
+    return [{'text': ''.join(parts), 'mentions': mentions} for parts, mentions in posts]
+
+
+def title_layout(payload: dict):
+    """
+    Returns a layout of a title post planned in the outbox
+
+    :param payload: payload of a send_post step
+    :return: dictionary with a text and mentions, or None for the reminded post itself
+    """
+    return payload if 'mentions' in payload else None
+
+
+def mentioned_handles(payloads: list[dict]) -> list[str]:
+    """
+    Returns handles mentioned by title posts
+
+    :param payloads: payloads of send_post steps
+    :return: handles, each once, in the order they appear
+    """
+    layouts = [layout for layout in map(title_layout, payloads) if layout is not None]
+    return list(dict.fromkeys(handle for layout in layouts for _, _, handle in layout['mentions']))
@@ -0,0 +1,143 @@
+"""Tests for async_runtime.py"""
+import asyncio
+import os
+from time import time
+from types import SimpleNamespace
+from sqlalchemy.exc import OperationalError
+from modules.async_runtime import SEND_CONCURRENCY, AsyncBot
+from modules.classes import Post
+from modules.database_control import Database
+from modules.handle_resolver import HandleResolver
+from modules.partitions import drop_partitions
+from modules.post_cache import PostCache
+
+
+class FakeAsyncClient:
+    """AsyncClient where resolving a handle 'slow' waits until the other reminder is posted"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.sent = []
+        self.request = SimpleNamespace(rate_limit={})
+
+    async def resolve_handle(self, handle):
+        """Resolves a handle into a made up did"""
+        if handle == 'slow':
+            await self.gate.wait()
+        return SimpleNamespace(did='did:plc:' + handle)
+
+    async def get_posts(self, uris):
+        """Knows no posts"""
+        assert uris
+        return SimpleNamespace(posts=[])
+
+    async def send_post(self, text, reply_to=None, embed=None, facets=None):
+        """Remembers a text of a post and returns a made up reference"""
+        text = text if isinstance(text, str) else text.build_text()
+        self.sent.append((text, reply_to is not None, embed, facets))
+        if text == 'fast reminder':
+            self.gate.set()
+        return SimpleNamespace(uri='at://did:plc:bot/app.bsky.feed.post/' + str(len(self.sent)), cid='cid' + str(len(self.sent)))
+
+
+def create_reminder(text: str, mention: str) -> Post:
+    """Creates a reminder that is already due"""
+    post = Post()
+    post.set_text(text)
+    post.set_author_post('author')
+    post.set_author_remind('author')
+    post.set_every_n_seconds(0)
+    post.set_time_to_remind('2024-01-01 00:00:00')
+    post.set_time_send_request('2023-12-01T00:00:00.000Z')
+    post.set_people_remind([mention])
+    return post
+
+
+def test_slow_reminder_does_not_block():
+    """Test of a reminder waiting for its mentions while the next reminder is already sent, both read in one batch"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    database.insert_reminder(create_reminder('slow reminder', 'slow'), [], [])
+    database.insert_reminder(create_reminder('fast reminder', 'fast'), [], [])
+    client = FakeAsyncClient()
+    loads = []
+    load = database.load_reminder_bundle
+    database.load_reminder_bundle = lambda post_ids: loads.append(list(post_ids)) or load(post_ids)
+    database.get_facets_by_post_id = database.get_media_by_post_id = None
+
+    async def send_all():
+        bot = AsyncBot(client, database, 'media', HandleResolver(database))
+        await asyncio.wait_for(asyncio.gather(*await bot.dispatch(database.claim_due_posts(int(time())))), 5)
+        await bot.media_store.close()
+
+    asyncio.run(send_all())
+    texts = [sent[0] for sent in client.sent]
+    assert texts.index('fast reminder') < texts.index('slow reminder')
+    assert loads == [[1, 2]]
+    assert all(sent[1] for sent in client.sent if sent[0].endswith('reminder'))
+    assert database.get_pending_reminders() == []
+    drop_partitions(database, int(time()))
+    database.stop()
+    os.remove('test.db')
+
+
+def test_send_loop_claims_free_slots():
+    """Test that a backlog is claimed only as send slots free up, so no claimed reminder waits for a slot"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    for number in range(10):
+        database.insert_reminder(create_reminder('reminder ' + str(number), 'fast'), [], [])
+    client = FakeAsyncClient()
+    queued = []
+
+    async def send_all():
+        bot = AsyncBot(client, database, 'media', HandleResolver(database))
+        claim = database.claim_due_posts
+
+        def claim_free(now, limit=None):
+            queued.append(len(bot.tasks) + limit)
+            return claim(now, limit=limit)
+
+        database.claim_due_posts = claim_free
+        loop = asyncio.create_task(bot.send_loop())
+        while database.get_pending_reminders() or bot.tasks:
+            await asyncio.sleep(0.05)
+        loop.cancel()
+        await bot.media_store.close()
+
+    asyncio.run(asyncio.wait_for(send_all(), 10))
+    assert max(queued) <= SEND_CONCURRENCY
+    assert len([sent for sent in client.sent if sent[0].startswith('reminder')]) == 10
+    drop_partitions(database, int(time()))
+    database.stop()
+    os.remove('test.db')
+
+
+def test_failing_notification_does_not_stop_page():
+    """Test that a locked database or an unexpected error of one notification leaves the others of a page processed"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    processed = []
+
+    async def process_notification(notification, _app_handle, _posts):
+        if notification.uri.endswith('/0'):
+            raise OperationalError('UPDATE', {}, Exception('database is locked'))
+        if notification.uri.endswith('/1'):
+            raise ValueError("time data '2024-05-23T15:00:00Z' does not match format")
+        processed.append(notification.uri)
+
+    async def process_all():
+        bot = AsyncBot(FakeAsyncClient(), database, 'media', HandleResolver(database))
+        bot.process_notification = process_notification
+        notifications = [SimpleNamespace(uri='at://did:plc:1/app.bsky.feed.post/' + str(number), author=SimpleNamespace(did='did:plc:' + str(number % 2)))
+                         for number in range(4)]
+        await bot.process_page(notifications, 'bot.bsky.social', PostCache())
+        await bot.media_store.close()
+
+    asyncio.run(asyncio.wait_for(process_all(), 5))
+    assert sorted(processed) == ['at://did:plc:1/app.bsky.feed.post/2', 'at://did:plc:1/app.bsky.feed.post/3']
+    database.stop()
+    os.remove('test.db')
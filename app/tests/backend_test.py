@@ -0,0 +1,85 @@
+"""Tests of storage backends, SQLite by default and any SQLAlchemy URL given in TEST_DATABASE_URL, e.g. a local PostgreSQL"""
+import os
+import threading
+from sqlalchemy.dialects import postgresql
+from modules.classes import Post
+from modules.database_control import METADATA, Database, claim_statement, to_epoch
+from modules.storage import database_url
+
+TEST_DATABASE = os.getenv('TEST_DATABASE_URL', 'test.db')
+
+
+def open_database() -> Database:
+    """Opens an empty test database"""
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+    database = Database(TEST_DATABASE)
+    METADATA.drop_all(database.engine)
+    METADATA.create_all(database.engine)
+    return database
+
+
+def close_database(database: Database) -> None:
+    """Drops every table of a test database"""
+    METADATA.drop_all(database.engine)
+    database.stop()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+
+def create_test_post(minute: int) -> Post:
+    """Creates a test post"""
+    test_post = Post()
+    test_post.set_author_post('test_handle_1')
+    test_post.set_author_remind('test_handle_2')
+    test_post.set_text('test post that should be okay')
+    test_post.set_time_to_remind('2024-01-01 10:' + str(minute).zfill(2) + ':00')
+    test_post.set_time_send_request('2024-01-01T09:00:00.000Z')
+    return test_post
+
+
+def test_database_url():
+    """Test of paths and URLs accepted as a location of a database"""
+    assert database_url('database/database.db') == 'sqlite:///database/database.db'
+    assert database_url('postgresql+psycopg2://bot@localhost/bot') == 'postgresql+psycopg2://bot@localhost/bot'
+
+
+def test_claim_skips_locked_posts():
+    """Test of claims on PostgreSQL skipping posts that another instance is claiming"""
+    sql = str(claim_statement(60, 'node', 600, 10).compile(dialect=postgresql.dialect()))
+    assert 'FOR UPDATE SKIP LOCKED' in sql
+    assert 'LIMIT' in sql
+
+
+def test_instances_claim_disjoint_posts():
+    """Test of two bot instances claiming every due post exactly once"""
+    database = open_database()
+    other = Database(TEST_DATABASE)
+    post_ids = {database.insert_post(create_test_post(minute)) for minute in range(40)}
+    claimed = []
+
+    def claim(instance):
+        while rows := instance.claim_due_posts(to_epoch('2024-01-01 11:00'), limit=3):
+            claimed.extend(row.ID for row in rows)
+
+    threads = [threading.Thread(target=claim, args=(instance,)) for instance in (database, other, database, other)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(post_ids)
+    other.stop()
+    close_database(database)
+
+
+def test_delete_on_backend():
+    """Test of a post and its mentions being deleted with one statement"""
+    database = open_database()
+    test_post = create_test_post(0)
+    test_post.set_people_remind(['test_handle_3', 'test_handle_4'])
+    post_id = database.insert_post(test_post)
+    assert len(database.get_mentions(post_id)) == 2
+    database.delete_post_by_id(post_id, '')
+    assert database.get_mentions(post_id) == []
+    assert database.get_pending_reminders() == []
+    close_database(database)
@@ -0,0 +1,86 @@
+"""Tests for blob_cache.py"""
+import asyncio
+import hashlib
+import os
+import shutil
+from types import SimpleNamespace
+from atproto_client.exceptions import BadRequestError
+from atproto_client.models.blob_ref import BlobRef, IpldLink
+from modules.blob_cache import BlobCache, is_blob_rejection
+from modules.database_control import Database
+
+
+def create_blob(content: bytes) -> BlobRef:
+    """Creates a blob ref of content"""
+    return BlobRef(mime_type='image/jpeg', size=len(content), ref=IpldLink.model_validate({'$link': hashlib.sha256(content).hexdigest()}))
+
+
+class FakeRepo:
+    """Repository namespace that counts uploads"""
+
+    def __init__(self):
+        self.uploads = []
+
+    def upload_blob(self, data):
+        """Reads an uploaded file"""
+        content = data.read()
+        self.uploads.append(content)
+        return SimpleNamespace(blob=create_blob(content))
+
+    async def upload_blob_async(self, data):
+        """Reads an uploaded asynchronous stream"""
+        content = b''.join([chunk async for chunk in data])
+        self.uploads.append(content)
+        return SimpleNamespace(blob=create_blob(content))
+
+
+def create_media():
+    """Creates a database and a media folder with two images"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    os.makedirs('test_media', exist_ok=True)
+    for name, content in (('a.jpg', b'first image'), ('b.jpg', b'second image')):
+        with open('test_media/' + name, 'wb') as f:
+            f.write(content)
+    return Database('test.db')
+
+
+def test_get_blobs_cached():
+    """Test of uploading every file once until its blob ref is rejected"""
+    database = create_media()
+    repo = FakeRepo()
+    client = SimpleNamespace(com=SimpleNamespace(atproto=SimpleNamespace(repo=repo)))
+    cache = BlobCache(database, 'test_media')
+    first = cache.get_blobs(client, ['a.jpg', 'b.jpg'])
+    assert repo.uploads == [b'first image', b'second image']
+    assert BlobCache(database, 'test_media').get_blobs(client, ['b.jpg', 'a.jpg']) == [first[1], first[0]]
+    assert len(repo.uploads) == 2
+    cache.forget(['a.jpg'])
+    assert cache.get_blobs(client, ['a.jpg', 'b.jpg']) == first
+    assert repo.uploads[2:] == [b'first image']
+    database.stop()
+    shutil.rmtree('test_media')
+    os.remove('test.db')
+
+
+def test_get_blobs_async():
+    """Test of streaming uploads of files that are not cached with an AsyncClient"""
+    database = create_media()
+    repo = FakeRepo()
+    client = SimpleNamespace(com=SimpleNamespace(atproto=SimpleNamespace(repo=SimpleNamespace(upload_blob=repo.upload_blob_async))))
+    cache = BlobCache(database, 'test_media')
+    cache.get_blobs(SimpleNamespace(com=SimpleNamespace(atproto=SimpleNamespace(repo=repo))), ['a.jpg'])
+    blobs = asyncio.run(cache.get_blobs_async(client, ['a.jpg', 'b.jpg']))
+    assert blobs == [create_blob(b'first image'), create_blob(b'second image')]
+    assert repo.uploads == [b'first image', b'second image']
+    database.stop()
+    shutil.rmtree('test_media')
+    os.remove('test.db')
+
+
+def test_is_blob_rejection():
+    """Test of recognizing errors about missing blobs"""
+    rejected = SimpleNamespace(content=SimpleNamespace(error='InvalidRequest', message='Could not find blob: bafkrei'))
+    assert is_blob_rejection(BadRequestError(rejected))
+    assert not is_blob_rejection(BadRequestError(SimpleNamespace(content=SimpleNamespace(error='InvalidRequest', message='Text too long'))))
+    assert not is_blob_rejection(BadRequestError(None))
@@ -1,4 +1,5 @@
 """Tests for get_posts"""
+from types import SimpleNamespace
 import modules.bot_get_posts as bot
 
 
@@ -34,3 +35,22 @@ def test_get_time_to_remind_from_post():
     assert bot.get_time_to_remind_from_post('in 1 hour', test_date) == '2024-05-22 16:30:00'
     assert bot.get_time_to_remind_from_post('in 1 days', test_date) == '2024-05-23 15:30:00'
     assert bot.get_time_to_remind_from_post('in 1 year', test_date) == '2025-05-22 15:30:00'
+
+
+def test_mention_action():
+    """Tests deciding what a mention of a bot asks for"""
+    future = '2999-01-01 00:00:00'
+    parent = SimpleNamespace(record=SimpleNamespace(text='@bot.bsky.social remind me in 1 day'))
+    reply = SimpleNamespace(parent=SimpleNamespace(uri='at://parent'))
+    post = SimpleNamespace(value=SimpleNamespace(text='in 1 day', reply=reply))
+    assert bot.parent_to_fetch(post, future) == 'at://parent'
+    assert bot.parent_to_fetch(post, '2000-01-01 00:00:00') is None
+    assert bot.mention_action(post, parent, 'bot.bsky.social', '2000-01-01 00:00:00') == (None, bot.PAST_DATE_REPLY)
+    assert bot.mention_action(post, None, 'bot.bsky.social', future) == (None, bot.ERROR_REPLY)
+    assert bot.mention_action(post, parent, 'bot.bsky.social', future) == (bot.SAVE, bot.ok_reply_text(future))
+    post.value.text = 'delete'
+    assert bot.mention_action(post, parent, 'bot.bsky.social', future) == (bot.DELETE, bot.DELETED_REPLY)
+    assert bot.mention_action(post, parent, 'other.bsky.social', future) == (None, bot.NOT_FOUND_REPLY)
+    post.value.reply = None
+    assert bot.parent_to_fetch(post, future) is None
+    assert bot.mention_action(post, None, 'bot.bsky.social', future) == (None, bot.NOT_A_REPLY_REPLY)
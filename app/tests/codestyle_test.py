@@ -26,3 +26,22 @@ def test_codestyle():
     assert codestyle_module(inspect.getfile(modules.bot_send_posts)) == 10
     assert codestyle_module(inspect.getfile(modules.classes)) == 10
     assert codestyle_module(inspect.getfile(modules.database_control)) == 10
+    assert codestyle_module(inspect.getfile(modules.reminder_queue)) == 10
+    assert codestyle_module(inspect.getfile(modules.handle_resolver)) == 10
+    assert codestyle_module(inspect.getfile(modules.notification_ingest)) == 10
+    assert codestyle_module(inspect.getfile(modules.poll_control)) == 10
+    assert codestyle_module(inspect.getfile(modules.async_runtime)) == 10
+    assert codestyle_module(inspect.getfile(modules.notification_workers)) == 10
+    assert codestyle_module(inspect.getfile(modules.media_store)) == 10
+    assert codestyle_module(inspect.getfile(modules.blob_cache)) == 10
+    assert codestyle_module(inspect.getfile(modules.reminder_parser)) == 10
+    assert codestyle_module(inspect.getfile(modules.recurrence)) == 10
+    assert codestyle_module(inspect.getfile(modules.partitions)) == 10
+    assert codestyle_module(inspect.getfile(modules.storage)) == 10
+    assert codestyle_module(inspect.getfile(modules.leases)) == 10
+    assert codestyle_module(inspect.getfile(modules.outbox)) == 10
+    assert codestyle_module(inspect.getfile(modules.rate_limiter)) == 10
+    assert codestyle_module(inspect.getfile(modules.jetstream)) == 10
+    assert codestyle_module(inspect.getfile(modules.post_cache)) == 10
+    assert codestyle_module(inspect.getfile(modules.send_pipeline)) == 10
+    assert codestyle_module(inspect.getfile(modules.thread_layout)) == 10
@@ -1,7 +1,13 @@
 """Tests for database_control.py"""
 import os
-from modules.database_control import Database, convert_date
-from modules.classes import Post, Media
+import shutil
+import sqlite3
+import threading
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from modules.database_control import SCHEMA_VERSION, Database, convert_date, to_epoch
+from modules.classes import Post, Media, Facet
 
 
 def create_test_post() -> Post:
@@ -23,6 +29,12 @@ def test_convert_date():
     assert convert_date('2024-05-19T13:27:25.756Z') != '2024-05-19 13:28:41'
 
 
+def test_to_epoch():
+    """Test of converting dates into unix timestamps"""
+    assert to_epoch('1970-01-01 00:01') == 60
+    assert to_epoch('2024-05-19 13:28:41') == 1716125321
+
+
 def test_insert_person():
     """Test of inserting people"""
     if os.path.exists('test.db'):
@@ -74,6 +86,27 @@ def test_delete_post_by_id():
     os.remove('test.db')
 
 
+def test_delete_shared_media():
+    """Test of a media file being removed with the last reminder that refers to it"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    os.makedirs('test_media', exist_ok=True)
+    with open('test_media/cid.jpg', 'wb') as f:
+        f.write(b'image')
+    test_media = Media()
+    test_media.set_path('cid.jpg')
+    database = Database('test.db')
+    first_id = database.insert_reminder(create_test_post(), [test_media], [])
+    second_id = database.insert_reminder(create_test_post(), [test_media], [])
+    database.delete_post_by_id(first_id, 'test_media')
+    assert os.path.exists('test_media/cid.jpg')
+    database.delete_post_by_id(second_id, 'test_media')
+    assert not os.path.exists('test_media/cid.jpg')
+    database.stop()
+    os.rmdir('test_media')
+    os.remove('test.db')
+
+
 def test_delete_post():
     """Test of deleting post using Post class"""
     if os.path.exists('test.db'):
@@ -127,3 +160,179 @@ def test_insert_facets():
     assert database.get_facets_by_post_id(post_id)[0].URI == 'https://example.com'
     database.stop()
     os.remove('test.db')
+
+
+def test_shared_database_between_threads():
+    """Test of one database instance being used by several threads at once"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db', pool_size=2)
+
+    def insert_people(prefix):
+        for i in range(20):
+            database.find_person_or_insert(prefix + str(i))
+
+    threads = [threading.Thread(target=insert_people, args=('thread_' + str(i) + '_',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert database.find_person('thread_3_19') != -1
+    assert database.find_person_or_insert('test_handle_1') == 81
+    database.stop()
+    os.remove('test.db')
+
+
+def test_nested_transaction_rollback():
+    """Test of nested calls sharing one transaction that is rolled back as a whole"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    try:
+        with database.transaction():
+            database.insert_person('test_handle_1')
+            raise ValueError
+    except ValueError:
+        pass
+    assert database.find_person('test_handle_1') == -1
+    database.stop()
+    os.remove('test.db')
+
+
+def test_claim_due_posts():
+    """Test of claiming due posts, overdue ones included, only once"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    test_post = create_test_post()
+    database = Database('test.db')
+    overdue_id = database.insert_post(test_post)
+    test_post.set_time_to_remind('2023-12-01 15:40:00')
+    later_id = database.insert_post(test_post)
+    now = to_epoch('2023-12-01 15:39')
+    assert [row.ID for row in database.claim_due_posts(now)] == [overdue_id]
+    assert not database.claim_due_posts(now)
+    assert [row.ID for row in database.claim_due_posts(now + 60 * 60)] == [overdue_id, later_id]
+    database.update_post_time_remind(database.claim_due_posts(now + 60 * 60 * 2)[0])
+    assert [row.ID for row in database.claim_due_posts(now + 60 * 60 * 2)] == [overdue_id]
+    database.stop()
+    os.remove('test.db')
+
+
+def test_upgrade_legacy_database():
+    """Test of opening a database where reminder times are stored as strings"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    connection = sqlite3.connect('test.db')
+    connection.execute('CREATE TABLE POSTS (ID INTEGER NOT NULL, TEXT VARCHAR, TIME_TO_REMIND VARCHAR, AUTHOR_REMIND INTEGER, '
+                       'AUTHOR_POST INTEGER, EVERY_N_SECONDS INTEGER, TIME_SEND_REQUEST VARCHAR, PRIMARY KEY (ID))')
+    connection.execute("INSERT INTO POSTS VALUES (7, 'text', '2024-06-01 15:02', 1, 1, 0, '2024-05-23 15:02:20')")
+    connection.commit()
+    connection.close()
+    database = Database('test.db')
+    assert database.get_posts_by_time_to_remind('2024-06-01 15:02')[0].TIME_TO_REMIND == to_epoch('2024-06-01 15:02')
+    assert [row.ID for row in database.claim_due_posts(to_epoch('2024-06-02 00:00'))] == [7]
+    assert database.claim_due_posts(to_epoch('2024-06-03 00:00'), 0)[0].TIME_SEND_REQUEST == to_epoch('2024-05-23 15:02:20')
+    database.stop()
+    os.remove('test.db')
+
+
+def test_migrate_committed_database():
+    """Test of migrating a copy of the database shipped with the bot to the current schema"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    shutil.copyfile('database/database.db', 'test.db')
+    connection = sqlite3.connect('test.db')
+    mentions = connection.execute('SELECT COUNT(*) FROM PERSON_POST_MENTION WHERE POST_ID IN (SELECT ID FROM POSTS)').fetchone()[0]
+    connection.close()
+    Database('test.db').stop()
+    connection = sqlite3.connect('test.db')
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    assert connection.execute('PRAGMA foreign_key_check').fetchall() == []
+    assert connection.execute("SELECT COUNT(*) FROM POSTS WHERE typeof(TIME_SEND_REQUEST) != 'integer'").fetchone()[0] == 0
+    assert connection.execute('SELECT COUNT(*) FROM PERSON_POST_MENTION').fetchone()[0] == mentions
+    assert ('ix_POSTS_AUTHOR_REMIND_TIME_SEND_REQUEST',) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    connection.close()
+    os.remove('test.db')
+
+
+def test_delete_cascades():
+    """Test of deleting a post deleting its mentions, media and facets"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    test_media = Media()
+    test_media.set_path('image.jpg')
+    test_media.set_foreign('https://example.com')
+    test_facet = Facet()
+    test_facet.set_uri('https://example.com')
+    database = Database('test.db')
+    post_id = database.insert_reminder(create_test_post(), [test_media], [test_facet])
+    database.delete_post(create_test_post(), '')
+    assert database.get_mentions(post_id) == []
+    assert database.get_media_by_post_id(post_id) == []
+    assert database.get_facets_by_post_id(post_id) == []
+    database.stop()
+    os.remove('test.db')
+
+
+def test_insert_reminder():
+    """Test of inserting post with its media and facets at once"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    test_post = create_test_post()
+    test_media = Media()
+    test_media.set_path('image.jpg')
+    test_facet = Facet()
+    test_facet.set_index([0, 10])
+    test_facet.set_facet_type('link')
+    test_facet.set_uri('https://example.com')
+    database = Database('test.db')
+    post_id = database.insert_reminder(test_post, [test_media], [test_facet, test_facet])
+    assert database.get_media_by_post_id(post_id)[0].PATH == 'image.jpg'
+    assert len(database.get_facets_by_post_id(post_id)) == 2
+    assert len(database.get_mentions(post_id)) == 3
+    assert database.find_person('test_handle_5') != -1
+    database.stop()
+    os.remove('test.db')
+
+
+def test_load_reminder_bundle():
+    """Test of reading a batch of reminders with their people, facets and media in four queries"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    test_media = Media()
+    test_media.set_path('image.jpg')
+    test_media.set_foreign('')
+    test_facet = Facet()
+    test_facet.set_index([0, 10])
+    test_facet.set_facet_type('link')
+    test_facet.set_uri('https://example.com')
+    database = Database('test.db')
+    post_ids = [database.insert_reminder(create_test_post(), [test_media], [test_facet, test_facet]) for _ in range(10)]
+    statements = []
+    event.listen(database.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    bundles = database.load_reminder_bundle(post_ids + [1000])
+    assert len(statements) == 4
+    assert sorted(bundles) == post_ids
+    bundle = bundles[post_ids[0]]
+    assert bundle.post.TEXT == 'test post that should be okay'
+    assert bundle.people() == ('test_handle_1', 'test_handle_2', ['test_handle_3', 'test_handle_4', 'test_handle_5'])
+    assert len(bundle.facets) == 2
+    assert bundle.local_media_paths() == ['image.jpg']
+    database.stop()
+    os.remove('test.db')
+
+
+def test_insert_reminder_rollback():
+    """Test of a failing reminder leaving no rows behind"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    test_post = create_test_post()
+    test_media = Media()
+    test_media.set_path(object())
+    database = Database('test.db')
+    with pytest.raises(SQLAlchemyError):
+        database.insert_reminder(test_post, [test_media], [])
+    assert database.find_person('test_handle_1') == -1
+    assert len(database.get_posts_by_time_to_remind(test_post.time_to_remind)) == 0
+    database.stop()
+    os.remove('test.db')
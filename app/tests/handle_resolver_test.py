@@ -0,0 +1,76 @@
+"""Tests for handle_resolver.py"""
+import os
+from types import SimpleNamespace
+import sqlalchemy as db
+from modules.database_control import Database
+from modules.handle_resolver import HandleResolver
+
+
+class FakeClient:
+    """Client that counts how many times it was asked to resolve something"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def resolve_handle(self, handle):
+        """Resolves a handle into a made up did"""
+        self.calls += 1
+        return SimpleNamespace(did='did:plc:' + handle)
+
+    def get_profile(self, did):
+        """Resolves a did into a made up handle"""
+        self.calls += 1
+        return SimpleNamespace(handle=did.split(':')[-1])
+
+
+def test_get_did_cached():
+    """Test of resolving handles only once in both directions"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    client = FakeClient()
+    resolver = HandleResolver(database)
+    assert resolver.get_did(client, 'test_handle_1') == 'did:plc:test_handle_1'
+    assert resolver.get_did(client, 'test_handle_1') == 'did:plc:test_handle_1'
+    assert resolver.get_handle(client, 'did:plc:test_handle_1') == 'test_handle_1'
+    assert client.calls == 1
+    assert resolver.stats() == {'hits': 2, 'misses': 1, 'size': 1}
+    assert HandleResolver(database).get_did(client, 'test_handle_1') == 'did:plc:test_handle_1'
+    assert client.calls == 1
+    database.stop()
+    os.remove('test.db')
+
+
+def test_ttl_and_size():
+    """Test of expired and evicted entries being resolved again"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    client = FakeClient()
+    resolver = HandleResolver(database, ttl=60, max_size=1)
+    resolver.remember('did:plc:old', 'old', resolved_at=0)
+    assert resolver.get_did(client, 'old') == 'did:plc:old'
+    assert client.calls == 1
+    resolver.get_did(client, 'test_handle_2')
+    assert resolver.stats()['size'] == 1
+    assert database.find_person('old') == 1
+    database.stop()
+    os.remove('test.db')
+
+
+def test_remember_writes_only_changes():
+    """Test that remembering a cached pair again writes nothing, while a changed handle is written"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    resolver = HandleResolver(database, ttl=60)
+    resolver.remember('did:plc:1', 'first', resolved_at=1000)
+    resolver.remember('did:plc:1', 'first', resolved_at=1010)
+    resolver.remember('did:plc:2', 'second', resolved_at=1000)
+    resolver.remember('did:plc:3', 'second', resolved_at=1010)
+    with database.transaction() as connection:
+        rows = connection.execute(db.select(database.people_table.c.HANDLE, database.people_table.c.DID,
+                                            database.people_table.c.RESOLVED_AT).order_by(database.people_table.c.ID)).fetchall()
+    assert [tuple(row) for row in rows] == [('first', 'did:plc:1', 1000), ('second', 'did:plc:3', 1010)]
+    database.stop()
+    os.remove('test.db')
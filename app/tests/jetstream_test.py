@@ -0,0 +1,68 @@
+"""Tests for jetstream.py, a recorded stream is replayed from tests/fixtures"""
+import json
+import os
+from types import SimpleNamespace
+from modules.bot_get_posts import follow_stream
+from modules.database_control import Database, get_state
+from modules.jetstream import CURSOR_KEY, REWIND_US, JetstreamIngest, mention_of
+
+BOT_DID = 'did:plc:remindmebot'
+REPLAY = os.path.join(os.path.dirname(__file__), 'fixtures', 'jetstream_replay.jsonl')
+
+
+def replay() -> list[str]:
+    """Returns recorded messages of a stream"""
+    with open(REPLAY, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def open_database() -> Database:
+    """Opens an empty test database"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    return Database('test.db')
+
+
+def read_all(ingest: JetstreamIngest, messages: list[str]) -> list:
+    """Feeds messages to an ingest and returns new mentions"""
+    mentions = []
+    for message in messages:
+        if ingest.add(message):
+            mentions.extend(ingest.flush())
+    return mentions + ingest.flush()
+
+
+def test_mention_filter():
+    """Test that only new posts of other accounts that mention a bot pass"""
+    mentions = [mention_of(json.loads(message), BOT_DID) for message in replay()]
+    found = [mention for mention in mentions if mention is not None]
+    assert [mention.uri for mention in found] == ['at://did:plc:alice/app.bsky.feed.post/3ka1', 'at://did:plc:bob/app.bsky.feed.post/3kb2']
+    assert found[0].cid == 'bafy3ka1' and found[0].author.did == 'did:plc:alice' and found[0].author.handle is None
+    assert found[0].indexed_at == '2024-09-09T19:46:00.200000Z'
+
+
+def test_resume_from_cursor():
+    """Test that a reconnect resumes before the stored cursor and skips mentions that were already ingested"""
+    database = open_database()
+    ingest = JetstreamIngest(database, BOT_DID)
+    assert ingest.url('wss://jetstream.test/subscribe') == 'wss://jetstream.test/subscribe?wantedCollections=app.bsky.feed.post'
+    messages = replay()
+    assert [mention.cid for mention in read_all(ingest, messages[:9])] == ['bafy3ka1', 'bafy3kb2']
+    cursor = int(get_state(database, CURSOR_KEY))
+    assert cursor == json.loads(messages[8])['time_us']
+    resumed = JetstreamIngest(database, BOT_DID)
+    assert resumed.url('wss://jetstream.test/subscribe').endswith('&cursor=' + str(cursor - REWIND_US))
+    assert not read_all(resumed, messages)
+    assert int(get_state(database, CURSOR_KEY)) == json.loads(messages[-1])['time_us']
+    database.stop()
+    os.remove('test.db')
+
+
+def test_follow_stream():
+    """Test that a leader hands every new mention of a replayed stream to workers"""
+    database = open_database()
+    submitted = []
+    follow_stream(replay(), JetstreamIngest(database, BOT_DID), SimpleNamespace(database=database, prefetch=list), SimpleNamespace(submit=submitted.append))
+    assert [mention.author.did for mention in submitted] == ['did:plc:alice', 'did:plc:bob']
+    database.stop()
+    os.remove('test.db')
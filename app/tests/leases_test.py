@@ -0,0 +1,123 @@
+"""Tests of leases of reminders and of leader election between bot instances sharing a database"""
+import os
+import sqlalchemy as db
+from modules.classes import Post
+from modules.database_control import Database, to_epoch
+from modules.leases import NOTIFICATIONS_LEASE, acquire_lease, hold_lease, release_lease
+from modules.partitions import archive_posts, drop_partitions
+from modules.bot_send_posts import SendPost
+
+
+def open_instances() -> tuple:
+    """Opens two instances of a bot on an empty test database"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    first = Database('test.db')
+    first.node_id = 'node-a'
+    second = Database('test.db')
+    second.node_id = 'node-b'
+    return first, second
+
+
+def close_instances(*instances) -> None:
+    """Stops instances and removes a test database with its partitions"""
+    drop_partitions(instances[0], to_epoch('2100-01-01 00:00'))
+    for instance in instances:
+        instance.stop()
+    os.remove('test.db')
+
+
+def insert_test_post(database: Database, every=0) -> int:
+    """Inserts a test post that is due at 2024-01-01 10:00"""
+    test_post = Post()
+    test_post.set_author_post('test_handle_1')
+    test_post.set_author_remind('test_handle_2')
+    test_post.set_text('test post that should be okay')
+    test_post.set_time_to_remind('2024-01-01 10:00:00')
+    test_post.set_time_send_request('2024-01-01T09:00:00.000Z')
+    test_post.set_every_n_seconds(every)
+    return database.insert_post(test_post)
+
+
+def post_row(database: Database, post_id: int):
+    """Reads a row of POSTS"""
+    with database.transaction() as connection:
+        return connection.execute(db.select(database.post_table).where(database.post_table.c.ID == post_id)).first()
+
+
+def test_expired_lease_is_reclaimed():
+    """Test that a lease keeps a post from other instances until it expires"""
+    first, second = open_instances()
+    post_id = insert_test_post(first)
+    now = to_epoch('2024-01-01 10:00')
+    claimed = first.claim_due_posts(now, 60)
+    assert [row.ID for row in claimed] == [post_id]
+    assert claimed[0].CLAIMED_BY == 'node-a' and claimed[0].LEASE_UNTIL == now + 60
+    assert not second.claim_due_posts(now + 59)
+    assert [row.ID for row in second.claim_due_posts(now + 60)] == [post_id]
+    close_instances(first, second)
+
+
+def test_stale_instance_is_fenced():
+    """Test that an instance that lost its lease neither reschedules nor archives a post"""
+    first, second = open_instances()
+    post_id = insert_test_post(first, 60 * 60)
+    now = to_epoch('2024-01-01 10:00')
+    stale = first.claim_due_posts(now, 60)[0]
+    current = second.claim_due_posts(now + 60, 60)[0]
+    first.update_post_time_remind(stale)
+    archive_posts(first, [post_id], 'media')
+    assert post_row(second, post_id).TIME_TO_REMIND == now
+    second.update_post_time_remind(current)
+    assert post_row(second, post_id).TIME_TO_REMIND == now + 60 * 60
+    assert post_row(second, post_id).CLAIMED_BY is None
+    close_instances(first, second)
+
+
+def test_sent_reminder_is_not_sent_again():
+    """Test that a reminder sent before its lease expired is only rescheduled by the next instance"""
+    first, second = open_instances()
+    post_id = insert_test_post(first)
+    now = to_epoch('2024-01-01 10:00')
+    first.mark_post_sent(first.claim_due_posts(now, 60)[0])
+    record = second.claim_due_posts(now + 60)[0]
+    assert record.SENT_FIRE_TIME == record.TIME_TO_REMIND
+    assert SendPost(second, 'media', None, None).send_reminder(record)
+    archive_posts(second, [post_id], 'media')
+    assert post_row(second, post_id) is None
+    close_instances(first, second)
+
+
+def test_leader_election():
+    """Test that one instance holds a lease until it expires or is released"""
+    first, second = open_instances()
+    assert acquire_lease(first, NOTIFICATIONS_LEASE, 100, 30)
+    assert not acquire_lease(second, NOTIFICATIONS_LEASE, 110, 30)
+    assert acquire_lease(first, NOTIFICATIONS_LEASE, 120, 30)
+    assert not acquire_lease(second, NOTIFICATIONS_LEASE, 149, 30)
+    assert acquire_lease(second, NOTIFICATIONS_LEASE, 150, 30)
+    assert not acquire_lease(first, NOTIFICATIONS_LEASE, 151, 30)
+    release_lease(second, NOTIFICATIONS_LEASE)
+    assert acquire_lease(first, NOTIFICATIONS_LEASE, 152, 30)
+    close_instances(first, second)
+
+
+def test_hold_lease_renews_at_half_ttl():
+    """Test that a leader writes its lease only once half of ttl passed, and other instances still cannot take it"""
+    first, second = open_instances()
+    table = first.lease_table
+
+    def expires_at():
+        with first.transaction() as connection:
+            return connection.execute(db.select(table.c.EXPIRES_AT).where(table.c.NAME == NOTIFICATIONS_LEASE)).scalar()
+
+    assert hold_lease(first, NOTIFICATIONS_LEASE, 100, 30)
+    assert hold_lease(first, NOTIFICATIONS_LEASE, 114, 30)
+    assert expires_at() == 130
+    assert not hold_lease(second, NOTIFICATIONS_LEASE, 120, 30)
+    assert hold_lease(first, NOTIFICATIONS_LEASE, 115, 30)
+    assert expires_at() == 145
+    release_lease(first, NOTIFICATIONS_LEASE)
+    assert hold_lease(second, NOTIFICATIONS_LEASE, 116, 30)
+    assert not hold_lease(first, NOTIFICATIONS_LEASE, 117, 30)
+    close_instances(first, second)
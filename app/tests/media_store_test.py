@@ -0,0 +1,48 @@
+"""Tests for media_store.py"""
+import os
+import shutil
+import requests
+from modules.media_store import MediaStore, media_cid, media_file_name
+
+
+class FakeResponse:
+    """Streamed response of CDN"""
+
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def iter_content(self, chunk_size):
+        """Yields content in chunks"""
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+def test_download_once_per_cid(monkeypatch):
+    """Test of an image shared by many reminders being downloaded and stored once"""
+    os.makedirs('test_media', exist_ok=True)
+    urls = []
+
+    def fake_get(_session, url, **_kwargs):
+        urls.append(url)
+        return FakeResponse(404) if url.endswith('missing') else FakeResponse(200, url.encode() * 10000)
+
+    monkeypatch.setattr(requests.Session, 'get', fake_get)
+    store = MediaStore('test_media', workers=2)
+    assert store.download_all('did:plc:1', ['cid1', 'cid2', 'missing']) == ['cid1.jpg', 'cid2.jpg', None]
+    assert store.download_all('did:plc:2', ['cid1']) == [media_file_name('cid1')]
+    assert len(urls) == 3
+    with open('test_media/cid1.jpg', 'rb') as f:
+        assert f.read() == b'https://cdn.bsky.app/img/feed_fullsize/plain/did:plc:1/cid1' * 10000
+    assert sorted(os.listdir('test_media')) == ['cid1.jpg', 'cid2.jpg']
+    os.remove('test_media/cid2.jpg')
+    assert store.download_all('did:plc:1', [media_cid('cid2.jpg')]) == ['cid2.jpg']
+    assert len(urls) == 4
+    store.close()
+    shutil.rmtree('test_media')
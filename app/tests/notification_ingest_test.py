@@ -0,0 +1,78 @@
+"""Tests for notification_ingest.py"""
+import os
+from types import SimpleNamespace
+from modules.database_control import Database, get_state
+from modules.notification_ingest import INDEXED_AT_KEY, NotificationIngest
+
+
+class FakeNotifications:
+    """Notification endpoint that returns pages of a fixed list of notifications, newest first"""
+
+    def __init__(self, notifications):
+        self.notifications = notifications
+        self.list_calls = 0
+        self.seen_calls = 0
+
+    def list_notifications(self, params):
+        """Returns one page of notifications"""
+        self.list_calls += 1
+        start = int(params['cursor'] or 0)
+        end = start + params['limit']
+        cursor = str(end) if end < len(self.notifications) else None
+        return SimpleNamespace(notifications=self.notifications[start:end], cursor=cursor)
+
+    def update_seen(self, data):
+        """Marks notifications as seen"""
+        assert data['seen_at']
+        self.seen_calls += 1
+
+
+def create_client(notifications):
+    """Creates a fake client with given notifications"""
+    endpoint = FakeNotifications(notifications)
+    client = SimpleNamespace(app=SimpleNamespace(bsky=SimpleNamespace(notification=endpoint)),
+                             get_current_time_iso=lambda: '2024-05-23T16:00:00.000Z')
+    return client, endpoint
+
+
+def create_notification(number, reason='mention'):
+    """Creates a notification indexed at a given second"""
+    return SimpleNamespace(cid='cid_' + str(number), reason=reason, indexed_at=f'2024-05-23T15:00:{number:02d}.000Z')
+
+
+def test_fetch_new_incremental():
+    """Test of paging only through new notifications and writing nothing when idle"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    ingest = NotificationIngest(database, page_limit=2)
+    notifications = [create_notification(number) for number in (5, 4, 3)] + [create_notification(2, 'like')]
+    client, endpoint = create_client(notifications)
+    assert [notification.cid for notification in ingest.fetch_new(client)] == ['cid_3', 'cid_4', 'cid_5']
+    assert endpoint.list_calls == 2
+    assert get_state(database, INDEXED_AT_KEY) == '2024-05-23T15:00:05.000Z'
+    assert not ingest.fetch_new(client)
+    assert endpoint.list_calls == 3
+    assert endpoint.seen_calls == 1
+    endpoint.notifications = [create_notification(7), create_notification(6)] + notifications
+    assert [notification.cid for notification in ingest.fetch_new(client)] == ['cid_6', 'cid_7']
+    assert endpoint.list_calls == 5
+    database.stop()
+    os.remove('test.db')
+
+
+def test_fetch_new_pages_past_max_pages():
+    """Test that only the first poll stops after max_pages, later ones page on until the high-water mark"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    ingest = NotificationIngest(database, page_limit=2, max_pages=1)
+    client, endpoint = create_client([create_notification(number) for number in (11, 10, 9)])
+    assert [notification.cid for notification in ingest.fetch_new(client)] == ['cid_10', 'cid_11']
+    assert endpoint.list_calls == 1
+    endpoint.notifications = [create_notification(number) for number in range(20, 11, -1)] + endpoint.notifications
+    assert [notification.cid for notification in ingest.fetch_new(client)] == ['cid_' + str(number) for number in range(12, 21)]
+    assert endpoint.list_calls == 7
+    assert get_state(database, INDEXED_AT_KEY) == '2024-05-23T15:00:20.000Z'
+    database.stop()
+    os.remove('test.db')
@@ -0,0 +1,80 @@
+"""Tests for notification_workers.py"""
+import threading
+from time import sleep
+from types import SimpleNamespace
+from modules.notification_workers import NotificationWorkers, StageStats
+
+
+def create_notification(author: str, number: int) -> SimpleNamespace:
+    """Creates a notification of an author"""
+    return SimpleNamespace(uri='at://' + author + '/app.bsky.feed.post/' + str(number), author=SimpleNamespace(did=author))
+
+
+def test_order_per_author():
+    """Test of notifications of one author being processed in order while authors run in parallel"""
+    processed = []
+    running = set()
+    overlapped = threading.Event()
+    lock = threading.Lock()
+
+    def handler(notification):
+        with lock:
+            running.add(notification.author.did)
+            if len(running) > 1:
+                overlapped.set()
+        sleep(0.01 if notification.uri.endswith('/0') else 0)
+        with lock:
+            running.discard(notification.author.did)
+            processed.append(notification.uri)
+
+    workers = NotificationWorkers(handler, StageStats(), workers=4, queue_size=2)
+    authors = ['did:plc:' + str(number) for number in range(8)]
+    for number in range(5):
+        for author in authors:
+            workers.submit(create_notification(author, number))
+    workers.join()
+    for author in authors:
+        assert [uri for uri in processed if uri.startswith('at://' + author + '/')] == \
+               ['at://' + author + '/app.bsky.feed.post/' + str(number) for number in range(5)]
+    assert overlapped.is_set()
+    metrics = workers.metrics()
+    assert metrics['queue_depths'] == [0, 0, 0, 0]
+    assert metrics['stages']['total']['count'] == 40
+    assert metrics['stages']['wait']['count'] == 40
+    workers.stop()
+
+
+def test_failing_notification():
+    """Test of a worker surviving a notification that fails"""
+    processed = []
+
+    def handler(notification):
+        if notification.uri.endswith('/0'):
+            raise OSError('disk is full')
+        processed.append(notification.uri)
+
+    workers = NotificationWorkers(handler, StageStats(), workers=1)
+    workers.submit(create_notification('did:plc:1', 0))
+    workers.submit(create_notification('did:plc:1', 1))
+    workers.stop()
+    assert processed == ['at://did:plc:1/app.bsky.feed.post/1']
+
+
+def test_unexpected_error():
+    """Test that a handler raising an unexpected error neither kills its worker nor blocks join"""
+    processed = []
+
+    def handler(notification):
+        if notification.uri.endswith('/0'):
+            raise ValueError("time data '2024-05-23T15:00:00Z' does not match format")
+        processed.append(notification.uri)
+
+    workers = NotificationWorkers(handler, StageStats(), workers=1, queue_size=1)
+    for number in range(3):
+        workers.submit(create_notification('did:plc:1', number))
+    joined = threading.Thread(target=workers.join, daemon=True)
+    joined.start()
+    joined.join(timeout=5)
+    assert not joined.is_alive()
+    assert processed == ['at://did:plc:1/app.bsky.feed.post/1', 'at://did:plc:1/app.bsky.feed.post/2']
+    workers.stop()
@@ -0,0 +1,95 @@
+"""Tests for outbox.py"""
+import os
+from time import time
+from types import SimpleNamespace
+import atproto_client.exceptions
+import sqlalchemy as db
+from modules.bot_send_posts import SendPost
+from modules.classes import Post
+from modules.database_control import Database
+from modules.handle_resolver import HandleResolver
+from modules.outbox import BASE_BACKOFF_SEC, DONE, FAILED, MAX_BACKOFF_SEC, PENDING, backoff_delay
+from modules.partitions import drop_partitions
+
+
+class FakeClient:
+    """Client whose send_post raises queued errors before it posts"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    def resolve_handle(self, handle):
+        """Resolves a handle into a made up did"""
+        return SimpleNamespace(did='did:plc:' + handle)
+
+    def send_post(self, text, reply_to=None, embed=None, facets=None):
+        """Raises the next queued error or remembers a post and returns a made up reference"""
+        if self.errors and self.errors[0][0] == len(self.sent):
+            raise self.errors.pop(0)[1]
+        self.sent.append((text if isinstance(text, str) else text.build_text(), reply_to, embed, facets))
+        return SimpleNamespace(uri='at://did:plc:bot/app.bsky.feed.post/' + str(len(self.sent)), cid='cid' + str(len(self.sent)))
+
+
+def open_database() -> Database:
+    """Opens an empty test database with one due reminder"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    post = Post()
+    post.set_text('reminded post')
+    post.set_author_post('author')
+    post.set_author_remind('author')
+    post.set_every_n_seconds(0)
+    post.set_time_to_remind('2024-01-01 00:00:00')
+    post.set_time_send_request('2023-12-01T00:00:00.000Z')
+    post.set_people_remind(['friend'])
+    database.insert_reminder(post, [], [])
+    return database
+
+
+def close_database(database: Database) -> None:
+    """Removes a test database with its partitions"""
+    drop_partitions(database, int(time()) + 60 * 60 * 24 * 62)
+    database.stop()
+    os.remove('test.db')
+
+
+def test_backoff_delay():
+    """Test of exponential backoff between attempts"""
+    assert [backoff_delay(attempts) for attempts in (1, 2, 3)] == [BASE_BACKOFF_SEC, BASE_BACKOFF_SEC * 2, BASE_BACKOFF_SEC * 4]
+    assert backoff_delay(100) == MAX_BACKOFF_SEC
+
+
+def test_resume_after_failure():
+    """Test that a retry posts only the part of a thread that failed and replies to the title posted before"""
+    database = open_database()
+    client = FakeClient([(1, atproto_client.exceptions.NetworkError())])
+    send_post = SendPost(database, 'media', client, HandleResolver(database))
+    record = database.claim_due_posts(int(time()))[0]
+    assert not send_post.send_reminder(record)
+    steps = send_post.outbox.steps(record)
+    assert [step.STATE for step in steps] == [DONE, PENDING] and steps[1].ATTEMPTS == 1
+    assert not database.claim_due_posts(int(time()))
+    record = database.claim_due_posts(steps[1].NEXT_ATTEMPT_AT)[0]
+    assert SendPost(database, 'media', client, HandleResolver(database)).send_reminder(record)
+    assert [sent[0] for sent in client.sent][1:] == ['reminded post']
+    assert client.sent[1][1].parent.uri == client.sent[1][1].root.uri == 'at://did:plc:bot/app.bsky.feed.post/1'
+    assert not send_post.outbox.steps(record)
+    close_database(database)
+
+
+def test_permanent_failure():
+    """Test that an error a retry cannot fix abandons a reminder without marking it as sent or archiving it"""
+    database = open_database()
+    client = FakeClient([(1, atproto_client.exceptions.BadRequestError())])
+    send_post = SendPost(database, 'media', client, HandleResolver(database))
+    record = database.claim_due_posts(int(time()))[0]
+    assert not send_post.send_reminder(record)
+    assert len(client.sent) == 1
+    assert [step.STATE for step in send_post.outbox.steps(record)] == [DONE, FAILED]
+    with database.transaction() as connection:
+        row = connection.execute(db.select(database.post_table).where(database.post_table.c.ID == record.ID)).one()
+    assert row.SENT_FIRE_TIME is None and row.LEASE_UNTIL is None
+    assert not database.claim_due_posts(int(time()) + 60 * 60)
+    close_database(database)
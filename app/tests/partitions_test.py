@@ -0,0 +1,51 @@
+"""Tests for partitions.py"""
+import os
+from modules.classes import Post, Media, Facet
+from modules.database_control import Database, to_epoch
+from modules.partitions import archive_posts, archived_posts, drop_partitions, list_partitions, partition_path
+
+
+def create_test_post(time_to_remind: str) -> Post:
+    """Creates a test post"""
+    test_post = Post()
+    test_post.set_author_post('test_handle_1')
+    test_post.set_author_remind('test_handle_2')
+    test_post.set_text('test post that should be okay')
+    test_post.set_time_to_remind(time_to_remind)
+    test_post.set_time_send_request('2024-01-01T13:28:41.107Z')
+    test_post.set_people_remind(['test_handle_3'])
+    return test_post
+
+
+def test_archive_posts():
+    """Test of sent reminders moving with their rows into partitions of their months"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    os.makedirs('test_media', exist_ok=True)
+    with open('test_media/cid.jpg', 'wb') as f:
+        f.write(b'image')
+    test_media = Media()
+    test_media.set_path('cid.jpg')
+    test_facet = Facet()
+    test_facet.set_uri('https://example.com')
+    database = Database('test.db')
+    drop_partitions(database, to_epoch('2100-01-01 00:00'))
+    january = database.insert_reminder(create_test_post('2024-01-31 09:00:00'), [test_media], [test_facet])
+    february = database.insert_reminder(create_test_post('2024-02-01 09:00:00'), [test_media], [])
+    pending = database.insert_post(create_test_post('2024-03-01 09:00:00'))
+    archive_posts(database, [january], 'test_media')
+    assert os.path.exists('test_media/cid.jpg')
+    archive_posts(database, [february, 12345], 'test_media')
+    assert not os.path.exists('test_media/cid.jpg')
+    assert list_partitions(database) == ['2024_01', '2024_02']
+    assert [post_id for _, post_id in database.get_pending_reminders()] == [pending]
+    assert database.get_media_by_post_id(january) == [] and database.get_facets_by_post_id(january) == []
+    assert [row.ID for row in archived_posts(database, to_epoch('2024-01-01 00:00'), to_epoch('2024-03-01 00:00'))] == [january, february]
+    assert [row.ID for row in archived_posts(database, to_epoch('2024-02-01 00:00'), to_epoch('2024-02-02 00:00'))] == [february]
+    assert drop_partitions(database, to_epoch('2024-02-15 00:00')) == ['2024_01']
+    assert not os.path.exists(partition_path(database, '2024_01'))
+    assert archived_posts(database, to_epoch('2024-01-01 00:00'), to_epoch('2024-02-01 00:00')) == []
+    database.stop()
+    os.remove(partition_path(database, '2024_02'))
+    os.rmdir('test_media')
+    os.remove('test.db')
@@ -0,0 +1,50 @@
+"""Tests for poll_control.py"""
+import asyncio
+from time import time
+import httpx
+from modules.poll_control import AdaptivePoller, AsyncRateLimitAwareRequest, RateLimitAwareRequest
+
+
+def test_backoff_and_burst():
+    """Test of interval growing while idle and shrinking while work arrives"""
+    poller = AdaptivePoller(1, 30, jitter=0.1)
+    for _ in range(10):
+        poller.record(0)
+    assert poller.metrics()['interval'] == 30
+    assert 27 <= poller.next_delay() <= 33
+    poller.record(5)
+    poller.record(5)
+    assert poller.interval == 7.5
+    for _ in range(10):
+        poller.record(1)
+    assert poller.interval == 1
+
+
+def test_rate_limit_headers():
+    """Test of waiting for a rate limit reset when no requests remain"""
+    poller = AdaptivePoller(1, 30, jitter=0)
+    poller.record_rate_limit({'ratelimit-remaining': '100', 'ratelimit-reset': str(int(time()) + 60)})
+    assert poller.rate_limit_delay() == 0
+    poller.record_rate_limit({'ratelimit-remaining': '0', 'ratelimit-reset': str(int(time()) + 60)})
+    assert 55 < poller.next_delay() <= 60
+    poller.record_rate_limit({})
+    assert poller.metrics()['rate_limited_for'] > 55
+
+
+def test_request_records_headers(monkeypatch):
+    """Test of a request keeping only rate-limit headers of the latest response"""
+    monkeypatch.setattr(httpx.Client, 'request', lambda *args, **kwargs: httpx.Response(
+        200, headers={'RateLimit-Remaining': '10', 'Content-Type': 'application/json'}, content=b'{}'))
+    request = RateLimitAwareRequest()
+    request.get(url='https://bsky.social/xrpc/app.bsky.notification.listNotifications')
+    assert request.rate_limit == {'ratelimit-remaining': '10'}
+
+
+def test_async_request_records_headers(monkeypatch):
+    """Test of an asynchronous request keeping only rate-limit headers of the latest response"""
+    async def fake_request(*_args, **_kwargs):
+        return httpx.Response(200, headers={'RateLimit-Reset': '60', 'Content-Type': 'application/json'}, content=b'{}')
+    monkeypatch.setattr(httpx.AsyncClient, 'request', fake_request)
+    request = AsyncRateLimitAwareRequest()
+    asyncio.run(request.get(url='https://bsky.social/xrpc/app.bsky.notification.listNotifications'))
+    assert request.rate_limit == {'ratelimit-reset': '60'}
@@ -0,0 +1,100 @@
+"""Tests for post_cache.py"""
+import asyncio
+from types import SimpleNamespace
+from modules.post_cache import GET_POSTS_LIMIT, PostCache, batches, record_response
+
+
+def post_view(uri: str, parent=None):
+    """Returns a post view, a reply when parent is given"""
+    reply = SimpleNamespace(parent=SimpleNamespace(uri=parent), root=SimpleNamespace(uri=parent)) if parent else None
+    return SimpleNamespace(uri=uri, cid='cid-' + uri, record=SimpleNamespace(text='text', reply=reply))
+
+
+async def resolved(value):
+    """Returns value from a coroutine, like a response of an AsyncClient"""
+    return value
+
+
+class FakeClient:
+    """Client whose get_posts returns the posts it knows and counts calls"""
+
+    def __init__(self, views):
+        self.views = {view.uri: view for view in views}
+        self.calls = []
+
+    def get_posts(self, uris):
+        """Returns known posts of uris, like getPosts it skips the missing ones"""
+        assert len(uris) <= GET_POSTS_LIMIT
+        self.calls.append(list(uris))
+        return SimpleNamespace(posts=[self.views[uri] for uri in uris if uri in self.views])
+
+    def as_async(self) -> SimpleNamespace:
+        """Returns a client whose get_posts returns a coroutine like AsyncClient does"""
+        return SimpleNamespace(get_posts=lambda uris: resolved(self.get_posts(uris)))
+
+
+def page(count: int):
+    """Returns views of count mentions that reply to their own parents, and notifications of the mentions"""
+    mentions = [post_view(f'at://mention/{index}', f'at://parent/{index}') for index in range(count)]
+    parents = [post_view(f'at://parent/{index}') for index in range(count)]
+    return mentions + parents, [SimpleNamespace(uri=view.uri) for view in mentions]
+
+
+def test_batches():
+    """Test of splitting uris into calls of at most 25"""
+    assert [len(batch) for batch in batches([str(index) for index in range(60)])] == [25, 25, 10]
+    assert not batches([])
+
+
+def test_prefetch_page():
+    """Test that a page of 50 mentions and their parents costs 4 calls and handlers make none"""
+    views, notifications = page(50)
+    client = FakeClient(views)
+    cache = PostCache()
+    cache.prefetch(client, notifications)
+    assert len(client.calls) == 4
+    for index in range(50):
+        assert cache.view(client, f'at://mention/{index}').record.reply.parent.uri == f'at://parent/{index}'
+        assert cache.view(client, f'at://parent/{index}').uri == f'at://parent/{index}'
+    assert len(client.calls) == 4
+    assert cache.counters == {'hits': 100, 'misses': 0, 'calls': 4}
+    cache.prefetch(client, notifications)
+    assert len(client.calls) == 4
+
+
+def test_prefetch_async():
+    """Test that an AsyncClient fetches a page in the same number of calls"""
+    views, notifications = page(30)
+    client = FakeClient(views)
+    cache = PostCache()
+    asyncio.run(cache.prefetch_async(client.as_async(), notifications))
+    assert sorted(len(call) for call in client.calls) == [5, 5, 25, 25]
+    assert asyncio.run(cache.view_async(client.as_async(), 'at://parent/29')).uri == 'at://parent/29'
+    assert len(client.calls) == 4
+
+
+def test_miss_and_missing_post():
+    """Test that a post that is not cached is fetched alone and a deleted post is None"""
+    client = FakeClient([post_view('at://mention/0')])
+    cache = PostCache()
+    assert cache.view(client, 'at://mention/0').uri == 'at://mention/0'
+    assert cache.view(client, 'at://deleted/0') is None
+    assert cache.counters == {'hits': 0, 'misses': 2, 'calls': 2}
+
+
+def test_expiry_and_size():
+    """Test that old posts expire and the oldest are dropped from a full cache"""
+    client = FakeClient([post_view(f'at://mention/{index}') for index in range(3)])
+    cache = PostCache(ttl=-1)
+    cache.store(client.views.values())
+    assert cache.cached('at://mention/0') is None
+    cache = PostCache(max_size=2)
+    cache.store(client.views.values())
+    assert cache.cached('at://mention/0') is None
+    assert cache.cached('at://mention/2').uri == 'at://mention/2'
+
+
+def test_record_response():
+    """Test that a cached view looks like a response of get_post"""
+    response = record_response(SimpleNamespace(uri='at://mention/0', cid='bafy', record={'text': 'text'}))
+    assert (response.uri, response.cid, response.value) == ('at://mention/0', 'bafy', {'text': 'text'})
@@ -0,0 +1,75 @@
+"""Tests for rate_limiter.py"""
+import asyncio
+import threading
+from time import sleep
+import httpx
+from modules.poll_control import RateLimitAwareRequest
+from modules.rate_limiter import LOOKUP, REQUESTS, URGENT, RequestBudget, endpoint_of
+
+ENDPOINTS = {'com.atproto.repo.createRecord': (URGENT, {'writes': 3})}
+
+
+def test_endpoint_of():
+    """Test of reading an XRPC method from a url"""
+    assert endpoint_of('https://bsky.social/xrpc/com.atproto.repo.createRecord') == 'com.atproto.repo.createRecord'
+    assert endpoint_of('https://bsky.social/xrpc/app.bsky.feed.getPosts?uris=at://x') == 'app.bsky.feed.getPosts'
+
+
+def test_bucket_waits_for_refill():
+    """Test of a burst that fits into a bucket and a call that waits for a refill"""
+    budget = RequestBudget({REQUESTS: (100, 1), 'writes': (6, 0.3)}, ENDPOINTS, margin=1)
+    assert budget.acquire('com.atproto.repo.createRecord') < 0.01
+    assert budget.acquire('com.atproto.repo.createRecord') < 0.01
+    assert 0.1 < budget.acquire('com.atproto.repo.createRecord') < 0.3
+    assert budget.acquire('app.bsky.actor.getProfile') < 0.01
+    metrics = budget.metrics()
+    assert metrics['com.atproto.repo.createRecord']['calls'] == 3
+    assert metrics['com.atproto.repo.createRecord']['max_wait'] > 0.1
+
+
+def test_urgent_call_goes_first():
+    """Test of a reminder send overtaking a lookup that waited for the same bucket longer"""
+    budget = RequestBudget({REQUESTS: (1, 0.3)}, ENDPOINTS, margin=1)
+    budget.acquire('app.bsky.feed.getPosts')
+    order = []
+    lookup = threading.Thread(target=lambda: (budget.acquire('app.bsky.feed.getPosts'), order.append('lookup')))
+    lookup.start()
+    sleep(0.05)
+    assert budget.route('com.atproto.repo.createRecord')[0] < budget.route('app.bsky.feed.getPosts')[0] == LOOKUP
+    budget.acquire('com.atproto.repo.createRecord')
+    order.append('send')
+    lookup.join()
+    assert order == ['send', 'lookup']
+
+
+def test_async_acquire():
+    """Test of waiting for a budget on an event loop"""
+    budget = RequestBudget({REQUESTS: (1, 0.1)}, ENDPOINTS, margin=1)
+
+    async def acquire_twice():
+        return [await budget.acquire_async('app.bsky.feed.getPosts') for _ in range(2)]
+
+    first, second = asyncio.run(acquire_twice())
+    assert first < 0.01 < second
+
+
+def test_request_takes_budget(monkeypatch):
+    """Test of a client request spending a budget of its endpoint"""
+    monkeypatch.setattr(httpx.Client, 'request', lambda *args, **kwargs: httpx.Response(
+        200, headers={'Content-Type': 'application/json'}, content=b'{}'))
+    budget = RequestBudget()
+    RateLimitAwareRequest(budget).get(url='https://bsky.social/xrpc/app.bsky.notification.listNotifications')
+    assert budget.metrics()['app.bsky.notification.listNotifications']['calls'] == 1
+
+
+def test_exhausted_writes_do_not_block_lookups():
+    """Test of a lookup going on while a send waits for write points that refill only in an hour"""
+    budget = RequestBudget({REQUESTS: (100, 1), 'writes': (3, 3600)}, ENDPOINTS, margin=1)
+    budget.acquire('com.atproto.repo.createRecord')
+    send = threading.Thread(target=budget.acquire, args=('com.atproto.repo.createRecord',), daemon=True)
+    send.start()
+    sleep(0.1)
+    assert budget.buckets['writes'].waiting[URGENT] == 1
+    assert not budget.buckets[REQUESTS].outranked(LOOKUP)
+    assert budget.acquire('app.bsky.actor.getProfile') < 0.05
+    assert send.is_alive()
@@ -0,0 +1,71 @@
+"""Tests for recurrence.py"""
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from modules.classes import Post
+from modules.database_control import Database, to_epoch
+from modules.recurrence import Recurrence, next_fire_times, parse_rule
+
+
+def test_months_do_not_drift():
+    """Test of a monthly rule anchored on the 31st coming back to the 31st after shorter months"""
+    rule = Recurrence('months', 1, to_epoch('2024-01-31 09:00:00'))
+    times = [datetime.fromtimestamp(time, timezone.utc).strftime('%Y-%m-%d %H:%M') for time in rule.upcoming(rule.anchor, 4)]
+    assert times == ['2024-02-29 09:00', '2024-03-31 09:00', '2024-04-30 09:00', '2024-05-31 09:00']
+    yearly = Recurrence('years', 1, to_epoch('2024-02-29 09:00:00'))
+    assert yearly.next_after(yearly.anchor) == to_epoch('2025-02-28 09:00:00')
+    assert yearly.next_after(to_epoch('2027-06-01 00:00:00')) == to_epoch('2028-02-29 09:00:00')
+
+
+def test_count_and_until():
+    """Test of rules that stop after a number of occurrences or after a time"""
+    anchor = to_epoch('2024-05-01 12:00:00')
+    assert Recurrence('days', 2, anchor, count=3).upcoming(anchor - 1, 10) == [anchor, anchor + 2 * 86400, anchor + 4 * 86400]
+    assert Recurrence('hours', 1, anchor, until=anchor + 3 * 3600).upcoming(anchor, 10) == [anchor + 3600, anchor + 7200, anchor + 10800]
+    assert Recurrence('minutes', 5, anchor).next_after(anchor + 3 * 3600 + 1) == anchor + 3 * 3600 + 300
+
+
+def test_rule_round_trip():
+    """Test of storing a rule as text"""
+    rule = Recurrence('months', 2, 1717252207, count=5)
+    assert rule.to_rule() == 'FREQ=MONTHLY;INTERVAL=2;DTSTART=1717252207;COUNT=5'
+    parsed = parse_rule(rule.to_rule())
+    assert (parsed.unit, parsed.interval, parsed.anchor, parsed.count, parsed.until) == ('months', 2, 1717252207, 5, None)
+    assert Recurrence.from_seconds(1209600).to_rule() == 'FREQ=WEEKLY;INTERVAL=2'
+    assert Recurrence.from_seconds(0) is None
+
+
+def test_next_fire_times():
+    """Test of computing next fire times of many rows, including rows that only have EVERY_N_SECONDS"""
+    anchor = to_epoch('2024-01-31 09:00:00')
+    rows = [SimpleNamespace(ID=number, TIME_TO_REMIND=anchor, EVERY_N_SECONDS=0,
+                            RECURRENCE='FREQ=MONTHLY;INTERVAL=1;DTSTART=' + str(anchor)) for number in range(1000)]
+    rows.append(SimpleNamespace(ID=1000, TIME_TO_REMIND=anchor, EVERY_N_SECONDS=60, RECURRENCE=None))
+    rows.append(SimpleNamespace(ID=1001, TIME_TO_REMIND=anchor, EVERY_N_SECONDS=0, RECURRENCE=None))
+    times = next_fire_times(rows, anchor)
+    assert times[999] == to_epoch('2024-02-29 09:00:00')
+    assert times[1000] == anchor + 60
+    assert times[1001] is None
+
+
+def test_update_post_time_remind():
+    """Test of a repeating reminder skipping missed occurrences and ending after its last one"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    test_post = Post()
+    test_post.set_author_post('test_handle_1')
+    test_post.set_author_remind('test_handle_2')
+    test_post.set_time_to_remind('2024-01-31 09:00:00')
+    test_post.set_time_send_request('2024-01-01T13:28:41.107Z')
+    test_post.set_recurrence(Recurrence('months', 1, count=3))
+    database.insert_post(test_post)
+    record = database.claim_due_posts(to_epoch('2024-01-31 09:00:00'))[0]
+    assert record.RECURRENCE == 'FREQ=MONTHLY;INTERVAL=1;DTSTART=' + str(to_epoch('2024-01-31 09:00:00')) + ';COUNT=3'
+    assert record.EVERY_N_SECONDS == 30 * 24 * 60 * 60
+    assert database.update_post_time_remind(record, to_epoch('2024-03-01 00:00:00'))
+    record = database.claim_due_posts(to_epoch('2024-03-31 09:00:00'))[0]
+    assert record.TIME_TO_REMIND == to_epoch('2024-03-31 09:00:00')
+    assert not database.update_post_time_remind(record, to_epoch('2024-03-31 09:00:00'))
+    database.stop()
+    os.remove('test.db')
@@ -0,0 +1,41 @@
+"""Tests for reminder_parser.py"""
+from benchmarks.reminder_parser_benchmark import BOT, CORPUS, TIME_SEND, legacy_every, legacy_time_to_remind
+from modules.bot_get_posts import count_remind, get_every_from_post, get_time_to_remind_from_post
+from modules.reminder_parser import parse_reminder, time_to_remind
+
+
+def test_same_as_legacy_functions():
+    """Test of the parser giving the same answers as the functions it replaced"""
+    for text in CORPUS:
+        assert get_time_to_remind_from_post(text, TIME_SEND) == legacy_time_to_remind(text, TIME_SEND), text
+        assert get_every_from_post(text) == legacy_every(text), text
+
+
+def test_structured_result():
+    """Test of reading periods and a date in one pass"""
+    parsed = parse_reminder(BOT + ' every 2 Weeks on 01.06.2025 at 9:05')
+    assert parsed.every == (2, 'weeks')
+    assert parsed.every_seconds() == 2 * 7 * 24 * 60 * 60
+    assert parsed.remind_in is None
+    assert parsed.date == {'day': 1, 'month': 6, 'year': 2025}
+    assert parsed.time == {'hour': 9, 'minute': 5}
+    assert parsed.fuzzy_text is None
+    assert parse_reminder(BOT + ' In 3 Days').remind_in == (3, 'days')
+    assert parse_reminder(BOT + ' on monday').fuzzy_text is not None
+
+
+def test_month_overflow():
+    """Test of adding months past December and to days that a month does not have"""
+    assert count_remind('1 month', '2024-11-15 10:00:00') == '2024-12-15 10:00:00'
+    assert count_remind('2 months', '2024-11-15 10:00:00') == '2025-01-15 10:00:00'
+    assert count_remind('13 months', '2024-12-15 10:00:00') == '2026-01-15 10:00:00'
+    assert count_remind('1 month', '2024-01-31 10:00:00') == '2024-02-29 10:00:00'
+    assert count_remind('1 year', '2024-02-29 10:00:00') == '2025-02-28 10:00:00'
+    assert time_to_remind('in 1 month', '2024-11-30 10:00:00') == '2024-12-30 10:00:00'
+
+
+def test_every_without_date():
+    """Test of a repeating reminder without a date being sent in one day instead of on a day of the current month"""
+    assert get_time_to_remind_from_post(BOT + ' every 2 weeks', TIME_SEND) == '2024-05-23 15:30:07'
+    assert get_time_to_remind_from_post(BOT + ' every 3 months 01.06.2025', TIME_SEND) == '2025-06-01 15:30:07'
+    assert get_every_from_post(BOT + ' every 3 months 01.06.2025') == 3 * 30 * 24 * 60 * 60
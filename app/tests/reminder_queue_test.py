@@ -0,0 +1,71 @@
+"""Tests for reminder_queue.py"""
+import asyncio
+import os
+import threading
+from time import time
+from modules.reminder_queue import ReminderQueue
+from modules.database_control import Database
+from modules.classes import Post
+
+
+def test_wait_for_due_order():
+    """Test of taking due reminders while skipping rescheduled and cancelled ones"""
+    reminder_queue = ReminderQueue()
+    now = int(time())
+    reminder_queue.load([(now - 10, 1), (now - 5, 2), (now + 3600, 3), (now - 1, 4)])
+    reminder_queue.reminder_scheduled(2, now + 60)
+    reminder_queue.reminder_cancelled(4)
+    assert reminder_queue.wait_for_due(0) == [1]
+    assert reminder_queue.wait_for_due(0) == []
+    assert reminder_queue.next_due() == now + 60
+    assert len(reminder_queue) == 2
+
+
+def test_wait_for_due_wakes_up():
+    """Test of a new reminder waking up a sender that sleeps until a later reminder"""
+    reminder_queue = ReminderQueue()
+    reminder_queue.load([(int(time()) + 3600, 1)])
+    timer = threading.Timer(0.1, reminder_queue.reminder_scheduled, args=(2, int(time()) - 1))
+    timer.start()
+    start = time()
+    assert reminder_queue.wait_for_due(5) == [2]
+    assert time() - start < 1
+    timer.join()
+
+
+def test_database_notifies_queue():
+    """Test of database pushing committed changes into the queue"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    reminder_queue = ReminderQueue()
+    database.listeners.append(reminder_queue)
+    test_post = Post()
+    test_post.set_author_post('test_handle_1')
+    test_post.set_author_remind('test_handle_2')
+    test_post.set_every_n_seconds(60)
+    test_post.set_time_to_remind('2023-12-01 15:34:12')
+    test_post.set_time_send_request('2022-05-19T13:28:41.107Z')
+    post_id = database.insert_post(test_post)
+    assert reminder_queue.next_due() == 1701444840
+    database.update_post_time_remind(database.claim_due_posts(int(time()))[0])
+    assert reminder_queue.next_due() == 1701444900
+    database.delete_post_by_id(post_id, '')
+    assert reminder_queue.next_due() is None
+    database.stop()
+    os.remove('test.db')
+
+
+def test_wait_for_due_async():
+    """Test of an event loop waking up when a reminder is scheduled from another thread"""
+    reminder_queue = ReminderQueue()
+    reminder_queue.load([(int(time()) + 3600, 1)])
+
+    async def wait():
+        timer = threading.Timer(0.1, reminder_queue.reminder_scheduled, args=(2, int(time()) - 1))
+        timer.start()
+        due = await reminder_queue.wait_for_due_async(5)
+        timer.join()
+        return due, await reminder_queue.wait_for_due_async(0.05)
+
+    assert asyncio.run(wait()) == ([2], [])
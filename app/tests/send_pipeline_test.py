@@ -0,0 +1,95 @@
+"""Tests for send_pipeline.py"""
+import threading
+from time import sleep, time
+from types import SimpleNamespace
+from modules.send_pipeline import LagStats, SendPipeline
+
+
+class FakeSender:
+    """Sender whose stages sleep and record the order they ran in"""
+
+    def __init__(self, failing=None):
+        self.events = []
+        self.failing = failing or {}
+        self.lock = threading.Lock()
+        self.preparing = set()
+        self.overlapped = threading.Event()
+
+    def load(self, records) -> None:
+        """Records that a batch was loaded before any stage"""
+        self.events.append(('load', len(records)))
+
+    def log(self, stage: str, post_record) -> None:
+        """Records a stage of a reminder"""
+        with self.lock:
+            self.events.append((stage, post_record.ID))
+
+    def prepare(self, post_record):
+        """Takes a while, like handle lookups and uploads"""
+        with self.lock:
+            self.preparing.add(post_record.ID)
+        sleep(0.02)
+        self.log('prepare', post_record)
+        with self.lock:
+            self.preparing.discard(post_record.ID)
+        if post_record.ID in self.failing:
+            raise self.failing[post_record.ID]
+        return [], ['title', 'body']
+
+    def post(self, post_record, done, posts) -> bool:
+        """Makes posts of a reminder in order"""
+        with self.lock:
+            if self.preparing:
+                self.overlapped.set()
+        for part in posts:
+            sleep(0.01)
+            done.append(part)
+        self.log('post', post_record)
+        return done == ['title', 'body']
+
+    def finalize(self, post_record) -> bool:
+        """Archives reminders with an even id"""
+        self.log('finalize', post_record)
+        return post_record.ID % 2 == 0
+
+
+def record(post_id: int, sent=False) -> SimpleNamespace:
+    """Returns a claimed reminder that was due a second ago"""
+    due = int(time()) - 1
+    return SimpleNamespace(ID=post_id, TIME_TO_REMIND=due, SENT_FIRE_TIME=due if sent else None)
+
+
+def test_stages_overlap_in_order():
+    """Test that reminders are prepared while earlier ones are posted, and each stage keeps the claimed order"""
+    sender = FakeSender()
+    pipeline = SendPipeline(sender, prepare_workers=4, post_workers=1)
+    assert pipeline.run([record(post_id) for post_id in range(1, 9)]) == [2, 4, 6, 8]
+    assert sender.events[0] == ('load', 8)
+    assert [post_id for stage, post_id in sender.events if stage == 'post'] == list(range(1, 9))
+    assert [post_id for stage, post_id in sender.events if stage == 'finalize'] == list(range(1, 9))
+    assert sender.overlapped.is_set()
+    metrics = pipeline.metrics()
+    assert metrics['stages']['post']['count'] == 8
+    assert metrics['lag']['count'] == 8
+    assert 1 <= metrics['lag']['p99'] < 5
+    pipeline.stop()
+
+
+def test_failed_and_sent_reminders():
+    """Test that a failed reminder is left to its lease and a reminder sent before is only finalized"""
+    sender = FakeSender(failing={2: OSError('upload failed'), 8: KeyError('text')})
+    pipeline = SendPipeline(sender)
+    assert pipeline.run([record(2), record(4, sent=True), record(6), record(8)]) == [4, 6]
+    assert ('post', 2) not in sender.events and ('prepare', 4) not in sender.events and ('post', 4) not in sender.events
+    assert ('post', 8) not in sender.events and ('finalize', 8) not in sender.events
+    assert pipeline.metrics()['lag']['count'] == 1
+    pipeline.stop()
+
+
+def test_lag_percentiles():
+    """Test of nearest-rank percentiles over a window of delays"""
+    lags = LagStats(size=100)
+    assert lags.snapshot() == {'count': 0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+    for seconds in range(200):
+        lags.record(float(seconds))
+    assert lags.snapshot() == {'count': 100, 'p50': 149.0, 'p99': 198.0, 'max': 199.0}
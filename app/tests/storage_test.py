@@ -0,0 +1,95 @@
+"""Tests for storage.py"""
+import os
+import threading
+from time import sleep
+import pytest
+from modules.database_control import Database
+
+
+def block_writer(database: Database) -> tuple:
+    """Starts a write that keeps the writer busy until a returned event is set"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def wait_in_writer():
+        database.insert_person('blocking_handle')
+        started.set()
+        release.wait()
+
+    thread = threading.Thread(target=database.write, args=(wait_in_writer,))
+    thread.start()
+    started.wait()
+    return release, thread
+
+
+def wait_for_queue(database: Database, size: int) -> None:
+    """Waits until a number of writes is queued for the writer"""
+    while database.writer.pending() < size:
+        sleep(0.01)
+
+
+def test_profile_pragmas():
+    """Test of every pooled connection getting the pragmas of a storage profile"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    pragmas = database.pragmas()
+    assert pragmas['journal_mode'] == 'wal'
+    assert pragmas['synchronous'] == 1
+    assert pragmas['busy_timeout'] == 5000
+    assert pragmas['foreign_keys'] == 1
+    database.stop()
+    os.remove('test.db')
+
+
+def test_group_commit():
+    """Test of writes queued while the writer is busy being committed in one transaction"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    release, blocker = block_writer(database)
+    assert database.find_person('blocking_handle') == -1
+    threads = [threading.Thread(target=database.insert_person, args=('handle_' + str(i),)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    wait_for_queue(database, 10)
+    commits = database.writer.commits
+    release.set()
+    for thread in threads + [blocker]:
+        thread.join()
+    assert database.writer.commits == commits + 2
+    assert all(database.find_person('handle_' + str(i)) != -1 for i in range(10))
+    database.stop()
+    os.remove('test.db')
+
+
+def test_failing_write_in_a_batch():
+    """Test of a failing write losing only its own changes when it shares a batch with others"""
+    if os.path.exists('test.db'):
+        os.remove('test.db')
+    database = Database('test.db')
+    errors = []
+
+    def failing_write():
+        database.insert_person('failing_handle')
+        raise ValueError
+
+    def run_failing():
+        with pytest.raises(ValueError):
+            database.write(failing_write)
+        errors.append(ValueError)
+
+    release, blocker = block_writer(database)
+    threads = [threading.Thread(target=database.insert_person, args=('first_handle',)), threading.Thread(target=run_failing),
+               threading.Thread(target=database.insert_person, args=('second_handle',))]
+    for thread in threads:
+        thread.start()
+        wait_for_queue(database, threads.index(thread) + 1)
+    release.set()
+    for thread in threads + [blocker]:
+        thread.join()
+    assert errors == [ValueError]
+    assert database.find_person('failing_handle') == -1
+    assert database.find_person('first_handle') != -1 and database.find_person('second_handle') != -1
+    database.stop()
+    os.remove('test.db')
@@ -0,0 +1,45 @@
+"""Tests for thread_layout.py"""
+from modules.bot_send_posts import mention_facets, title_segments
+from modules.thread_layout import GRAPHEME_LIMIT, grapheme_length, layout_thread, mentioned_handles
+
+
+def test_grapheme_length():
+    """Test of counting graphemes the way Bluesky limits posts, not code points"""
+    assert grapheme_length('reminder') == 8
+    assert grapheme_length('é') == 1
+    assert grapheme_length('\U0001F44D\U0001F3FD') == 1
+    assert grapheme_length('\U0001F468\u200d\U0001F469\u200d\U0001F467') == 1
+    assert grapheme_length('\U0001F1FA\U0001F1E6\U0001F1F5\U0001F1F1') == 2
+    assert grapheme_length('❤️!') == 2
+    assert grapheme_length('\r\n') == 1
+
+
+def test_mention_byte_offsets():
+    """Test that mentions are laid out as UTF-8 byte ranges of @handle without the space after it"""
+    layout = layout_thread([('Hi \U0001F44B ', None), ('@zoë.bsky.social ', 'zoë.bsky.social'), ('bye', None)])
+    assert len(layout) == 1
+    text = layout[0]['text'].encode()
+    start, end, handle = layout[0]['mentions'][0]
+    assert handle == 'zoë.bsky.social'
+    assert text[start:end].decode() == '@zoë.bsky.social'
+    assert mention_facets(layout[0], {'zoë.bsky.social': 'did:plc:zoe'})[0].index.byte_start == start
+    assert not mention_facets(layout[0], {'zoë.bsky.social': None})
+
+
+def test_split_by_graphemes():
+    """Test that a title with hundreds of mentions is split into posts of at most 300 graphemes at part boundaries"""
+    handles = ['user' + str(number) + '.bsky.social' for number in range(500)]
+    layout = layout_thread(title_segments('author.bsky.social', 'reminder.bsky.social', handles))
+    assert len(layout) > 1
+    assert all(grapheme_length(post['text']) <= GRAPHEME_LIMIT for post in layout)
+    assert mentioned_handles(layout) == handles + ['reminder.bsky.social', 'author.bsky.social']
+    for post in layout:
+        for start, end, handle in post['mentions']:
+            assert post['text'].encode()[start:end].decode() == '@' + handle
+
+
+def test_emoji_fit_by_graphemes():
+    """Test that a part of 150 family emoji, 750 code points, still fits into one post"""
+    family = '\U0001F468\u200d\U0001F469\u200d\U0001F467' * 150
+    assert len(layout_thread([(family, None), (family, None)])) == 1
+    assert len(layout_thread([(family, None), (family, None), ('x', None)])) == 2